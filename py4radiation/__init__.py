@@ -1,17 +1,37 @@
 """
-py4radiation is a python-based package that includes 
+py4radiation is a python-based package that includes
 radiation effects into wind-cloud simulations.
 
 Please visit our research group's website:
 https://cphysplus.github.io/
 """
 
-from .simload import simload
-from .radiation.prepare_sed import SED
-from .radiation.parfiles import ParameterFiles
-from .radiation.ion_tables import IonTables
-from .radiation.hc_rates import HeatingCoolingRates
-from .synthetic.observables import SyntheticObservables
-from .clouds.diagnose import Diagnose
+import importlib
+
+# simload defers vtk to its first call; it is imported here because
+# the submodule of the same name would otherwise shadow the function
+from .simload import simload, VTKSlabReader
+
+# public names and their modules, imported on first access so that
+# importing the package (or running mode 1) does not load yt or trident
+_lazy = {
+    'SED':                  '.radiation.prepare_sed',
+    'ParameterFiles':       '.radiation.parfiles',
+    'IonTables':            '.radiation.ion_tables',
+    'HeatingCoolingRates':  '.radiation.hc_rates',
+    'SyntheticObservables': '.synthetic.observables',
+    'Diagnose':             '.clouds.diagnose',
+}
+
+def __getattr__(name):
+    if name in _lazy:
+        value = getattr(importlib.import_module(_lazy[name], __name__), name)
+        globals()[name] = value
+        return value
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy))
 
 __all__ = ['main', 'simload']
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import os
+
+class SerialBackend():
+    """
+
+    Run analysis units one after the other in this process
+
+    """
+
+    root = True
+    rank = 0
+
+    def run(self, units, func, callback=None):
+        """
+
+        Run func on every unit, calling callback(unit, result) with each result
+
+        """
+        for unit in units:
+            result = func(unit)
+            if callback is not None:
+                callback(unit, result)
+
+    def bcast(self, value):
+        return value
+
+    def shared_arrays(self):
+        """
+
+        Store of read-only arrays shared by the processes of the run
+        (none for a single process)
+
+        """
+        return None
+
+class ProcessBackend():
+    """
+
+    Run analysis units on a pool of local processes, without MPI
+
+    :workers: int, optional
+
+        Number of worker processes (default: all local cores)
+
+    """
+
+    root = True
+    rank = 0
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+
+    def run(self, units, func, callback=None):
+        """
+
+        Run func on every unit, calling callback(unit, result) in this
+        process as results arrive
+        func and the results must be picklable
+
+        """
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(func, unit): unit for unit in units}
+            for future in as_completed(futures):
+                result = future.result()
+                if callback is not None:
+                    callback(futures[future], result)
+
+    def bcast(self, value):
+        return value
+
+    def shared_arrays(self):
+        from .shared import ProcessArrays
+        return ProcessArrays()
+
+class MPIBackend():
+    """
+
+    Run analysis units over MPI ranks with dynamic scheduling
+    (see TaskScheduler); callbacks run on rank 0
+
+    """
+
+    def __init__(self):
+        from mpi4py import MPI
+        from .scheduler import TaskScheduler
+
+        self.comm = MPI.COMM_WORLD
+        self.rank = self.comm.Get_rank()
+        self.root = self.rank == 0
+        self.scheduler = TaskScheduler(self.comm)
+
+    def run(self, units, func, callback=None):
+        self.scheduler.run(units, func, callback)
+
+    def bcast(self, value):
+        """
+
+        Broadcast a value computed on rank 0
+
+        """
+        return self.comm.bcast(value, root=0)
+
+    def shared_arrays(self):
+        """
+
+        Node-local store of read-only arrays (collective)
+
+        """
+        from .shared import NodeArrays
+        return NodeArrays(self.comm)
+
+def get_backend(name, workers=None):
+    """
+
+    Get an execution backend
+
+    :name: string, serial, processes or mpi
+
+    :workers: int, optional, number of processes for processes
+
+    """
+    if name == 'serial':
+        return SerialBackend()
+    elif name == 'processes':
+        return ProcessBackend(workers)
+    elif name == 'mpi':
+        return MPIBackend()
+    else:
+        raise ValueError(f'Error: unknown backend {name}')
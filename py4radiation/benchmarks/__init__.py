@@ -0,0 +1,3 @@
+#!/usr/bin/env python3
+
+__all__ = ['generate', 'run']
\ No newline at end of file
@@ -0,0 +1,5 @@
+#!/usr/bin/env python3
+
+from .run import main
+
+main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import os
+import numpy as np
+
+def cloud_fields(shape, t=0.0, chi=100.0, radius=None, vwind=1.0, seed=0):
+    """
+
+    Scalar/vector fields of a cloud in a wind, in the layout of simload
+
+    The cloud sits near the bottom of the box, is pushed along y by the
+    wind and stretched with time, with a noisy turbulent mixing layer
+
+    :shape: tuple
+
+        Dimensions of the computational box
+
+    :t: float, optional
+
+        Time in cloud-crushing units, from 0 (spherical cloud) to ~1
+
+    :chi: float, optional
+
+        Cloud to wind density contrast
+
+    :radius: float, optional
+
+        Cloud radius in cells (default: 1/8 of the x size)
+
+    :vwind: float, optional
+
+        Wind speed in code units
+
+    :seed: int, optional
+
+        Seed of the velocity and density perturbations
+
+    :return: [rho, tr1, prs, vx1, vx2, vx3] float32 arrays
+
+    """
+    nx, ny, nz = shape
+    rng = np.random.default_rng(seed)
+
+    if radius is None:
+        radius = nx / 8
+
+    x = np.arange(nx) - nx / 2 + 0.5
+    y = np.arange(ny) + 0.5
+    z = np.arange(nz) - nz / 2 + 0.5
+
+    # stretched along the wind, flattened across it, moving downstream
+    yc = ny / 8 + t * ny / 2
+    ry = radius * (1 + 2 * t)
+    rxz = radius / (1 + t)
+
+    r = np.sqrt((x.reshape(-1, 1, 1) / rxz)**2 + ((y.reshape(1, -1, 1) - yc) / ry)**2 + (z.reshape(1, 1, -1) / rxz)**2)
+    r = r * (1 + 0.2 * t * rng.standard_normal(shape))
+
+    tr1 = 0.5 * (1 - np.tanh((r - 1) * 10))
+    rho = 1 + (chi - 1) * tr1
+    prs = np.full(shape, 1 / 1.6667)
+
+    vx1 = 0.02 * vwind * rng.standard_normal(shape) * tr1
+    vx2 = vwind * (1 - tr1) + t * vwind * 0.3 * tr1
+    vx3 = 0.02 * vwind * rng.standard_normal(shape) * tr1
+
+    return [np.asfortranarray(f, dtype=np.float32) for f in [rho, tr1, prs, vx1, vx2, vx3]]
+
+def write_vtk(filename, fields, time=0.0):
+    """
+
+    Write fields to a legacy binary VTK file in the PLUTO layout
+    (rectilinear grid, big-endian float32 cell scalars)
+
+    :filename: string, path to the VTK file
+
+    :fields: list, [rho, tr1, prs, vx1, vx2, vx3] arrays
+
+    :time: float, optional, simulation time in the header
+
+    """
+    nx, ny, nz = fields[0].shape
+
+    with open(filename, 'wb') as f:
+        f.write(b'# vtk DataFile Version 2.0\nPLUTO 4.4 VTK Data\nBINARY\nDATASET RECTILINEAR_GRID\n')
+        f.write(b'FIELD FieldData 1\nTIME 1 1 double\n')
+        f.write(np.array([time], dtype='>f8').tobytes() + b'\n')
+        f.write(f'DIMENSIONS {nx + 1} {ny + 1} {nz + 1}\n'.encode())
+
+        for axis, n, lo in [('X', nx, -nx / 2), ('Y', ny, 0), ('Z', nz, -nz / 2)]:
+            f.write(f'{axis}_COORDINATES {n + 1} float\n'.encode())
+            f.write((lo + np.arange(n + 1)).astype('>f4').tobytes() + b'\n')
+
+        f.write(f'CELL_DATA {nx * ny * nz}\n'.encode())
+        for name, field in zip(['rho', 'tr1', 'prs', 'vx1', 'vx2', 'vx3'], fields):
+            f.write(f'SCALARS {name} float\nLOOKUP_TABLE default\n'.encode())
+            f.write(np.ravel(field, order='F').astype('>f4').tobytes() + b'\n')
+
+def write_series(path, shape, nsnap, seed=0):
+    """
+
+    Write a series of snapshots data.NNNN.vtk of a cloud in a wind
+
+    :path: string, output directory
+
+    :shape: tuple, dimensions of the computational box
+
+    :nsnap: int, number of snapshots
+
+    :return: list of paths
+
+    """
+    os.makedirs(path, exist_ok=True)
+
+    files = []
+    for k in range(nsnap):
+        t = k / max(nsnap - 1, 1)
+        filename = os.path.join(path, f'data.{k:04d}.vtk')
+        write_vtk(filename, cloud_fields(shape, t, seed=seed + k), t)
+        files.append(filename)
+
+    return files
+
+def write_runfile(filename, parameters):
+    """
+
+    Write a CIAOLoop .run file for a grid of parameter values
+
+    :parameters: dict, loop parameter name -> list of values
+
+    :return: number of runs
+
+    """
+    grid = np.meshgrid(*parameters.values(), indexing='ij')
+    nruns = grid[0].size
+
+    lines = ['# CIAOLoop run file (synthetic)', '# Loop commands and values']
+    lines += [f'# {name}: ' + ' '.join(f'{v:g}' for v in values) for name, values in parameters.items()]
+    lines += ['#', '#run\t' + '\t'.join(parameters)]
+    for j in range(nruns):
+        lines.append(f'{j + 1}\t' + '\t'.join(f'{g.ravel()[j]:g}' for g in grid))
+
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines))
+
+    return nruns
+
+def write_ib_tree(path, prefix, elements, resolution='LOW', z=0.0, seed=0):
+    """
+
+    Write a synthetic CIAOLoop ion fraction output tree: a .run file over
+    hden and redshift (init) and one map per run and element with
+    log T and log ion fractions, as read by IonTables
+
+    :elements: list, element symbols, e.g. ['H', 'O']
+
+    :resolution: string, LOW or HIGH (as in ParameterFiles)
+
+    :return: name of the .run file
+
+    """
+    nT, dhden = (81, 0.5) if resolution == 'LOW' else (321, 0.125)
+    charges = {'H': 1, 'He': 2, 'C': 6, 'N': 7, 'O': 8, 'Ne': 10, 'Mg': 12, 'Si': 14, 'S': 16, 'Fe': 26}
+
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    hden = np.arange(-9, 4 + dhden / 2, dhden)
+    runfile = prefix + '.run'
+    nruns = write_runfile(os.path.join(path, runfile), {'hden': hden, 'init': [z, z + 1e-4]})
+
+    logT = np.linspace(1, 9, nT)
+    for element in elements:
+        nions = charges.get(element, 8) + 1
+        for j in range(nruns):
+            # ionisation peaks moving with T, normalised to sum to 1
+            peaks = np.linspace(4, 8, nions)
+            frac = np.exp(-((logT.reshape(-1, 1) - peaks) / 0.3)**2) + 1e-12 * (1 + rng.random((nT, nions)))
+            frac /= frac.sum(axis=1, keepdims=True)
+
+            data = np.column_stack([10**logT, np.log10(frac)])
+            np.savetxt(os.path.join(path, f'{prefix}_run{j + 1}_{element}.dat'), data,
+                       header='Te ' + ' '.join(f'{element}{i + 1}' for i in range(nions)), fmt='%.6e')
+
+    return runfile
+
+def write_hc_tree(path, prefix, resolution='LOW'):
+    """
+
+    Write a synthetic CIAOLoop heating & cooling output tree: a .run file
+    over hden and one map per run with T, heating and cooling,
+    as read by HeatingCoolingRates
+
+    :resolution: string, LOW or HIGH (as in ParameterFiles)
+
+    :return: name of the .run file
+
+    """
+    nT, dhden = (81, 0.5) if resolution == 'LOW' else (321, 0.125)
+
+    os.makedirs(path, exist_ok=True)
+
+    hden = np.arange(-9, 4 + dhden / 2, dhden)
+    runfile = prefix + '.run'
+    nruns = write_runfile(os.path.join(path, runfile), {'hden': hden})
+
+    T = np.logspace(1, 9, nT)
+    for j in range(nruns):
+        cooling = 1e-22 * np.exp(-((np.log10(T) - 5.3) / 1.0)**2) + 1e-27 * np.sqrt(T)
+        heating = 1e-25 * 10**(-0.3 * hden[j]) * np.ones(nT)
+        np.savetxt(os.path.join(path, f'{prefix}_run{j + 1}.dat'), np.column_stack([T, heating, cooling]),
+                   header='Te Heating Cooling', fmt='%.6e')
+
+    return runfile
+
+def write_sed(filename, nwave=2000, nages=36):
+    """
+
+    Write a Starburst99-like SED file (header removed): wavelength in
+    Angstroms and log luminosity in erg s^-1 A^-1 for each age, as read by SED
+
+    :nwave: int, number of wavelengths
+
+    :nages: int, number of ages (columns after the wavelength)
+
+    """
+    # includes the wavelength of 1 Ryd for the normalisation
+    wavelength = np.unique(np.concatenate([np.logspace(np.log10(91), np.log10(1.6e6), nwave), [909.0]]))
+
+    ages = np.linspace(0, 1, nages)
+    blackbody = 1 / (wavelength.reshape(-1, 1)**5 * (np.exp(1.4388e8 / (wavelength.reshape(-1, 1) * 4e4 * (1 - 0.5 * ages))) - 1) + 1e-300)
+
+    loglum = 40 - 2 * ages + np.log10(blackbody / blackbody.max(axis=0))
+    np.savetxt(filename, np.column_stack([wavelength, np.maximum(loglum, 0)]), fmt='%.6e')
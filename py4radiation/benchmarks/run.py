@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+from .generate import cloud_fields, write_vtk, write_ib_tree, write_hc_tree, write_sed
+
+# ions and code units of the observables benchmarks
+IONS  = np.array([['H', '1', 'I'], ['O', '6', 'VI']])
+UNITS = np.array([1.67e-25, 1.67e-25 * 1e14, 1e7, 3.086e18])
+
+def best_of(func, repeat):
+    """
+
+    Best wall time of repeat calls of func
+
+    """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+
+    return min(times)
+
+def snapshot(workdir, n):
+    """
+
+    Synthetic snapshot of a (n, 2n, n) box in workdir, written once per size
+
+    """
+    filename = os.path.join(workdir, f'bench_{n}.vtk')
+    if not os.path.isfile(filename):
+        write_vtk(filename, cloud_fields((n, 2 * n, n), t=0.5), 0.5)
+
+    return filename
+
+def load(workdir, n):
+    from ..simload import VTKSlabReader
+
+    reader = VTKSlabReader(snapshot(workdir, n))
+    return reader.slab(0, reader.shape[2]), reader.shape
+
+def bench_simload(workdir, n, repeat):
+    from ..simload import simload
+
+    filename = snapshot(workdir, n)
+    return best_of(lambda: simload(filename), repeat)
+
+def bench_slab_reader(workdir, n, repeat):
+    from ..simload import VTKSlabReader
+
+    filename = snapshot(workdir, n)
+
+    def read():
+        for _ in VTKSlabReader(filename).slabs(2**26):
+            pass
+
+    return best_of(read, repeat)
+
+def bench_diagnose(workdir, n, repeat):
+    from ..clouds.diagnose import Diagnose
+    from ..clouds.cloud_diagnostics import CloudDiagnostics
+
+    fields, shape = load(workdir, n)
+    diagnose = Diagnose(fields, shape)
+
+    return best_of(lambda: CloudDiagnostics(diagnose.j3D, diagnose.dV, diagnose.M0).diagnose(fields), repeat)
+
+def bench_cuts(workdir, n, repeat):
+    from ..clouds.cloud_cuts import CloudCuts
+    from ..writer import flush
+
+    fields, shape = load(workdir, n)
+
+    # every stored quantity is its own field (constant fields 1, 2, ...)
+    planes = [np.full((2, 2), i + 1.0) for i in range(len(CloudCuts.fieldnames))]
+    for i, name in enumerate(CloudCuts.fieldnames):
+        if not np.all(CloudCuts(planes, shape, 'bench').quantity(name, planes) == i + 1):
+            raise ValueError(f'Error: cut of {name} is not the {name} field')
+
+    def cuts():
+        cuts = CloudCuts(fields, shape, 'bench')
+        cuts.get_ncuts()
+        cuts.get_vcuts()
+        flush()
+
+    return best_of(cuts, repeat)
+
+def ion_table(workdir):
+    from ..radiation.ion_tables import IonTables
+
+    table = os.path.join(workdir, 'bench_ions.h5')
+    if not os.path.isfile(table):
+        path = os.path.join(workdir, 'ib_table') + '/'
+        IonTables(path, write_ib_tree(path, 'bench_ib', ['H', 'O']), table, ['H', 'O']).get_ion_tables()
+    return table
+
+def bench_column_density(workdir, n, repeat):
+    from ..synthetic.observables import SyntheticObservables
+    from ..synthetic.column_density import ColumnDensity
+    from ..writer import flush
+
+    table = ion_table(workdir)
+
+    fields, shape = load(workdir, n)
+    ions, units = IONS, UNITS
+
+    observables = SyntheticObservables('bench', fields, shape, ions, units, ionization_table=table)
+
+    def project():
+        cols = ColumnDensity('bench', observables.ds, shape, ions)
+        cols.projXZ()
+        cols.projYZ()
+        flush()
+
+    return best_of(project, repeat)
+
+def bench_shared_tables(workdir, n, repeat):
+    """
+
+    Ion fraction fields of Trident from the shared ion tables; fails
+    if Trident opens the table instead of using the shared arrays
+
+    """
+    import h5py
+    from trident import ion_balance
+    from ..shared import ProcessArrays, share_ion_tables, use_ion_tables
+    from ..synthetic.observables import SyntheticObservables
+
+    table = ion_table(workdir)
+    fields, shape = load(workdir, n)
+
+    shared = ProcessArrays()
+    share_ion_tables(shared, table, ['H', 'O'])
+
+    opened = []
+    h5file = h5py.File
+
+    def open_file(name, *args, **kwargs):
+        if isinstance(name, (str, os.PathLike)) and os.path.abspath(name) == os.path.abspath(table):
+            opened.append(name)
+        return h5file(name, *args, **kwargs)
+
+    def fractions():
+        ion_balance.table_store.clear()
+        use_ion_tables(shared, IONS)
+
+        observables = SyntheticObservables('bench', fields, shape, IONS, UNITS, ionization_table=table)
+        ad = observables.ds.all_data()
+        for row in IONS:
+            ad[('gas', f'{row[0]}_p{int(row[1]) - 1}_ion_fraction')]
+
+    h5py.File = open_file
+    try:
+        seconds = best_of(fractions, repeat)
+    finally:
+        h5py.File = h5file
+        ion_balance.table_store.clear()
+        shared.close()
+
+    if opened:
+        raise ValueError('Error: Trident opened the ion table instead of using the shared ion fractions')
+
+    return seconds
+
+def bench_emission(workdir, n, repeat):
+    from ..radiation.hc_rates import HeatingCoolingRates
+    from ..synthetic.emission import RateTable, EmissionMaps
+    from ..writer import flush
+
+    table = os.path.join(workdir, 'bench_hc_emission.dat')
+    if not os.path.isfile(table):
+        path = os.path.join(workdir, 'hc_emission') + '/'
+        HeatingCoolingRates(path, write_hc_tree(path, 'bench_hc', 'LOW'), table).get_hc_rates()
+
+    fields, shape = load(workdir, n)
+    rho = fields[0] * 1.67e-25
+    T   = fields[2] / fields[0] * 1e14 * 0.6724418 * 1.660e-24 / 1.380e-16
+    tables = [RateTable(table, ['COOLING'])]
+
+    def project():
+        maps = EmissionMaps('bench', rho, T, [3.086e18, 3.086e18], tables)
+        maps.write_maps(maps.project())
+        flush()
+
+    return best_of(project, repeat)
+
+def bench_spectra(workdir, nspectra, repeat):
+    from ..synthetic.spectra import SpectralBatch, SpectralProcessing
+
+    # Gaussian absorbers on the 1 km/s grid of MockSpectra, rays x 8 ions,
+    # labelled from an ions array as in the pipeline
+    rng = np.random.default_rng(0)
+    v = np.arange(-500, 1, 1.0)
+    centre = rng.uniform(-400, -100, (nspectra, 1))
+    tau = rng.uniform(0.01, 3, (nspectra, 1)) * np.exp(-((v - centre) / rng.uniform(5, 40, (nspectra, 1)))**2)
+
+    ions = np.array([['H', '1', 'I'], ['C', '2', 'II'], ['C', '4', 'IV'], ['N', '5', 'V'],
+                     ['O', '6', 'VI'], ['Si', '3', 'III'], ['Si', '4', 'IV'], ['Mg', '2', 'II']])
+    labels = [f'{row[0]}{row[2]}' for row in ions]
+
+    nrays = nspectra // len(ions)
+    batch = SpectralBatch('0000', v, np.exp(-tau).reshape(nrays, len(ions), -1), tau.reshape(nrays, len(ions), -1),
+                          [str(i) for i in range(nrays)], labels)
+    processing = SpectralProcessing(lsf=20, snr=30, rebin=3)
+
+    missing = [ion for ion in labels if ion not in processing.lines]
+    if missing:
+        raise ValueError(f'Error: no line data of {missing} for column densities')
+
+    return best_of(lambda: processing.process(batch), repeat)
+
+def bench_pyramid(workdir, size, repeat):
+    """
+
+    Diagnostics at a downsampling level of the pyramid, with the
+    relative error of the quantities that are resolved (see Diagnose)
+
+    """
+    from ..clouds.diagnose import Diagnose
+    from ..pyramid import Pyramid
+
+    n, level = size
+    fields, shape = load(workdir, n)
+    pyramid = Pyramid(fields, [level] if level > 1 else [])
+
+    def values(diagnose):
+        avs, v_avs, fmix, j_cm, j_sg, v_sg = diagnose.get_sim_diagnostics(pyramid)
+        return np.array([avs[0], avs[1], avs[2], fmix, j_cm[1], j_sg[0], j_sg[1], j_sg[2], v_sg[1]])
+
+    diagnose = Diagnose(fields, shape, level=level)
+    seconds  = best_of(lambda: values(diagnose), repeat)
+
+    full = values(Diagnose(fields, shape))
+    errors = np.abs(values(diagnose) - full) / np.abs(full)
+
+    names = ['n', 'T', 'v', 'fmix', 'y_CM', 'x_sg', 'y_sg', 'z_sg', 'vy_sg']
+    return seconds, {'errors': dict(zip(names, errors.tolist()))}
+
+def bench_ion_tables(workdir, resolution, repeat):
+    from ..radiation.ion_tables import IonTables
+
+    path = os.path.join(workdir, f'ib_{resolution}') + '/'
+    runfile = write_ib_tree(path, 'bench_ib', ['H', 'O'], resolution)
+    outfile = os.path.join(workdir, f'bench_ib_{resolution}.h5')
+
+    def tables():
+        if os.path.isfile(outfile):
+            os.remove(outfile)
+        IonTables(path, runfile, outfile, ['H', 'O']).get_ion_tables()
+
+    return best_of(tables, repeat)
+
+def bench_hc_rates(workdir, resolution, repeat):
+    from ..radiation.hc_rates import HeatingCoolingRates
+
+    path = os.path.join(workdir, f'hc_{resolution}') + '/'
+    runfile = write_hc_tree(path, 'bench_hc', resolution)
+    outfile = os.path.join(workdir, f'bench_hc_{resolution}.dat')
+
+    return best_of(lambda: HeatingCoolingRates(path, runfile, outfile).get_hc_rates(), repeat)
+
+def bench_sed(workdir, nwave, repeat):
+    from ..radiation.prepare_sed import SED
+
+    sedfile = os.path.join(workdir, f'bench_sed_{nwave}.dat')
+    write_sed(sedfile, nwave)
+
+    return best_of(lambda: SED(os.path.join(workdir, 'bench'), sedfile, 1.0, '0.0000e+00').getFile(), repeat)
+
+def bench_startup(workdir, command, repeat):
+    """
+
+    Start-up of a fresh interpreter: importing the package, or running
+    the CLI in mode 1 to write a SED file
+
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env  = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+
+    if command == 'import':
+        args = [sys.executable, '-c', 'import py4radiation']
+    else:
+        sedfile = os.path.join(workdir, 'bench_sed_startup.dat')
+        write_sed(sedfile)
+
+        config = os.path.join(workdir, 'bench_mode1.ini')
+        with open(config, 'w') as f:
+            f.write(f'[MODE]\nmode = 1\n\n[RADIATION]\nrun_name = bench\nredshift = 0.0000e+00\n'
+                    f'sedfile = {sedfile}\ndistance = 1.0\nage = 1\n')
+
+        args = [sys.executable, '-m', 'py4radiation.main', '-f', config]
+
+    return best_of(lambda: subprocess.run(args, env=env, check=True, stdout=subprocess.DEVNULL), repeat)
+
+def snapshot_work(n):
+    return n * 2 * n * n
+
+def table_work(resolution):
+    # number of CIAOLoop runs times temperatures
+    return (27 * 81) if resolution == 'LOW' else (105 * 321)
+
+# name: (function, size axis, work of a size)
+BENCHMARKS = {
+    'simload':                        (bench_simload, 'snapshot', snapshot_work),
+    'VTKSlabReader.slabs':            (bench_slab_reader, 'snapshot', snapshot_work),
+    'CloudDiagnostics.diagnose':      (bench_diagnose, 'snapshot', snapshot_work),
+    'CloudCuts':                      (bench_cuts, 'snapshot', snapshot_work),
+    'ColumnDensity':                  (bench_column_density, 'snapshot', snapshot_work),
+    'use_ion_tables':                 (bench_shared_tables, 'snapshot', snapshot_work),
+    'EmissionMaps':                   (bench_emission, 'snapshot', snapshot_work),
+    'IonTables.get_ion_tables':       (bench_ion_tables, 'table', table_work),
+    'HeatingCoolingRates.get_hc_rates': (bench_hc_rates, 'table', table_work),
+    'SED.getFile':                    (bench_sed, 'sed', lambda nwave: nwave),
+    'startup':                        (bench_startup, 'startup', lambda command: 1),
+    'pyramid':                        (bench_pyramid, 'level', lambda size: snapshot_work(size[0]) // size[1]**3),
+    'SpectralProcessing':             (bench_spectra, 'spectra', lambda nspectra: nspectra),
+}
+
+def scaling(rows):
+    """
+
+    Exponent a of a fit time ~ work^a over the sizes of a benchmark
+
+    """
+    points = [(row['work'], row['seconds']) for row in rows if row.get('seconds')]
+    if len(set(work for work, _ in points)) < 2:
+        return None
+
+    work, seconds = np.log(np.array(points)).T
+    return float(np.polyfit(work, seconds, 1)[0])
+
+def run(names=None, sizes=(32, 64, 128), resolutions=('LOW', 'HIGH'), nwaves=(2000, 20000, 200000), repeat=3, workdir=None):
+    """
+
+    Run the benchmarks and get the timings across sizes
+
+    :names: list, optional, benchmarks to run (default: all)
+
+    :sizes: list, snapshot sizes n of (n, 2n, n) boxes
+
+    :resolutions: list, CIAOLoop grid resolutions (LOW, HIGH)
+
+    :nwaves: list, number of wavelengths of the SED files
+
+    :repeat: int, the best of repeat runs is kept
+
+    :workdir: string, optional, directory for the synthetic inputs and
+              outputs (default: a temporary directory)
+
+    :return: dict, benchmark -> {'rows': [...], 'exponent': float}
+
+    """
+    axes = {'snapshot': sizes, 'table': resolutions, 'sed': nwaves, 'startup': ['import', 'mode1'],
+            'level': [(max(sizes), level) for level in [1, 2, 4, 8]], 'spectra': [256, 1024, 4096]}
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = os.path.abspath(workdir or tmpdir)
+        os.makedirs(workdir, exist_ok=True)
+
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for name in names or BENCHMARKS:
+                func, axis, work = BENCHMARKS[name]
+
+                rows = []
+                for size in axes[axis]:
+                    row = {'size': size, 'work': work(size)}
+                    try:
+                        seconds = func(workdir, size, repeat)
+                        if isinstance(seconds, tuple):
+                            seconds, extra = seconds
+                            row.update(extra)
+                        row['seconds'] = seconds
+                        row['throughput'] = row['work'] / row['seconds']
+                    except ImportError as e:
+                        row['skipped'] = f'missing dependency: {e.name}'
+                        rows.append(row)
+                        break
+                    rows.append(row)
+
+                results[name] = {'rows': rows, 'exponent': scaling(rows)}
+        finally:
+            os.chdir(cwd)
+
+    return results
+
+def report(results, out=sys.stdout):
+    """
+
+    Print a table of the timings and scaling exponents
+
+    """
+    out.write(f'{"benchmark":34s} {"size":>8s} {"work":>12s} {"seconds":>10s} {"work/s":>12s}\n')
+    for name, result in results.items():
+        for row in result['rows']:
+            if 'skipped' in row:
+                out.write(f'{name:34s} {str(row["size"]):>8s} {row["skipped"]}\n')
+            else:
+                out.write(f'{name:34s} {str(row["size"]):>8s} {row["work"]:12d} {row["seconds"]:10.4f} {row["throughput"]:12.4e}\n')
+            if 'errors' in row:
+                out.write(f'{"":34s} relative error: ' + ' '.join(f'{key} {value:.3f}' for key, value in row['errors'].items()) + '\n')
+        if result['exponent'] is not None:
+            out.write(f'{name:34s} scaling: time ~ work^{result["exponent"]:.2f}\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m py4radiation.benchmarks',
+                                     description='Time py4radiation on synthetic inputs across sizes')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default: all): ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[32, 64, 128], help='snapshot sizes n of (n, 2n, n) boxes')
+    parser.add_argument('--resolutions', nargs='+', default=['LOW', 'HIGH'], help='CIAOLoop grid resolutions')
+    parser.add_argument('--nwaves', nargs='+', type=int, default=[2000, 20000, 200000], help='wavelengths of the SED files')
+    parser.add_argument('--repeat', type=int, default=3, help='keep the best of REPEAT runs')
+    parser.add_argument('--workdir', help='keep the synthetic inputs and outputs in WORKDIR')
+    parser.add_argument('--json', help='write the results to JSON')
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'unknown benchmarks {unknown}')
+
+    results = run(args.names, args.sizes, args.resolutions, args.nwaves, args.repeat, args.workdir)
+    report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
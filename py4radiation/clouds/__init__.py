@@ -1,3 +1,3 @@
 #!/usr/bin/env python3
 
-__all__ = ['cloud_cuts', 'cloud_diagnostics', 'diagnose']
\ No newline at end of file
+__all__ = ['cloud_cuts', 'cloud_diagnostics', 'diagnose', 'clumps']
\ No newline at end of file
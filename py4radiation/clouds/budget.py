@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import copy
+import numpy as np
+
+class MassBudget():
+    """
+
+    Mass flux of cloud gas through y planes and cloud mass binned in
+    vy and in T of a simulation file, filled during the fused pass of
+    CloudDiagnostics from the arrays it computes
+
+    The flux through a plane is the sum of rho * tr1 * vy over its
+    cells (net, and of the cells with vy > 0 only), from a reduction
+    of every slab along x and z; the masses are bincounts of rho * tr1
+    Bins are fixed: linear vy bins in km/s and log10 T bins, with
+    bin 0 and the last bin collecting values below and above the range
+
+    :planes: list, optional
+
+        Indices of the y planes of the fluxes (default: 10 planes
+        evenly spaced along y, set with the shape of the box)
+
+    :vy_range: tuple, optional
+
+        Limits of the vy bins in km/s
+
+    :vy_bin: float, optional
+
+        Width of the vy bins in km/s
+
+    :T_range: tuple, optional
+
+        log10 limits of the T bins
+
+    :bins_per_dex: int, optional
+
+        Number of T bins per dex
+
+    """
+
+    def __init__(self, planes=None, vy_range=(-500, 1500), vy_bin=20, T_range=(2, 9), bins_per_dex=10):
+        self.planes = None if planes is None else np.array(planes, dtype=np.intp)
+        self.edges = {
+            'vy': np.linspace(*vy_range, int(round((vy_range[1] - vy_range[0]) / vy_bin)) + 1),
+            'T':  np.linspace(*T_range, int(round((T_range[1] - T_range[0]) * bins_per_dex)) + 1)
+        }
+
+        self.flux    = None
+        self.outflux = None
+        self.mass_vy = np.zeros(len(self.edges['vy']) + 1)
+        self.mass_T  = np.zeros(len(self.edges['T']) + 1)
+
+    def spec(self):
+        """
+
+        Planes and bins of the budget as a tuple (e.g. for a run manifest)
+
+        """
+        planes = None if self.planes is None else self.planes.tolist()
+        return (planes,) + tuple((var, float(edges[0]), float(edges[-1]), len(edges) - 1) for var, edges in self.edges.items())
+
+    def empty(self, ny):
+        """
+
+        Empty budget with the planes and bins of this object, for a
+        box of ny cells along y
+
+        """
+        budget = copy.copy(self)
+        if budget.planes is None:
+            budget.planes = np.unique(np.linspace(0, ny - 1, 10).astype(np.intp))
+        if budget.planes.min() < 0 or budget.planes.max() >= ny:
+            raise ValueError(f'Error: flux planes outside of the {ny} y planes of the box')
+
+        budget.flux    = np.zeros(len(budget.planes))
+        budget.outflux = np.zeros(len(budget.planes))
+        budget.mass_vy = np.zeros_like(self.mass_vy)
+        budget.mass_T  = np.zeros_like(self.mass_T)
+        return budget
+
+    def index(self, var, values, log=False):
+        """
+
+        Bin indices of values, including the under/overflow bins
+
+        """
+        edges = self.edges[var]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            idx = np.log10(values) if log else np.array(values, dtype=np.float64)
+
+        idx -= edges[0]
+        idx *= (len(edges) - 1) / (edges[-1] - edges[0])
+        idx += 1
+        np.clip(idx, 0, len(edges), out=idx)
+        idx[np.isnan(idx)] = 0
+
+        return idx.astype(np.intp)
+
+    def accumulate(self, w, vy, T, shape, j0=0):
+        """
+
+        Add the cells of a slab to the budget
+
+        :w, vy, T: numpy arrays, rho * tr1, vy and T of the cells
+                   (flattened in F order)
+
+        :shape: tuple, shape of the slab
+
+        :j0: int, index of the first y plane of the slab
+
+        """
+        self.bins(w, vy, T)
+
+        # planar reduction along x and z of the planes within the slab
+        inside = (self.planes >= j0) & (self.planes < j0 + shape[1])
+        if inside.any():
+            wvy = (w * vy).reshape(shape, order='F')[:, self.planes[inside] - j0, :]
+            self.flux[inside]    += wvy.sum(axis=(0, 2))
+            self.outflux[inside] += np.maximum(wvy, 0).sum(axis=(0, 2))
+
+    def accumulate_cells(self, w, vy, T, iy):
+        """
+
+        Add gathered cells to the budget
+
+        :w, vy, T: numpy arrays, rho * tr1, vy and T of the cells
+
+        :iy: numpy array, y plane of the cells
+
+        """
+        self.bins(w, vy, T)
+
+        # cells of the planes, summed per plane
+        lookup = np.full(max(int(self.planes.max()), int(iy.max(initial=0))) + 1, -1, dtype=np.intp)
+        lookup[self.planes] = np.arange(len(self.planes))
+        plane = lookup[iy]
+        cells = plane >= 0
+
+        wvy = w[cells] * vy[cells]
+        self.flux    += np.bincount(plane[cells], weights=wvy, minlength=len(self.planes))
+        self.outflux += np.bincount(plane[cells], weights=np.maximum(wvy, 0), minlength=len(self.planes))
+
+    def bins(self, w, vy, T):
+        self.mass_vy += np.bincount(self.index('vy', vy / 1e5), weights=w, minlength=len(self.mass_vy))
+        self.mass_T  += np.bincount(self.index('T', T, log=True), weights=w, minlength=len(self.mass_T))
+
+    def update(self, other):
+        """
+
+        Add the budget of another part of the box
+
+        """
+        self.flux    += other.flux
+        self.outflux += other.outflux
+        self.mass_vy += other.mass_vy
+        self.mass_T  += other.mass_T
+
+    def merge(self, comm):
+        """
+
+        Sum the budgets of all MPI ranks of comm into rank 0
+        (e.g. the parts of a box split among ranks)
+
+        """
+        from mpi4py import MPI
+
+        for arr in [self.flux, self.outflux, self.mass_vy, self.mass_T]:
+            if comm.Get_rank() == 0:
+                comm.Reduce(MPI.IN_PLACE, arr, op=MPI.SUM, root=0)
+            else:
+                comm.Reduce(arr, None, op=MPI.SUM, root=0)
+
+    def write(self, filename, y, dV):
+        """
+
+        Write the budget of a simulation file to HDF5: fluxes through
+        the planes and masses per bin, in code units (mass dV, flux
+        dV^(2/3) cm/s); bin edges are attributes of the datasets, bin 0
+        and the last bin are the under/overflow bins
+
+        :y: numpy array, y coordinates of the planes of the box
+
+        :dV: float, volume element of the cells
+
+        """
+        import h5py
+
+        with h5py.File(filename, 'w') as f:
+            f.create_dataset('planes', data=self.planes)
+            f.create_dataset('y', data=np.asarray(y)[self.planes])
+            f.create_dataset('flux', data=self.flux * dV**(2 / 3))
+            f.create_dataset('outflux', data=self.outflux * dV**(2 / 3))
+            f.create_dataset('mass_vy', data=self.mass_vy * dV)
+            f.create_dataset('mass_T', data=self.mass_T * dV)
+            f['mass_vy'].attrs['edges'] = self.edges['vy']
+            f['mass_T'].attrs['edges'] = self.edges['T']
+            f['mass_T'].attrs['log'] = True
@@ -3,28 +3,72 @@
 import os
 import numpy as np
 
+from ..writer import get_writer, write_table
+
 class CloudCuts():
     """
 
-    Create velocity and number density cuts from a VTK simulation file
+    Create cuts of number density, velocity and other quantities
+    from a VTK simulation file on planes along any axis
+
+    Fields are only sliced on the planes of the cuts; derived
+    quantities are computed on the 2D planes
 
     :fields: numpy array
 
-        Scalar/vector fields from a VTK simulation file
+        Scalar/vector fields from a VTK simulation file, or a part
+        of them along the axis of the cuts (see offset)
 
     :shape: tuple
 
         Shape of the computational box of the simulation file
 
+    :nsim: string
+
+        Number of the simulation file to label output files
+
+    :axis: string, optional
+
+        x, y or z, axis normal to the planes of the cuts
+
+    :positions: list, optional
+
+        Indices of the planes along axis in the computational box
+        (default: the z mid-plane, written as {nsim}_ncut.dat and
+        {nsim}_vcut.dat)
+
+    :offset: int, optional
+
+        Index in the computational box of the first plane of fields
+        along axis; positions outside of fields are left out
+
     """
 
-    def __init__(self, fields, shape, nsim):
-        self.nsim = nsim
-        rho, _, _, vx, vy, vz = fields
-        self.rho = rho
-        self.v   = np.sqrt(vx**2 + vy**2 + vz**2)
+    axes = ['x', 'y', 'z']
+
+    quantities = ['n', 'v', 'T', 'tr1', 'prs', 'rho', 'vx', 'vy', 'vz']
+
+    # stored quantities, in the order of the fields
+    fieldnames = ['rho', 'tr1', 'prs', 'vx', 'vy', 'vz']
+
+    def __init__(self, fields, shape, nsim, axis='z', positions=None, offset=0):
+        if axis not in self.axes:
+            raise ValueError(f'Error: unknown cut axis {axis}')
+
+        self.fields = fields
+        self.nsim   = nsim
+        self.axis   = self.axes.index(axis)
+        self.offset = offset
 
-        self.cut = int((shape[2] / 2) - 1)
+        self.default = positions is None
+        if self.default:
+            positions = [int((shape[2] / 2) - 1)]
+            self.axis = 2
+        self.positions = list(positions)
+
+        self.mu = 0.6724418
+        self.mm = 1.660e-24
+        self.kb = 1.380e-16
 
         self.clouds = './clouds/'
 
@@ -33,33 +77,97 @@ class CloudCuts():
         else:
             os.mkdir('./clouds/')
 
-    def get_ncuts(self):
+    @classmethod
+    def filename(cls, nsim, quantity, axis='z', position=None):
         """
 
-        Get a number density cut of a single simulation file
+        Output file of a cut (position None for the default z mid-plane)
+
+        """
+        if position is None:
+            return f'./clouds/{nsim}_{quantity}cut.dat'
+        return f'./clouds/{nsim}_{quantity}cut_{axis}{position:04d}.dat'
+
+    def quantity(self, name, plane):
+        """
+
+        Quantity on a plane of the fields
+
+        :name: string, one of CloudCuts.quantities
+
+        :plane: list, 2D scalar/vector fields
+
+        """
+        rho, tr1, prs, vx, vy, vz = plane
+
+        if name == 'n':
+            return rho / (self.mm * self.mu)
+        if name == 'v':
+            return np.sqrt(vx**2 + vy**2 + vz**2)
+        if name == 'T':
+            return prs / rho * self.mu * self.mm / self.kb
+        if name in self.fieldnames:
+            return plane[self.fieldnames.index(name)]
 
+        raise ValueError(f'Error: unknown cut quantity {name}')
+
+    def planes(self, quantities=('n', 'v')):
+        """
+
+        Get the cuts of the planes within the fields
+
+        :quantities: list, names of the quantities
+
+        :return: list of (quantity, position, 2D numpy array)
+
+        """
+        nplanes = self.fields[0].shape[self.axis]
+
+        cuts = []
+        for position in self.positions:
+            i = position - self.offset
+            if not 0 <= i < nplanes:
+                continue
+
+            index = [slice(None)] * 3
+            index[self.axis] = i
+            plane = [f[tuple(index)] for f in self.fields]
+
+            for name in quantities:
+                cuts.append((name, position, np.array(self.quantity(name, plane))))
+
+        return cuts
+
+    def write(self, cuts):
         """
-        mu = 0.6724418
-        mm = 1.660e-24
 
-        n = self.rho / (mm * mu)
-        nz0 = n[:, :, self.cut]
+        Write cuts (output of planes)
 
-        nfile = f'{self.clouds}{self.nsim}_ncut.dat'
-        n_arr = '\n'.join(['\t'.join(map(str, row)) for row in nz0])
-        with open(nfile, 'w') as fn:
-            fn.write(n_arr)
+        """
+        for name, position, arr in cuts:
+            filename = self.filename(self.nsim, name, self.axes[self.axis], None if self.default else position)
+            get_writer().write(filename, write_table, arr)
+
+    def get_cuts(self, quantities=('n', 'v')):
+        """
+
+        Get the cuts of the quantities on every plane
+
+        """
+        self.write(self.planes(quantities))
+
+    def get_ncuts(self):
+        """
+
+        Get a number density cut of a single simulation file
+
+        """
+        self.get_cuts(['n'])
 
     def get_vcuts(self):
         """
 
         Get a velocity cut of a single simulation file
-        
-        """
-        v = self.v
-        vz0 = v[:, :, self.cut]
 
-        vfile = f'{self.clouds}{self.nsim}_vcut.dat'
-        v_arr = '\n'.join(['\t'.join(map(str, row)) for row in vz0])
-        with open(vfile, 'w') as fv:
-            fv.write(v_arr)
\ No newline at end of file
+        """
+        self.get_cuts(['v'])
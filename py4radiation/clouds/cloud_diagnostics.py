@@ -7,6 +7,9 @@ class CloudDiagnostics():
 
     Get diagnostics for gas in a VTK simulation file
 
+    All mass-weighted moments are gathered in a single fused pass
+    over z-slabs of the fields with float64 accumulators
+
     :j3D: numpy array
 
         3D reshaped axes for x, y, z
@@ -19,13 +22,36 @@ class CloudDiagnostics():
 
         Initial mass of the cloud
 
+    :slab: int, optional
+
+        Number of cells per slab in the fused pass, small enough for
+        the slab temporaries to stay in cache
+
+    :phase: PhaseHistograms, optional
+
+        Histograms filled with the cells of every slab of the pass
+
+    :budget: MassBudget, optional
+
+        Mass fluxes and binned masses filled with the cells of every
+        slab of the pass
+
     """
 
-    def __init__(self, j3D, dV, M0):
+    # Sums of w = rho * tr1 times each quantity over the grid
+    moments = ['M', 'n', 'T', 'v', 'vx', 'vy', 'vz', 'vx2', 'vy2', 'vz2',
+               'x', 'y', 'z', 'x2', 'y2', 'z2', 'mix']
+
+    def __init__(self, j3D, dV, M0, slab=2**15, phase=None, budget=None):
         self.j3D = j3D
         self.dV  = dV
         self.M0  = M0
-        
+        self.slab = slab
+        self.phase = phase
+        self.budget = budget
+
+        self.j = [np.ravel(j).astype(np.float64) for j in j3D]
+
         self.mu = 0.6724418
         self.mm = 1.660e-24
         self.kb = 1.380e-16
@@ -38,57 +64,261 @@ class CloudDiagnostics():
         :fields: numpy array
 
             Scalar/vector fields from a VTK simulation file
-            
+
+        """
+
+        return self.diagnose_slabs([(0, fields)])
+
+    def diagnose_slabs(self, slabs):
+        """
+
+        Diagnose a single VTK file streamed in z-slabs, so that only
+        one slab of the fields needs to be in memory
+
+        :slabs: iterable
+
+            (k0, fields) for consecutive z-slabs of the simulation file,
+            e.g. VTKSlabReader.slabs
+
+        """
+
+        return self.finalize(self.moment_sums(slabs))
+
+    def diagnose_region(self, region):
+        """
+
+        Diagnose a single VTK file from its cloud region only
+        (see CloudRegion)
+
+        :region: CloudRegion
+
         """
 
-        rho, tr1, prs, vx, vy, vz = fields
+        if self.phase is not None:
+            raise ValueError('Error: phase histograms need every cell, not a cloud region')
 
-        n = rho * tr1 / (self.mm * self.mu)
-        T = prs * tr1 * self.mu * self.mm / (rho * self.kb)
-        v = np.sqrt(vx**2 + vy**2 + vz**2) * tr1
+        if region.dense:
+            fields, (i0, j0, k0) = region.box()
+            return self.finalize(self.moment_sums([(k0, fields)], i0, j0))
+
+        return self.finalize(self.cell_sums(region))
+
+    def moment_sums(self, slabs, i0=0, j0=0):
+        """
+
+        Get the moment sums of consecutive z-slabs of a simulation file
+
+        Sums of disjoint parts of the box (e.g. on different MPI ranks)
+        add up to the sums of the whole box
+
+        :slabs: iterable
+
+            (k0, fields) for each z-slab
+
+        :i0, j0: int, optional
+
+            Index of the first x and y planes of the slabs
+
+        :return: numpy array, sums in the order of CloudDiagnostics.moments
+
+        """
+
+        sums = np.zeros(len(self.moments))
+        for k0, fields in slabs:
+            shape = fields[0].shape
+            dk = max(1, self.slab // (shape[0] * shape[1]))
+
+            for k in range(0, shape[2], dk):
+                self.accumulate(sums, [f[:, :, k:k + dk] for f in fields], k0 + k, i0, j0)
+
+        return sums
+
+    def cell_sums(self, region):
+        """
+
+        Get the moment sums of the gathered cells of a cloud region,
+        in chunks of slab cells
+
+        :region: CloudRegion
+
+        :return: numpy array, sums in the order of CloudDiagnostics.moments
+
+        """
+
+        sums  = np.zeros(len(self.moments))
+        cells = region.cells()
+        for c0 in range(0, region.ncells, self.slab):
+            chunk = slice(c0, c0 + self.slab)
+            coords = [j[i[chunk]] for j, i in zip(self.j, [region.ix, region.iy, region.iz])]
+            self.accumulate_cells(sums, [f[chunk] for f in cells], coords, region.iy[chunk])
+
+        return sums
+
+    def accumulate(self, sums, fields, k0=0, i0=0, j0=0):
+        """
+
+        Add the moments of a z-slab of the fields to the running sums
+
+        :sums: numpy array
+
+            Running sums, in the order of CloudDiagnostics.moments
+
+        :fields: numpy array
+
+            Scalar/vector fields of the slab
+
+        :k0: int
+
+            Index of the first z plane of the slab
+
+        :i0, j0: int, optional
+
+            Index of the first x and y planes of the slab
+
+        """
+
+        shape = fields[0].shape
+        rho, tr1, prs, vx, vy, vz = (np.asarray(f, dtype=np.float64, order='F').ravel(order='F') for f in fields)
+        x = self.j[0][i0:i0 + shape[0]]
+        y = self.j[1][j0:j0 + shape[1]]
+        z = self.j[2][k0:k0 + shape[2]]
+
+        w  = rho * tr1
+        wt = w * tr1
+
+        v = vx * vx
+        v += vy * vy
+        v += vz * vz
+        np.sqrt(v, out=v)
+
+        wv = [w * vx, w * vy, w * vz]
+
+        mix = np.where((tr1 >= 0.01) & (tr1 <= 0.99), w, 0)
+
+        if self.phase is not None or self.budget is not None:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                T = prs / rho
+            T *= self.mu * self.mm / self.kb
+
+        if self.phase is not None:
+            self.phase.accumulate(rho / (self.mm * self.mu), T, v, tr1, rho, w)
+
+        if self.budget is not None:
+            self.budget.accumulate(w, vy, T, shape, j0)
+
+        w3  = w.reshape(shape, order='F')
+        wxy = w3.sum(axis=2)
+        wx  = wxy.sum(axis=1)
+        wy  = wxy.sum(axis=0)
+        wz  = w3.sum(axis=(0, 1))
+
+        sums += [
+            wx.sum(),
+            w @ w,
+            (prs * tr1) @ tr1,
+            wt @ v,
+            w @ vx, w @ vy, w @ vz,
+            wv[0] @ vx, wv[1] @ vy, wv[2] @ vz,
+            wx @ x, wy @ y, wz @ z,
+            wx @ x**2, wy @ y**2, wz @ z**2,
+            mix.sum()
+        ]
+
+    def accumulate_cells(self, sums, cells, coords, iy=None):
+        """
+
+        Add the moments of gathered cells to the running sums
+
+        :sums: numpy array
+
+            Running sums, in the order of CloudDiagnostics.moments
+
+        :cells: list, 1D rho, tr1, prs, vx, vy, vz of the cells
+
+        :coords: list, 1D x, y, z of the cells
+
+        :iy: numpy array, y plane of the cells (needed with budget)
+
+        """
+
+        rho, tr1, prs, vx, vy, vz = cells
+        x, y, z = coords
+
+        w  = rho * tr1
+        wt = w * tr1
+
+        v = vx * vx
+        v += vy * vy
+        v += vz * vz
+        np.sqrt(v, out=v)
+
+        wv = [w * vx, w * vy, w * vz]
+        wj = [w * x, w * y, w * z]
+
+        mix = np.where((tr1 >= 0.01) & (tr1 <= 0.99), w, 0)
+
+        if self.budget is not None:
+            T = prs / rho * self.mu * self.mm / self.kb
+            self.budget.accumulate_cells(w, vy, T, iy)
+
+        sums += [
+            w.sum(),
+            w @ w,
+            (prs * tr1) @ tr1,
+            wt @ v,
+            w @ vx, w @ vy, w @ vz,
+            wv[0] @ vx, wv[1] @ vy, wv[2] @ vz,
+            wj[0].sum(), wj[1].sum(), wj[2].sum(),
+            wj[0] @ x, wj[1] @ y, wj[2] @ z,
+            mix.sum()
+        ]
+
+    def finalize(self, sums):
+        """
+
+        Get the diagnostics from the moment sums
+
+        :sums: numpy array
+
+            Moment sums over the whole grid
+
+        :return: lists
+
+            avs, v_avs, fmix, j_cm, j_sg, v_sg
+
+        """
+
+        s = dict(zip(self.moments, sums))
+
+        M = s['M']
 
-        M = np.sum(rho * tr1) * self.dV
-        
         def mwav(var):
-            return np.sum(rho * var * tr1) * self.dV / M
+            return np.float64(s[var]) / M
 
-        n_av = mwav(n)
-        T_av = mwav(T)
-        v_av = mwav(v)
+        n_av = mwav('n') / (self.mm * self.mu)
+        T_av = mwav('T') * self.mu * self.mm / self.kb
+        v_av = mwav('v')
         avs = [n_av, T_av, v_av]
 
-        vx_av = mwav(vx)
-        vy_av = mwav(vy)
-        vz_av = mwav(vz)
-        v_avs = [vx_av, vy_av, vz_av]
+        v_avs = [mwav('vx'), mwav('vy'), mwav('vz')]
 
-        mask = np.where((tr1 >= 0.01) & (tr1 <= 0.99), tr1, 0)
-        fmix = np.sum(rho * mask) * self.dV / self.M0
+        fmix = s['mix'] * self.dV / self.M0
 
-        x_cm = mwav(self.j3D[0])
-        y_cm = mwav(self.j3D[1])
-        z_cm = mwav(self.j3D[2])
-        j_cm = [x_cm, y_cm, z_cm]
+        j_cm = [mwav('x'), mwav('y'), mwav('z')]
 
         def sigma(var):
             s  = mwav(var)
-            s2 = mwav(var**2)
+            s2 = mwav(var + '2')
 
             if np.isnan(s):
                 sg = np.sqrt(s2)
             else:
                 sg = np.sqrt(s2 - s**2)
-            
+
             return sg
 
-        x_sg = sigma(self.j3D[0]) * np.sqrt(5)
-        y_sg = sigma(self.j3D[1]) * np.sqrt(5)
-        z_sg = sigma(self.j3D[2]) * np.sqrt(5)
-        j_sg = [x_sg, y_sg, z_sg]
+        j_sg = [sigma('x') * np.sqrt(5), sigma('y') * np.sqrt(5), sigma('z') * np.sqrt(5)]
 
-        vx_sg = sigma(vx)
-        vy_sg = sigma(vy)
-        vz_sg = sigma(vz)
-        v_sg = [vx_sg, vy_sg, vz_sg]
+        v_sg = [sigma('vx'), sigma('vy'), sigma('vz')]
 
-        return avs, v_avs, fmix, j_cm, j_sg, v_sg
\ No newline at end of file
+        return avs, v_avs, fmix, j_cm, j_sg, v_sg
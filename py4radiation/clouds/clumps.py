@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+class CloudClumps():
+    """
+
+    Identify the clumps of a fragmented cloud as connected regions of
+    cells above a tracer and/or density threshold, and get per-clump
+    statistics with labelled reductions over the clump cells
+
+    Moments are weighted by w = rho * tr1 as in CloudDiagnostics
+
+    :j3D: numpy array
+
+        3D reshaped axes for x, y, z
+
+    :dV: float
+
+        Volume element of the computational box
+
+    :tr1_min: float, optional
+
+        Minimum tracer of clump cells (None for no tracer threshold)
+
+    :rho_min: float, optional
+
+        Minimum density of clump cells in code units
+        (None for no density threshold)
+
+    :connectivity: int, optional
+
+        1 for face, 2 for edge and 3 for corner neighbours
+
+    :min_cells: int, optional
+
+        Clumps with fewer cells are left out of the catalogue
+
+    """
+
+    # Sums over the cells of each clump
+    moments = ['N', 'M', 'x', 'y', 'z', 'vx', 'vy', 'vz', 'vx2', 'vy2', 'vz2', 'n', 'T']
+
+    columns = ['id', 'ncells', 'mass', 'x_CM', 'y_CM', 'z_CM', 'vx', 'vy', 'vz',
+               'vx_sg', 'vy_sg', 'vz_sg', 'n', 'T']
+
+    def __init__(self, j3D, dV, tr1_min=0.5, rho_min=None, connectivity=1, min_cells=1):
+        if tr1_min is None and rho_min is None:
+            raise ValueError('Error: clumps need a tracer or density threshold')
+
+        self.j  = [np.ravel(j).astype(np.float64) for j in j3D]
+        self.dV = dV
+        self.tr1_min = tr1_min
+        self.rho_min = rho_min
+        self.connectivity = connectivity
+        self.min_cells = min_cells
+
+        self.mu = 0.6724418
+        self.mm = 1.660e-24
+        self.kb = 1.380e-16
+
+    def mask(self, fields):
+        """
+
+        Cells above the thresholds
+
+        """
+        rho, tr1 = fields[0], fields[1]
+
+        mask = np.ones(rho.shape, dtype=bool)
+        if self.tr1_min is not None:
+            mask &= tr1 >= self.tr1_min
+        if self.rho_min is not None:
+            mask &= rho >= self.rho_min
+
+        return mask
+
+    def label(self, mask):
+        """
+
+        Label the connected regions of the mask
+
+        :return: labels (0 outside clumps), number of clumps
+
+        """
+        from scipy import ndimage
+
+        structure = ndimage.generate_binary_structure(3, self.connectivity)
+        return ndimage.label(mask, structure=structure)
+
+    def accumulate(self, sums, labels, fields, k0=0, i0=0, j0=0):
+        """
+
+        Add the clump moments of a z-slab to the running sums
+
+        :sums: numpy array, (moments, clumps + 1) running sums
+
+        :labels: numpy array, labels of the slab
+
+        :fields: numpy array, scalar/vector fields of the slab
+
+        :k0: int, index of the first z plane of the slab
+
+        :i0, j0: int, optional, index of the first x and y planes of the slab
+
+        """
+        inside = labels > 0
+        lab = labels[inside]
+        ix, iy, iz = np.nonzero(inside)
+
+        rho, tr1, prs, vx, vy, vz = (np.asarray(f[inside], dtype=np.float64) for f in fields)
+        w = rho * tr1
+
+        nbins = sums.shape[1]
+        def add(i, weights=None):
+            sums[i] += np.bincount(lab, weights=weights, minlength=nbins)
+
+        add(0)
+        add(1, w)
+        add(2, w * self.j[0][i0 + ix])
+        add(3, w * self.j[1][j0 + iy])
+        add(4, w * self.j[2][k0 + iz])
+        for i, v in enumerate([vx, vy, vz]):
+            wv = w * v
+            add(5 + i, wv)
+            add(8 + i, wv * v)
+        add(11, w * w)
+        add(12, prs * tr1 * tr1)
+
+    def finalize(self, sums):
+        """
+
+        Get the clump catalogue from the moment sums
+
+        :return: numpy array, one row per clump in the order of CloudClumps.columns
+
+        """
+        s = dict(zip(self.moments, sums[:, 1:]))
+
+        M = s['M']
+        def mwav(var):
+            return np.divide(s[var], M, out=np.full_like(M, np.nan), where=M > 0)
+
+        v  = [mwav(c) for c in ['vx', 'vy', 'vz']]
+        sg = [np.sqrt(np.maximum(mwav(c + '2') - vc**2, 0)) for c, vc in zip(['vx', 'vy', 'vz'], v)]
+
+        catalogue = np.column_stack([
+            np.arange(1, len(M) + 1), s['N'], M * self.dV,
+            mwav('x'), mwav('y'), mwav('z'), *v, *sg,
+            mwav('n') / (self.mm * self.mu),
+            mwav('T') * self.mu * self.mm / self.kb
+        ])
+
+        return catalogue[s['N'] >= self.min_cells]
+
+    def find(self, fields):
+        """
+
+        Find the clumps of a simulation file
+
+        :fields: numpy array, scalar/vector fields of a VTK simulation file
+
+        :return: clump catalogue (see finalize)
+
+        """
+        labels, nclumps = self.label(self.mask(fields))
+
+        sums = np.zeros((len(self.moments), nclumps + 1))
+        self.accumulate(sums, labels, fields)
+
+        return self.finalize(sums)
+
+    def find_region(self, region):
+        """
+
+        Find the clumps of a simulation file within the bounding box
+        of its cloud region (see CloudRegion), which holds every clump
+        cell when tr1_min is above the tracer threshold of the region
+
+        :region: CloudRegion
+
+        :return: clump catalogue (see finalize)
+
+        """
+        if self.tr1_min is None or self.tr1_min <= region.tr1_min:
+            return self.find(region.fields)
+
+        fields, (i0, j0, k0) = region.box()
+        labels, nclumps = self.label(self.mask(fields))
+
+        sums = np.zeros((len(self.moments), nclumps + 1))
+        self.accumulate(sums, labels, fields, k0, i0, j0)
+
+        return self.finalize(sums)
+
+    def find_slabs(self, slabs):
+        """
+
+        Find the clumps of a simulation file streamed in z-slabs, with
+        one pass for the mask and one for the moments
+
+        :slabs: callable, returns an iterable of (k0, fields) for
+                consecutive z-slabs (called twice)
+
+        :return: clump catalogue (see finalize)
+
+        """
+        mask = np.concatenate([self.mask(fields) for _, fields in slabs()], axis=2)
+        labels, nclumps = self.label(mask)
+        del mask
+
+        sums = np.zeros((len(self.moments), nclumps + 1))
+        for k0, fields in slabs():
+            self.accumulate(sums, labels[:, :, k0:k0 + fields[0].shape[2]], fields, k0)
+
+        return self.finalize(sums)
+
+    @classmethod
+    def write(cls, filename, catalogue):
+        """
+
+        Write a clump catalogue
+
+        """
+        with open(filename, 'w') as f:
+            f.write(' '.join(cls.columns))
+            for row in catalogue:
+                f.write('\n{0:d} {1:d} '.format(int(row[0]), int(row[1])) + ' '.join(f'{value:.14e}' for value in row[2:]))
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import copy
+import numpy as np
+
+class PhaseHistograms():
+    """
+
+    Volume-, mass- and cloud mass-weighted (n, T) phase diagram and
+    1D PDFs of n, T, |v| and tr1 of a simulation file, filled during
+    the fused pass of CloudDiagnostics from the arrays it computes
+
+    Bins are fixed: log10 bins for n [cm^-3], T [K] and |v|, linear
+    bins for tr1; bin 0 collects values below the range (and zeros),
+    the last bin values above it, so that no cell is left out
+    (for tr1, the last bin holds unmixed cloud gas, tr1 = 1)
+    The 1D PDFs of n and T are the marginals of the phase diagram
+
+    :n_range, T_range, v_range: tuple, optional
+
+        log10 limits of the n, T and |v| bins
+
+    :bins_per_dex: int, optional
+
+        Number of log10 bins per dex
+
+    :tr1_bins: int, optional
+
+        Number of tr1 bins between 0 and 1
+
+    """
+
+    # weights of the histograms: cells (volume / dV), rho (mass / dV) and rho * tr1 (cloud mass / dV)
+    weights = ['volume', 'mass', 'cloud']
+
+    def __init__(self, n_range=(-6, 4), T_range=(2, 9), v_range=(-2, 9), bins_per_dex=10, tr1_bins=100):
+        self.edges = {
+            'n': np.linspace(*n_range, int(round((n_range[1] - n_range[0]) * bins_per_dex)) + 1),
+            'T': np.linspace(*T_range, int(round((T_range[1] - T_range[0]) * bins_per_dex)) + 1),
+            'v': np.linspace(*v_range, int(round((v_range[1] - v_range[0]) * bins_per_dex)) + 1),
+            'tr1': np.linspace(0, 1, tr1_bins + 1)
+        }
+
+        # the histograms of one simulation file, with under/overflow bins
+        self.nbins = {var: len(edges) + 1 for var, edges in self.edges.items()}
+        self.nT  = np.zeros((len(self.weights), self.nbins['n'], self.nbins['T']))
+        self.v   = np.zeros((len(self.weights), self.nbins['v']))
+        self.tr1 = np.zeros((len(self.weights), self.nbins['tr1']))
+
+    def spec(self):
+        """
+
+        Bins of the histograms as (variable, lower, upper, number of bins)
+
+        """
+        return tuple((var, float(edges[0]), float(edges[-1]), len(edges) - 1) for var, edges in self.edges.items())
+
+    def empty(self):
+        """
+
+        Empty histograms with the bins of this object
+
+        """
+        hist = copy.copy(self)
+        hist.nT  = np.zeros_like(self.nT)
+        hist.v   = np.zeros_like(self.v)
+        hist.tr1 = np.zeros_like(self.tr1)
+        return hist
+
+    def index(self, var, values, log=True):
+        """
+
+        Bin indices of values, including the under/overflow bins
+
+        """
+        edges = self.edges[var]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            idx = np.log10(values) if log else np.array(values, dtype=np.float64)
+
+        # shifted by one so that truncation is the floor for every bin
+        idx -= edges[0]
+        idx *= (len(edges) - 1) / (edges[-1] - edges[0])
+        idx += 1
+        np.clip(idx, 0, len(edges), out=idx)
+        idx[np.isnan(idx)] = 0
+
+        return idx.astype(np.intp)
+
+    def accumulate(self, n, T, v, tr1, rho, w):
+        """
+
+        Add the cells of a slab to the histograms
+
+        :n, T: numpy arrays, number density and temperature of the cells
+
+        :v: numpy array, velocity modulus of the cells
+
+        :tr1, rho: numpy arrays, tracer and density of the cells
+
+        :w: numpy array, rho * tr1 of the cells
+
+        """
+        nn, nT = self.nbins['n'], self.nbins['T']
+        flat = self.index('n', n) * nT + self.index('T', T)
+        iv   = self.index('v', v)
+        itr1 = self.index('tr1', tr1, log=False)
+
+        for i, weights in enumerate([None, rho, w]):
+            self.nT[i]  += np.bincount(flat, weights=weights, minlength=nn * nT).reshape(nn, nT)
+            self.v[i]   += np.bincount(iv, weights=weights, minlength=self.nbins['v'])
+            self.tr1[i] += np.bincount(itr1, weights=weights, minlength=self.nbins['tr1'])
+
+    def pdfs(self):
+        """
+
+        1D histograms of n, T, v and tr1, by weight
+
+        """
+        return {'n': self.nT.sum(axis=2), 'T': self.nT.sum(axis=1), 'v': self.v, 'tr1': self.tr1}
+
+    def update(self, other):
+        """
+
+        Add the histograms of another PhaseHistograms with the same bins
+        (e.g. of another part of the box or another simulation file)
+
+        """
+        self.nT  += other.nT
+        self.v   += other.v
+        self.tr1 += other.tr1
+
+    def todict(self):
+        """
+
+        JSON-serialisable histograms (e.g. for a run manifest),
+        with the nonzero bins of the phase diagram only
+
+        """
+        nonzero = np.flatnonzero(self.nT.any(axis=0))
+        return {'nT_bins': nonzero.tolist(), 'nT': self.nT.reshape(len(self.weights), -1)[:, nonzero].tolist(),
+                'v': self.v.tolist(), 'tr1': self.tr1.tolist()}
+
+    def fromdict(self, state):
+        """
+
+        Histograms from the output of todict, with the bins of this object
+
+        """
+        hist = self.empty()
+        hist.nT.reshape(len(self.weights), -1)[:, state['nT_bins']] = state['nT']
+        hist.v[...]   = state['v']
+        hist.tr1[...] = state['tr1']
+        return hist
+
+    def merge(self, comm):
+        """
+
+        Sum the histograms of all MPI ranks of comm into rank 0
+        (e.g. the parts of a box split among ranks)
+
+        """
+        from mpi4py import MPI
+
+        for arr in [self.nT, self.v, self.tr1]:
+            if comm.Get_rank() == 0:
+                comm.Reduce(MPI.IN_PLACE, arr, op=MPI.SUM, root=0)
+            else:
+                comm.Reduce(arr, None, op=MPI.SUM, root=0)
+
+class PhaseSeries():
+    """
+
+    Phase diagrams and PDFs of every simulation file of a series
+    and their sum over the series, written to one HDF5 file
+
+    :hist: PhaseHistograms
+
+        Histograms giving the bins of the series
+
+    :dV: float
+
+        Volume element of the histogram cells, to convert the
+        weights to volume and mass in code units
+
+    """
+
+    def __init__(self, hist, dV):
+        self.hist = hist
+        self.dV   = dV
+        self.snapshots = {}
+
+    def add(self, simnum, hist):
+        """
+
+        Add the histograms of a simulation file
+
+        """
+        self.snapshots[simnum] = hist
+
+    def update(self, other):
+        """
+
+        Add the simulation files of another PhaseSeries
+
+        """
+        self.snapshots.update(other.snapshots)
+
+    def merge(self, comm):
+        """
+
+        Gather the simulation files of all MPI ranks into rank 0
+
+        """
+        gathered = comm.gather(self.snapshots, root=0)
+        if comm.Get_rank() == 0:
+            for snapshots in gathered:
+                self.snapshots.update(snapshots)
+
+    def total(self):
+        """
+
+        Histograms summed over the series
+
+        """
+        total = self.hist.empty()
+        for hist in self.snapshots.values():
+            total.update(hist)
+        return total
+
+    def write(self, filename):
+        """
+
+        Write the histograms to an HDF5 file with one dataset per
+        histogram, stacked over the simulation files in order
+        (dimensions: snapshot, weight, bins) and a series group
+        with their sums
+
+        Weights are volume, mass and cloud mass in code units;
+        bin edges are attributes of the file, bin 0 and the last bin
+        are the under/overflow bins
+
+        """
+        import h5py
+
+        simnums = sorted(self.snapshots)
+        hists   = [self.snapshots[simnum] for simnum in simnums]
+
+        with h5py.File(filename, 'w') as f:
+            f.attrs['weights'] = self.hist.weights
+            for var, edges in self.hist.edges.items():
+                f.attrs[f'{var}_edges'] = edges
+            f.attrs['log'] = ['n', 'T', 'v']
+
+            f.create_dataset('snapshots', data=np.array(simnums, dtype='S'))
+
+            def create(name, data):
+                f.create_dataset(name, data=data * self.dV, compression='gzip', shuffle=True)
+
+            create('nT', np.array([hist.nT for hist in hists]).reshape(len(hists), *self.hist.nT.shape))
+            for var in ['n', 'T', 'v', 'tr1']:
+                create(var, np.array([hist.pdfs()[var] for hist in hists]).reshape(len(hists), len(self.hist.weights), -1))
+
+            total = self.total()
+            create('series/nT', total.nT)
+            for var, pdf in total.pdfs().items():
+                create(f'series/{var}', pdf)
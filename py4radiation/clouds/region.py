@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+class CloudRegion():
+    """
+
+    Compacted cloud region of a simulation file: the cells with
+    tr1 > tr1_min, as flat indices and gathered field values, and
+    their bounding box
+
+    Tracer-weighted reductions over the region leave out the cells
+    with tr1 <= tr1_min, whose weight rho * tr1 is at most
+    rho * tr1_min (none are left out with tr1_min = 0)
+    When the cloud cells fill most of their bounding box the box is
+    used directly (views of the fields, no gather)
+
+    :fields: numpy array
+
+        Scalar/vector fields of a VTK simulation file
+
+    :tr1_min: float, optional
+
+        Tracer threshold of cloud cells
+
+    :fill: float, optional
+
+        Minimum fraction of cloud cells in the bounding box to use it
+        instead of the gathered cells
+
+    """
+
+    def __init__(self, fields, tr1_min=1e-4, fill=0.5):
+        self.fields  = fields
+        self.tr1_min = tr1_min
+        self.shape   = fields[0].shape
+
+        tr1 = np.asarray(fields[1])
+        self.index = np.flatnonzero((tr1 > tr1_min).ravel(order='F'))
+        self.ncells = len(self.index)
+
+        nx, ny, _ = self.shape
+        if self.ncells:
+            self.ix = self.index % nx
+            self.iy = self.index // nx % ny
+            self.iz = self.index // (nx * ny)
+            self.bbox = [(int(i.min()), int(i.max()) + 1) for i in [self.ix, self.iy, self.iz]]
+        else:
+            self.ix = self.iy = self.iz = self.index
+            self.bbox = [(0, 0)] * 3
+
+        self.fraction = self.ncells / np.prod(self.shape)
+        # an empty region has no box; its sums are zero (NaN diagnostics)
+        self.dense    = self.ncells > 0 and self.ncells >= fill * np.prod([i1 - i0 for i0, i1 in self.bbox])
+
+        self._cells = None
+
+    def box(self):
+        """
+
+        Fields of the bounding box (views)
+
+        :return: fields, (i0, j0, k0) index of the first cell of the box
+
+        """
+        index = tuple(slice(i0, i1) for i0, i1 in self.bbox)
+        return [f[index] for f in self.fields], tuple(i0 for i0, _ in self.bbox)
+
+    def cells(self):
+        """
+
+        Field values of the cloud cells (float64), gathered once
+
+        :return: rho, tr1, prs, vx, vy, vz
+
+        """
+        if self._cells is None:
+            self._cells = [np.asarray(f).ravel(order='F')[self.index].astype(np.float64) for f in self.fields]
+        return self._cells
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from .simload import VTKSlabReader
+from .clouds.cloud_cuts import CloudCuts
+from .clouds.cloud_diagnostics import CloudDiagnostics
+from .synthetic.observables import SyntheticObservables
+from .synthetic.column_density import ColumnDensity
+from .synthetic.emission import EmissionMaps
+
+class DomainDecomposition():
+    """
+
+    Analyse a single simulation file split in z-slabs over
+    the ranks of an MPI communicator
+
+    Every rank reads and keeps only its own slab of the fields
+    Moment sums are combined with Allreduce, phase histograms are
+    summed on rank 0, column density maps
+    and position-velocity cubes are gathered along z on rank 0,
+    cuts and spectra are done by the rank that owns them
+
+    :comm: MPI communicator
+
+        Ranks sharing the simulation file
+
+    :shape: tuple
+
+        Dimensions of the whole computational box
+
+    """
+
+    def __init__(self, comm, shape):
+        self.comm  = comm
+        self.rank  = comm.Get_rank()
+        self.size  = comm.Get_size()
+        self.shape = shape
+
+        if shape[2] < self.size:
+            raise ValueError('Error: more ranks than z planes in the domain decomposition')
+
+        bounds  = np.linspace(0, shape[2], self.size + 1).astype(int)
+        self.k0 = bounds[self.rank]
+        self.k1 = bounds[self.rank + 1]
+
+        self.local_shape = (shape[0], shape[1], self.k1 - self.k0)
+        self.bbox = np.array([[-shape[0]/2, shape[0]/2], [0, shape[1]],
+                              [-shape[2]/2 + self.k0, -shape[2]/2 + self.k1]], dtype=int)
+
+    def load(self, simfile):
+        """
+
+        Read the slab of this rank from a simulation file
+
+        :simfile: string, path to simulation file
+
+        :return: scalar/vector fields of the slab
+
+        """
+        return VTKSlabReader(simfile).slab(self.k0, self.k1)
+
+    def get_M0(self, fields, dV):
+        """
+
+        Initial mass of the cloud from the slabs of the first simulation file
+
+        """
+        rho, tr1, _, _, _, _ = fields
+        return self.comm.allreduce(np.sum(rho * tr1, dtype=np.float64)) * dV
+
+    def get_sim_diagnostics(self, diagnose, fields, phase=None, budget=None):
+        """
+
+        Get diagnostics of cloud gas of the whole box from the slabs
+
+        :diagnose: Diagnose
+
+            Diagnose object of the whole box (coordinates, dV, M0)
+
+        :fields: numpy array
+
+            Scalar/vector fields of the slab of this rank
+
+        :phase: PhaseHistograms, optional
+
+            Histograms of the slab, summed into rank 0 of the group
+
+        :budget: MassBudget, optional
+
+            Mass budget of the slab, summed into rank 0 of the group
+
+        :return: same as Diagnose.get_sim_diagnostics, on every rank
+
+        """
+        from mpi4py import MPI
+
+        diagnostics = CloudDiagnostics(diagnose.j3D, diagnose.dV, diagnose.M0, phase=phase, budget=budget)
+
+        sums = diagnostics.moment_sums([(self.k0, fields)])
+        self.comm.Allreduce(MPI.IN_PLACE, sums, op=MPI.SUM)
+
+        if phase is not None:
+            phase.merge(self.comm)
+        if budget is not None:
+            budget.merge(self.comm)
+
+        return diagnostics.finalize(sums)
+
+    def get_cuts(self, fields, simnum, axis='z', positions=None, quantities=('n', 'v')):
+        """
+
+        Get the cuts (see CloudCuts): z planes on the rank that owns
+        them, x and y planes gathered along z on rank 0
+
+        """
+        if positions is None or axis == 'z':
+            CloudCuts(fields, self.shape, simnum, axis, positions, offset=self.k0).get_cuts(quantities)
+            return
+
+        cuts  = CloudCuts(fields, self.shape, simnum, axis, positions)
+        parts = self.comm.gather(cuts.planes(quantities), root=0)
+        if self.rank == 0:
+            cuts.write([(name, position, np.concatenate([part[i][2] for part in parts], axis=1))
+                        for i, (name, position, _) in enumerate(parts[0])])
+
+    def get_observables(self, simnum, fields, ions, units, stats=None, pv_dv=None, ionization_table=None, emission=None,
+                        spectra=None):
+        """
+
+        Get column density maps, position-velocity cubes and mock
+        spectra of the whole box from the slabs
+
+        :simnum: string, number of the simulation file
+
+        :fields: numpy array, scalar/vector fields of the slab
+
+        :ions: numpy array, set of ions for analysis
+
+        :units: numpy array, units array (see SyntheticObservables)
+
+        :stats: ColumnDensityStats, optional
+
+            Fed on rank 0 with the assembled maps
+
+        :pv_dv: float, optional
+
+            Width of the velocity channels of position-velocity cubes in km/s
+
+        :ionization_table: string, optional
+
+            Path to the ion fractions file for Trident
+
+        :emission: list, optional
+
+            RateTable objects for emission maps (None for no emission maps)
+
+        :spectra: SpectralProcessing, optional
+
+            Mock observation and measurements of the spectra, on the
+            rank of the rays
+
+        """
+        observables = SyntheticObservables(simnum, fields, self.local_shape, ions, units, bbox=self.bbox,
+                                           ionization_table=ionization_table)
+        cols = ColumnDensity(simnum, observables.ds, self.local_shape, ions, stats)
+
+        for axis, view in [('y', 'xz'), ('x', 'yz')]:
+            maps = self.comm.gather(cols.project(axis), root=0)
+            if self.rank == 0:
+                cols.write_maps([np.concatenate(parts, axis=1) for parts in zip(*maps)], view)
+
+        if emission is not None:
+            maps = EmissionMaps(simnum, observables.rho, observables.T, observables.dl, emission)
+            parts = self.comm.gather(maps.project(), root=0)
+            if self.rank == 0:
+                maps.write_maps({view: np.concatenate([part[view] for part in parts], axis=2) for view in parts[0]})
+
+        if pv_dv:
+            edges = cols.pv_edges(-500, 500, pv_dv)
+            for i, cubes in cols.iterPV(dv=pv_dv):
+                parts = self.comm.gather(cubes, root=0)
+                if self.rank == 0:
+                    cubes = {view: np.concatenate([part[view] for part in parts], axis=1) for view in cubes}
+                    cols.write_pv(i, cubes, edges)
+
+        # the default rays run along y at z = 0
+        if self.bbox[2, 0] <= 0 < self.bbox[2, 1]:
+            batch = observables.get_mock_spectra()
+            if spectra is not None:
+                observables.get_spectra_summary(spectra, batch)
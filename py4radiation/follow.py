@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import numpy as np
+
+from .simload import VTKSlabReader
+from .pipeline import run_units
+
+class SnapshotWatcher():
+    """
+
+    Watch the simulation files of a running simulation and report
+    the ones that are completely written, in order
+
+    A file is complete when the next one exists, or when its size
+    has not changed between two polls and covers every field
+    declared in its header (for the last file of the series)
+
+    :sim_files: list
+
+        Paths to the simulation files, in order
+
+    :interval: float, optional
+
+        Seconds between polls of the directory
+
+    :timeout: float, optional
+
+        Seconds without a new complete file before giving up
+        (default: wait for the whole series)
+
+    """
+
+    def __init__(self, sim_files, interval=30.0, timeout=None):
+        self.sim_files = sim_files
+        self.interval  = interval
+        self.timeout   = timeout
+
+        self.next  = 0
+        self.sizes = {}
+
+    @staticmethod
+    def complete(simfile, size):
+        """
+
+        Whether a legacy binary VTK file of the given size holds all its cell fields
+
+        """
+        try:
+            reader = VTKSlabReader(simfile)
+        except (OSError, ValueError):
+            return False
+
+        ncells = int(np.prod(reader.shape))
+        end = max(offset + ncells * np.dtype(dtype).itemsize for offset, dtype in reader.arrays.values())
+        return size >= end
+
+    def ready(self, k):
+        """
+
+        Whether the k-th simulation file is completely written
+
+        """
+        simfile = self.sim_files[k]
+        if not os.path.isfile(simfile):
+            return False
+
+        if k + 1 < len(self.sim_files) and os.path.isfile(self.sim_files[k + 1]):
+            return True
+
+        size = os.path.getsize(simfile)
+        stable = self.sizes.get(k) == size
+        self.sizes[k] = size
+
+        return stable and self.complete(simfile, size)
+
+    def wait(self, k):
+        """
+
+        Wait until the k-th simulation file is complete
+
+        :return: False on timeout
+
+        """
+        t0 = time.monotonic()
+        while not self.ready(k):
+            if self.timeout is not None and time.monotonic() - t0 > self.timeout:
+                return False
+            time.sleep(self.interval)
+
+        return True
+
+    def poll(self):
+        """
+
+        Wait for the simulation files completed since the last call
+
+        :return: list of indices, empty when the series is done or on timeout
+
+        """
+        t0 = time.monotonic()
+        while self.next < len(self.sim_files):
+            batch = []
+            while self.next < len(self.sim_files) and self.ready(self.next):
+                batch.append(self.next)
+                self.next += 1
+
+            if batch:
+                return batch
+
+            if self.timeout is not None and time.monotonic() - t0 > self.timeout:
+                print(f'No new simulation file after {self.timeout} s, stopping at {self.next} of {len(self.sim_files)}')
+                return []
+
+            time.sleep(self.interval)
+
+        return []
+
+def follow_units(backend, analysis, watcher, tasks, callback, manifest=None, on_batch=None):
+    """
+
+    Run the analysis units of each simulation file as soon as the
+    file is complete, until the series is done
+
+    :backend: execution backend (see backends)
+
+    :analysis: Analysis
+
+    :watcher: SnapshotWatcher, used on the root process
+
+    :tasks: list, tasks to run for each simulation file (see Analysis)
+
+    :callback: callable, callback(unit, result) on the root process
+
+    :manifest: Manifest, optional
+
+    :on_batch: callable, optional, called on the root process after each batch
+
+    """
+    while True:
+        batch = watcher.poll() if backend.root else None
+        batch = backend.bcast(batch)
+        if not batch:
+            break
+
+        print(f'SIMULATION FILES {batch[0] + 1} to {batch[-1] + 1} ready')
+        run_units(backend, analysis, [(k, task) for task in tasks for k in batch], callback, manifest)
+
+        if on_batch is not None and backend.root:
+            on_batch()
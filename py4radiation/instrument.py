@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import json
+import time
+import functools
+
+# Active profiler of this process, None when instrumentation is disabled
+_profiler = None
+
+def _proc_io():
+    """
+
+    Bytes read and written by this process (rchar, wchar), zero if unknown
+
+    """
+    try:
+        with open('/proc/self/io') as f:
+            io = dict(line.split(': ') for line in f.read().splitlines())
+        return int(io['rchar']), int(io['wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+def _reset_peak_rss():
+    # Linux >= 4.0 resets VmHWM when 5 is written to clear_refs
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def _peak_rss():
+    """
+
+    Peak resident set size in bytes since the last reset (lifetime peak
+    where the reset is not available)
+
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Profiler():
+    """
+
+    Wall time, bytes read/written and peak RSS of the instrumented stages
+    of a run, per stage, simulation file and rank
+
+    :rank: int, optional
+
+        Rank of this process in the run
+
+    :cprofile: list, optional
+
+        Names of the stages to run under cProfile
+
+    :cprofile_dir: string, optional
+
+        Directory for the cProfile output of those stages
+
+    """
+
+    columns = ['stage', 'snapshot', 'rank', 'pid', 'wall', 'read_bytes', 'write_bytes', 'peak_rss']
+
+    def __init__(self, rank=0, cprofile=(), cprofile_dir='./profile/'):
+        self.rank = rank
+        self.cprofile = list(cprofile)
+        self.cprofile_dir = cprofile_dir
+
+        self.pid = os.getpid()
+
+        self.records  = []
+        self.snapshot = None
+        self.stack    = []
+        self.profiling = False
+
+    def measure(self, name, func, *args, **kwargs):
+        """
+
+        Run func(*args, **kwargs) as the stage name and record it
+
+        """
+        frame = {'child_peak': 0}
+        self.stack.append(frame)
+
+        _reset_peak_rss()
+        read0, write0 = _proc_io()
+        t0 = time.perf_counter()
+
+        try:
+            if name in self.cprofile and not self.profiling:
+                result = self._cprofile(name, func, *args, **kwargs)
+            else:
+                result = func(*args, **kwargs)
+        finally:
+            wall = time.perf_counter() - t0
+            read1, write1 = _proc_io()
+            peak = max(_peak_rss(), frame['child_peak'])
+
+            self.stack.pop()
+            if self.stack:
+                self.stack[-1]['child_peak'] = max(self.stack[-1]['child_peak'], peak)
+
+            self.records.append({'stage': name, 'snapshot': self.snapshot, 'rank': self.rank,
+                                 'pid': os.getpid(), 'wall': wall, 'read_bytes': read1 - read0,
+                                 'write_bytes': write1 - write0, 'peak_rss': peak})
+
+        return result
+
+    def _cprofile(self, name, func, *args, **kwargs):
+        import cProfile
+
+        if not os.path.isdir(self.cprofile_dir):
+            os.makedirs(self.cprofile_dir, exist_ok=True)
+
+        profile = cProfile.Profile()
+        self.profiling = True
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            self.profiling = False
+            profile.dump_stats(os.path.join(self.cprofile_dir, f'{name}_{self.snapshot}_{self.rank}_{os.getpid()}.prof'))
+
+    def pop_records(self):
+        """
+
+        Take the records collected so far (e.g. to send them to the root process)
+
+        """
+        records, self.records = self.records, []
+        return records
+
+    def merge(self, comm):
+        """
+
+        Gather the records of all MPI ranks on rank 0
+
+        """
+        gathered = comm.gather(self.records, root=0)
+        if comm.Get_rank() == 0:
+            self.records = [record for sublist in gathered for record in sublist]
+
+    def write(self, filename):
+        """
+
+        Write the records and a per-stage summary to JSON, or the records
+        to CSV when filename ends in .csv
+
+        """
+        if filename.endswith('.csv'):
+            with open(filename, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=self.columns)
+                writer.writeheader()
+                writer.writerows(self.records)
+            return
+
+        summary = {}
+        for record in self.records:
+            s = summary.setdefault(record['stage'], {'calls': 0, 'wall': 0.0, 'read_bytes': 0,
+                                                     'write_bytes': 0, 'peak_rss': 0})
+            s['calls'] += 1
+            s['wall']  += record['wall']
+            s['read_bytes']  += record['read_bytes']
+            s['write_bytes'] += record['write_bytes']
+            s['peak_rss'] = max(s['peak_rss'], record['peak_rss'])
+
+        with open(filename, 'w') as f:
+            json.dump({'summary': summary, 'records': self.records}, f, indent=1)
+
+def enable(rank=0, cprofile=(), cprofile_dir='./profile/'):
+    """
+
+    Enable instrumentation in this process
+
+    :return: Profiler
+
+    """
+    global _profiler
+    _profiler = Profiler(rank, cprofile, cprofile_dir)
+    return _profiler
+
+def get_profiler():
+    """
+
+    Active Profiler of this process, None if instrumentation is disabled
+
+    """
+    return _profiler
+
+def set_snapshot(snapshot):
+    """
+
+    Label the following stages with a simulation file number
+
+    """
+    if _profiler is not None:
+        _profiler.snapshot = snapshot
+
+def stage(name):
+    """
+
+    Decorator recording every call of a function as a stage
+    The function is called directly when instrumentation is disabled
+
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            return _profiler.measure(name, func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+class Collect():
+    """
+
+    Wrap a unit function so that it returns (result, records) with the
+    records of its stages, for runs where units execute in other processes
+
+    :func: callable, unit function of (k, task) units
+
+    :rank: int, rank of the worker processes when they are not instrumented yet
+
+    :cprofile, cprofile_dir: cProfile settings (see Profiler)
+
+    """
+
+    def __init__(self, func, rank=0, cprofile=(), cprofile_dir='./profile/'):
+        self.func = func
+        self.settings = (rank, list(cprofile), cprofile_dir)
+
+    def __call__(self, unit):
+        profiler = _profiler
+        if profiler is None or profiler.pid != os.getpid():
+            # worker process started (or forked) without its own profiler
+            profiler = enable(*self.settings)
+        profiler.snapshot = unit[0]
+
+        result = self.func(unit)
+        return result, profiler.pop_records()
@@ -4,10 +4,221 @@ import os
 import argparse
 from configparser import ConfigParser
 
-from mpi4py import MPI
 import numpy as np
 
-from py4radiation import simload, SED, ParameterFiles, IonTables, HeatingCoolingRates, SyntheticObservables, Diagnose
+from py4radiation import simload, VTKSlabReader, SED, ParameterFiles, IonTables, HeatingCoolingRates, SyntheticObservables, Diagnose
+from py4radiation.synthetic.coldens_stats import ColumnDensityStats
+from py4radiation.clouds.phase import PhaseHistograms, PhaseSeries
+from py4radiation.clouds.budget import MassBudget
+from py4radiation.synthetic.emission import RateTable
+from py4radiation.synthetic.spectra import SpectralProcessing, read_lines
+from py4radiation.radiation.cloudy_cache import CloudyCache
+from py4radiation.domain import DomainDecomposition
+from py4radiation.pipeline import Analysis, DiagnosticsFile, diagnostics_line, initial_conditions, run_units
+from py4radiation.manifest import Manifest
+from py4radiation.products import ProductStore
+from py4radiation.plan import Plan
+from py4radiation.follow import SnapshotWatcher, follow_units
+from py4radiation.backends import get_backend
+from py4radiation.shared import NodeArrays, share_ion_tables, use_ion_tables
+from py4radiation import instrument, writer
+
+def get_execution(c, default):
+    """
+
+    Execution backend from the [EXECUTION] section of the config file
+
+    :c: ConfigParser
+
+    :default: string, backend used when none is set
+
+    """
+    if not c.has_section('EXECUTION'):
+        return get_backend(default)
+
+    name    = c['EXECUTION'].get('backend', '') or default
+    workers = c['EXECUTION'].get('workers', '')
+
+    return get_backend(name, int(workers) if workers else None)
+
+def get_cache(section):
+    """
+
+    Cache of Cloudy grid point maps when cache is set in [RADIATION]
+    (cache_size in MB caps the store)
+
+    """
+    path = section.get('cache', '')
+    if not path:
+        return None
+
+    size = section.get('cache_size', '')
+
+    return CloudyCache(path, int(float(size) * 2**20) if size else None)
+
+def get_manifest(c, backend, simname):
+    """
+
+    Manifest of completed units when resume is set in [EXECUTION]
+
+    """
+    if not backend.root or not c.has_section('EXECUTION'):
+        return None
+
+    if c['EXECUTION'].get('resume', '').lower() not in ['yes', 'true', '1']:
+        return None
+
+    return Manifest('./clouds/' + simname + '_manifest.jsonl')
+
+def get_watcher(c, sim_files):
+    """
+
+    Watcher of the simulation files when follow is set in [EXECUTION],
+    to analyse them while the simulation runs
+
+    """
+    if not c.has_section('EXECUTION') or c['EXECUTION'].get('follow', '').lower() not in ['yes', 'true', '1']:
+        return None
+
+    interval = c['EXECUTION'].get('follow_interval', '')
+    timeout  = c['EXECUTION'].get('follow_timeout', '')
+
+    return SnapshotWatcher(sim_files, float(interval) if interval else 30.0, float(timeout) if timeout else None)
+
+def get_clumps(section, prefix=''):
+    """
+
+    Clump thresholds (tr1_min, rho_min) from a config section,
+    None when clump catalogues are not requested
+
+    """
+    tr1_min = section.get(prefix + 'clump_tr1', '')
+    rho_min = section.get(prefix + 'clump_rho', '')
+    if not tr1_min and not rho_min:
+        return None
+
+    return (float(tr1_min) if tr1_min else None, float(rho_min) if rho_min else None)
+
+def get_cuts(section, prefix=''):
+    """
+
+    (axis, positions, quantities) of the cuts from a config section,
+    None for the default n and v cuts on the z mid-plane
+
+    """
+    axis       = section.get(prefix + 'cut_axis', '') or 'z'
+    positions  = section.get(prefix + 'cut_positions', '').split()
+    quantities = section.get(prefix + 'cut_fields', '').split()
+    if not positions and not quantities:
+        return None
+
+    return axis, [int(p) for p in positions] or None, quantities or ['n', 'v']
+
+def get_products(section, prefix=''):
+    """
+
+    Store of the cuts, maps and spectra of the snapshots when a
+    products file is set in a config section, None for text files
+
+    """
+    filename = section.get(prefix + 'products', '')
+    return ProductStore(filename) if filename else None
+
+def get_phase(section, prefix=''):
+    """
+
+    Bins of the phase diagrams and PDFs from a config section,
+    None when they are not requested
+
+    """
+    if section.get(prefix + 'phase', '').lower() not in ['yes', 'true', '1']:
+        return None
+
+    ranges = {}
+    for var in ['n', 'T', 'v']:
+        limits = section.get(prefix + f'phase_{var}', '').split()
+        if limits:
+            ranges[f'{var}_range'] = (float(limits[0]), float(limits[1]))
+
+    return PhaseHistograms(**ranges)
+
+def get_budget(section, prefix=''):
+    """
+
+    Planes and bins of the mass fluxes and binned masses from a config
+    section, None when they are not requested
+
+    """
+    if section.get(prefix + 'budget', '').lower() not in ['yes', 'true', '1']:
+        return None
+
+    kwargs = {}
+    planes = section.get(prefix + 'budget_planes', '').split()
+    if planes:
+        kwargs['planes'] = [int(p) for p in planes]
+
+    for var in ['vy', 'T']:
+        limits = section.get(prefix + f'budget_{var}', '').split()
+        if limits:
+            kwargs[f'{var}_range'] = (float(limits[0]), float(limits[1]))
+
+    vy_bin = section.get(prefix + 'budget_vy_bin', '')
+    if vy_bin:
+        kwargs['vy_bin'] = float(vy_bin)
+
+    return MassBudget(**kwargs)
+
+def get_emission(section, prefix=''):
+    """
+
+    Rate tables of the emission maps from a config section: the cooling
+    of a HeatingCoolingRates file and every column of the line tables,
+    None when emission maps are not requested
+
+    """
+    if section.get(prefix + 'emission', '').lower() not in ['yes', 'true', '1']:
+        return None
+
+    tables = []
+    if section.get(prefix + 'emission_cooling', ''):
+        tables.append(RateTable(section[prefix + 'emission_cooling'], ['COOLING']))
+    for filename in section.get(prefix + 'emission_lines', '').split():
+        tables.append(RateTable(filename))
+
+    return tables
+
+def get_spectra(section, prefix=''):
+    """
+
+    Mock observation of the spectra from a config section: FWHM of the
+    line spread function (km/s), S/N per pixel, rebinning and line data,
+    None when spectra summaries are not requested
+
+    """
+    if section.get(prefix + 'spectra', '').lower() not in ['yes', 'true', '1']:
+        return None
+
+    lsf   = section.get(prefix + 'spectra_lsf', '')
+    snr   = section.get(prefix + 'spectra_snr', '')
+    rebin = section.get(prefix + 'spectra_rebin', '')
+    lines = section.get(prefix + 'spectra_lines', '')
+
+    return SpectralProcessing(float(lsf) if lsf else None, float(snr) if snr else None, int(rebin) if rebin else 1,
+                              read_lines(lines) if lines else None)
+
+def enable_profiling(c, rank=0):
+    """
+
+    Enable instrumentation when a report file is set in [EXECUTION]
+
+    :return: report file, None when disabled
+
+    """
+    if not c.has_section('EXECUTION') or not c['EXECUTION'].get('profile', ''):
+        return None
+
+    instrument.enable(rank, c['EXECUTION'].get('cprofile', '').split())
+    return c['EXECUTION']['profile']
 
 def main():
     parser = argparse.ArgumentParser(
@@ -16,6 +227,8 @@ def main():
     )
 
     parser.add_argument('-f', type=str, required=True, help='CONFIG file')
+    parser.add_argument('--plan', action='store_true', help='report Cloudy runs, outputs, memory and ranks without running')
+    parser.add_argument('--calibrate', type=str, default=None, help='profile report of a sample run to calibrate the plan')
 
     file = parser.parse_args()
     c = ConfigParser()
@@ -26,6 +239,13 @@ def main():
     if not mode in [1, 2, 3, 4]:
         raise ValueError('Error: wrong mode.')
 
+    if file.plan:
+        print('\n'.join(Plan(c, file.calibrate).make()))
+        return
+
+    report = enable_profiling(c)
+    root = True
+
     if mode == 1:
         print('PHOTOIONISATION + RADIATIVE HEATING & COOLING mode')
 
@@ -34,8 +254,8 @@ def main():
 
         if c['RADIATION']['sedfile'] != None:
             sedfile = c['RADIATION']['sedfile']
-            distance = c['RADIATION']['distance']
-            age = c['RADIATION']['age']
+            distance = float(c['RADIATION']['distance'])
+            age = int(c['RADIATION']['age'])
 
             sed = SED(run_name, sedfile, distance, redshift, age)
             sed.getFile()
@@ -46,7 +266,7 @@ def main():
             elements = c['RADIATION']['elements']
             resolution = c['RADIATION']['resolution']
 
-            parfiles = ParameterFiles(cloudypath, run_name, elements, redshift, resolution)
+            parfiles = ParameterFiles(cloudypath, run_name, elements, redshift, resolution, cache=get_cache(c['RADIATION']))
             parfiles.getIonFractions()
             parfiles.getHeatingCooling()
             print('IB/CH parameter files created.')
@@ -57,7 +277,7 @@ def main():
             outfile = c['RADIATION']['outfile']
             elements = c['RADIATION']['elements']
 
-            ionbalance = IonTables(ibpath, runfile, outfile, elements)
+            ionbalance = IonTables(ibpath, runfile, outfile, elements.split(), cache=get_cache(c['RADIATION']), grid=c['RADIATION'].get('grid', ''))
             ionbalance.get_ion_tables()
 
         elif c['RADIATION']['hcpath'] != None:
@@ -65,7 +285,7 @@ def main():
             runfile = c['RADIATION']['runfile']
             outfile = c['RADIATION']['outfile']
 
-            hcrates = HeatingCoolingRates(hcpath, runfile, outfile)
+            hcrates = HeatingCoolingRates(hcpath, runfile, outfile, cache=get_cache(c['RADIATION']), grid=c['RADIATION'].get('grid', ''))
             hcrates.get_hc_rates()
 
         else:
@@ -87,6 +307,9 @@ def main():
         observables = SyntheticObservables(fields, shape, ions, units)
         observables.get_column_densities()
         print('Column Densities done')
+        if c['OBSERVABLES'].get('obs_pv_dv', ''):
+            observables.get_pv_cubes(dv=float(c['OBSERVABLES']['obs_pv_dv']))
+            print('Position-velocity cubes done')
         observables.get_mock_spectra()
         print('Mock absorption spectra done')
 
@@ -96,36 +319,81 @@ def main():
         simpath = c['CLOUDS']['cl_simpath']
         simname = c['CLOUDS']['cl_simname']
 
-        output_lines = ['n T v vx vy vz fmix x_CM y_CM z_CM x_sg y_sg z_sg vx_sg vy_sg vz_sg']
-
         if not os.path.isdir('./clouds/'):
             os.mkdir('./clouds/')
 
         sim_nums = ['{:04d}'.format(i) for i in range(81)]
         sim_files = [simpath + f'data.{sim}.vtk' for sim in sim_nums]
 
-        fields_1, shape = simload(simpath + sim_files[0])
-        diagnostics = Diagnose(fields_1, shape)
-        
-        for i in range(81):
-            if i == 0:
-                fields = fields_1
-            else:
-                fields, _ = simload(sim_files[i])
-                
-            avs, v_avs, fmix, j_cm, j_sg, v_sg = diagnostics.get_sim_diagnostics(fields)
-            output_lines.append('{0:.14e} {1:.14e} {2:.14e} {3:.14e} {4:.14e} {5:.14e} {6:.14e} {7:.14e} {8:.14e} {9:.14e} {10:.14e} {11:.14e} {12:.14e} {13:.14e} {14:.14e} {15:.14e}'.format(avs[0], avs[1], avs[2], v_avs[0], v_avs[1], v_avs[2], fmix, j_cm[0], j_cm[1], j_cm[2], j_sg[0], j_sg[1], j_sg[2], v_sg[0], v_sg[1], v_sg[2]))
-            print('Diagnostics done')
-            
-            diagnostics.get_cuts(fields, sim_nums[i])
-            print('Cuts done')
-            
-            print(f'SIMULATION {i + 1} of 81 done')
-            
-        nfile = './clouds/' + simname + '_diagnostics.dat'
-        with open(nfile, 'w') as f:
-            f.write('\n'.join(output_lines))
-            
+        # snapshots are streamed from disk in z-slabs when a memory bound (in MB) is set
+        max_memory = c['CLOUDS'].get('cl_max_memory', '')
+        max_memory = int(float(max_memory) * 2**20) if max_memory else None
+
+        backend = get_execution(c, 'serial')
+        root = backend.root
+        if report is not None:
+            instrument.get_profiler().rank = backend.rank
+
+        watcher = get_watcher(c, sim_files)
+
+        if backend.root:
+            if watcher is not None and not watcher.wait(0):
+                raise RuntimeError(f'Error: {sim_files[0]} not written before the follow timeout')
+            shape, M0 = initial_conditions(sim_files[0], max_memory)
+        else:
+            shape, M0 = None, None
+
+        shape, M0 = backend.bcast((shape, M0))
+
+        # quick-look diagnostics on block averages of level^3 cells
+        level = int(c['CLOUDS'].get('cl_level', '') or 1)
+
+        # phase diagrams and PDFs are filled in the pass of the diagnostics
+        phase = get_phase(c['CLOUDS'], 'cl_')
+
+        # mass fluxes through y planes and cloud mass in vy and T bins, in the same pass
+        budget = get_budget(c['CLOUDS'], 'cl_')
+
+        # diagnostics and clumps on the cells of cloud gas only, with tr1 above this threshold
+        sparse = c['CLOUDS'].get('cl_sparse', '')
+
+        # cuts of every snapshot in one HDF5 file instead of text files
+        products = get_products(c['CLOUDS'], 'cl_')
+
+        analysis = Analysis(sim_files, sim_nums, shape, M0, max_memory=max_memory, level=level,
+                            clumps=get_clumps(c['CLOUDS'], 'cl_'), phase=phase, budget=budget, cuts=get_cuts(c['CLOUDS'], 'cl_'),
+                            sparse=float(sparse) if sparse else None, products=products)
+
+        if backend.root:
+            diagfile = DiagnosticsFile('./clouds/' + simname + '_diagnostics.dat', Analysis.header)
+            if phase is not None:
+                series = PhaseSeries(phase, analysis.diagnostics.dV)
+
+        def collect(unit, result):
+            line, hist = result
+            diagfile.add(unit[0], line)
+            if hist is not None:
+                series.add(sim_nums[unit[0]], hist)
+
+        def write_phase():
+            if phase is not None:
+                series.write('./clouds/' + simname + '_phase.h5')
+
+        manifest = get_manifest(c, backend, simname)
+        if products is not None and backend.root and manifest is None:
+            products.clear()
+
+        if watcher is not None:
+            follow_units(backend, analysis, watcher, ['clouds'], collect, manifest, write_phase)
+        else:
+            run_units(backend, analysis, [(k, 'clouds') for k in range(81)], collect, manifest)
+
+        if backend.root:
+            diagfile.close()
+            write_phase()
+            if products is not None:
+                products.join()
+
         print('DIAGNOSTICS and CUTS done')
 
     else:
@@ -136,63 +404,233 @@ def main():
         ions    = np.genfromtxt(c['ANALYSIS']['ionsfile'], dtype=None)
         units   = np.genfromtxt(c['ANALYSIS']['unitsfile'], dtype=None)[:, 1]
 
+        thresholds = c['ANALYSIS'].get('coldens_thresholds', '').split()
+        ionlabels  = [f'{row[0]}{row[2]}' for row in ions]
+        if thresholds:
+            stats = ColumnDensityStats(ionlabels, [float(t) for t in thresholds])
+        else:
+            stats = ColumnDensityStats(ionlabels)
+
+        pv_dv = c['ANALYSIS'].get('pv_dv', '')
+
+        # with shared_tables the ion fractions are loaded once per node
+        # and mapped by every process instead of loaded by each one
+        ionization_table = c['ANALYSIS'].get('ionization_table', '') or None
+        shared_tables = c.has_section('EXECUTION') and c['EXECUTION'].get('shared_tables', '').lower() in ['yes', 'true', '1']
+        if shared_tables and ionization_table is None:
+            raise ValueError('Error: shared_tables needs an ionization_table in [ANALYSIS]')
+        elements = list(dict.fromkeys(row[0] for row in ions))
+        shared = None
+
         if not os.path.isdir('./observables/'):
             os.mkdir('./observables/')
 
         if not os.path.isdir('./clouds/'):
             os.mkdir('./clouds/')
 
-        comm = MPI.COMM_WORLD
-        rank = comm.Get_rank()
-        size = comm.Get_size()
-        
         sim_nums = ['{:04d}'.format(i) for i in range(81)]
         sim_files = [simpath + f'data.{sim}.vtk' for sim in sim_nums]
 
-        fields_1, shape = simload(sim_files[0])
-        diagnostics = Diagnose(fields_1, shape)
-        print('FIRST SIMULATION LOADED')
-        
-        if rank == 0:
-            output_lines = ['n T v vx vy vz fmix x_CM y_CM z_CM x_sg y_sg z_sg vx_sg vy_sg vz_sg']
-            fields = fields_1
-            observables = SyntheticObservables(sim_nums[0], fields, shape, ions, units)
-            observables.get_column_densities()
-            observables.get_mock_spectra()
-
-            avs, v_avs, fmix, j_cm, j_sg, v_sg = diagnostics.get_sim_diagnostics(fields)
-            line = ('{0:.14e} {1:.14e} {2:.14e} {3:.14e} {4:.14e} {5:.14e} {6:.14e} {7:.14e} {8:.14e} {9:.14e} {10:.14e} {11:.14e} {12:.14e} {13:.14e} {14:.14e} {15:.14e}'.format(avs[0], avs[1], avs[2], v_avs[0], v_avs[1], v_avs[2], fmix, j_cm[0], j_cm[1], j_cm[2], j_sg[0], j_sg[1], j_sg[2], v_sg[0], v_sg[1], v_sg[2]))
-            output_lines.append(line)
-
-            diagnostics.get_cuts(fields, sim_nums[0])
-            print(f'SIMULATION 1 of 81 done')
-
-        process = [j for j in range(1, 81) if (j - 1) % size == rank]
-        local_data = []
-        for k in process:
-            fields, _ = simload(sim_files[k])
-            observables = SyntheticObservables(sim_nums[k], fields, shape, ions, units)
-            observables.get_column_densities()
-            observables.get_mock_spectra()
-            
-            avs, v_avs, fmix, j_cm, j_sg, v_sg = diagnostics.get_sim_diagnostics(fields)
-            line = ('{0:.14e} {1:.14e} {2:.14e} {3:.14e} {4:.14e} {5:.14e} {6:.14e} {7:.14e} {8:.14e} {9:.14e} {10:.14e} {11:.14e} {12:.14e} {13:.14e} {14:.14e} {15:.14e}'.format(avs[0], avs[1], avs[2], v_avs[0], v_avs[1], v_avs[2], fmix, j_cm[0], j_cm[1], j_cm[2], j_sg[0], j_sg[1], j_sg[2], v_sg[0], v_sg[1], v_sg[2]))
-            local_data.append((k, line))
-            
-            diagnostics.get_cuts(fields, sim_nums[k])
-            print(f'SIMULATION {k + 1} of 81 done')
-
-        gathered = comm.gather(local_data, root=0)
-        if rank == 0:
-            all_data = [item for sublist in gathered for item in sublist]
-            for k, line in sorted(all_data, key=lambda x: x[0]):
-                output_lines.append(line)
-                
-            nfile = './clouds/' + simname + '_diagnostics.dat'
-            with open(nfile, 'w') as f:
-                f.write('\n'.join(output_lines))
-            
+        # ranks split each simulation file in z-slabs in groups of domain_ranks,
+        # the groups split the series
+        domain_ranks = int(c['ANALYSIS'].get('domain_ranks', '') or 1)
+
+        # quick-look analysis on block averages of level^3 cells
+        level = int(c['ANALYSIS'].get('level', '') or 1)
+
+        # phase diagrams and PDFs are filled in the pass of the diagnostics
+        phase = get_phase(c['ANALYSIS'])
+
+        # mass fluxes through y planes and cloud mass in vy and T bins, in the same pass
+        budget = get_budget(c['ANALYSIS'])
+
+        # emission measure, cooling and line emission maps with the observables
+        emission = get_emission(c['ANALYSIS'])
+
+        # equivalent widths and AOD column densities of the mock spectra
+        spectra = get_spectra(c['ANALYSIS'])
+
+        cuts = get_cuts(c['ANALYSIS']) or ('z', None, ['n', 'v'])
+
+        # cuts, maps and spectra of every snapshot in one HDF5 file instead of text files
+        products = get_products(c['ANALYSIS'])
+
+        # diagnostics and clumps on the cells of cloud gas only, with tr1 above this threshold
+        sparse = c['ANALYSIS'].get('sparse', '')
+        sparse = float(sparse) if sparse else None
+
+        watcher = get_watcher(c, sim_files)
+
+        if domain_ranks > 1:
+            if watcher is not None:
+                raise ValueError('Error: follow is not available with domain_ranks > 1')
+            if level > 1:
+                raise ValueError('Error: level is not available with domain_ranks > 1')
+            if get_clumps(c['ANALYSIS']):
+                raise ValueError('Error: clumps are not available with domain_ranks > 1')
+            if sparse is not None:
+                raise ValueError('Error: sparse is not available with domain_ranks > 1')
+
+            from mpi4py import MPI
+
+            comm = MPI.COMM_WORLD
+            rank = comm.Get_rank()
+            size = comm.Get_size()
+            root = rank == 0
+            if report is not None:
+                instrument.get_profiler().rank = rank
+
+            ngroups = (size + domain_ranks - 1) // domain_ranks
+            color   = rank // domain_ranks
+            group   = comm.Split(color, rank)
+
+            shape  = VTKSlabReader(sim_files[0]).shape
+            domain = DomainDecomposition(group, shape)
+
+            diagnostics = Diagnose(None, shape, M0=0)
+            diagnostics.M0 = domain.get_M0(domain.load(sim_files[0]), diagnostics.dV)
+            print('FIRST SIMULATION LOADED')
+
+            if phase is not None:
+                series = PhaseSeries(phase, diagnostics.dV)
+
+            if shared_tables:
+                shared = NodeArrays(comm)
+                share_ion_tables(shared, ionization_table, elements)
+                use_ion_tables(shared, ions)
+
+            if products is not None:
+                if rank == 0:
+                    products.clear()
+                comm.Barrier()
+                writer.set_products(products)
+
+            if rank == 0:
+                output_lines = [Analysis.header]
+
+            local_data = []
+            for k in [j for j in range(81) if j % ngroups == color]:
+                instrument.set_snapshot(k)
+                fields = domain.load(sim_files[k])
+                domain.get_observables(sim_nums[k], fields, ions, units, stats, float(pv_dv) if pv_dv else None,
+                                       ionization_table, emission, spectra)
+
+                hist = None if phase is None else phase.empty()
+                mass = None if budget is None else budget.empty(shape[1])
+                avs, v_avs, fmix, j_cm, j_sg, v_sg = domain.get_sim_diagnostics(diagnostics, fields, hist, mass)
+                if group.Get_rank() == 0:
+                    if budget is not None:
+                        diagnostics.write_budget(mass, sim_nums[k])
+                    local_data.append((k, diagnostics_line(avs, v_avs, fmix, j_cm, j_sg, v_sg)))
+                    if phase is not None:
+                        series.add(sim_nums[k], hist)
+
+                domain.get_cuts(fields, sim_nums[k], *cuts)
+                print(f'SIMULATION {k + 1} of 81 done')
+
+            # every part of the product store is complete before the join
+            writer.flush()
+
+            stats.merge(comm)
+            if phase is not None:
+                series.merge(comm)
+            if report is not None:
+                instrument.get_profiler().merge(comm)
+
+            gathered = comm.gather(local_data, root=0)
+            if rank == 0:
+                stats.write('./observables/' + simname + '_coldens_stats.dat')
+                if phase is not None:
+                    series.write('./clouds/' + simname + '_phase.h5')
+
+                all_data = [item for sublist in gathered for item in sublist]
+                for k, line in sorted(all_data, key=lambda x: x[0]):
+                    output_lines.append(line)
+
+                nfile = './clouds/' + simname + '_diagnostics.dat'
+                with open(nfile, 'w') as f:
+                    f.write('\n'.join(output_lines))
+
+                if products is not None:
+                    products.join()
+
+        else:
+            backend = get_execution(c, 'mpi')
+            root = backend.root
+            if report is not None:
+                instrument.get_profiler().rank = backend.rank
+
+            # only one process loads the first simulation file for the initial mass
+            if backend.root:
+                if watcher is not None and not watcher.wait(0):
+                    raise RuntimeError(f'Error: {sim_files[0]} not written before the follow timeout')
+                shape, M0 = initial_conditions(sim_files[0])
+                print('FIRST SIMULATION LOADED')
+            else:
+                shape, M0 = None, None
+
+            shape, M0 = backend.bcast((shape, M0))
+
+            if shared_tables:
+                shared = backend.shared_arrays()
+                if shared is not None:
+                    share_ion_tables(shared, ionization_table, elements)
+
+            analysis = Analysis(sim_files, sim_nums, shape, M0, ions, units,
+                                [float(t) for t in thresholds], float(pv_dv) if pv_dv else None,
+                                ionization_table=ionization_table, shared=shared, level=level,
+                                clumps=get_clumps(c['ANALYSIS']), phase=phase, budget=budget, emission=emission, cuts=cuts,
+                                sparse=sparse, spectra=spectra, products=products)
+
+            # the expensive observables go first so that the queue ends with short units
+            work = [(k, 'observables') for k in range(81)] + [(k, 'clouds') for k in range(81)]
+
+            if backend.root:
+                diagfile = DiagnosticsFile('./clouds/' + simname + '_diagnostics.dat', Analysis.header)
+                if phase is not None:
+                    series = PhaseSeries(phase, analysis.diagnostics.dV)
+
+            def collect(unit, result):
+                k, task = unit
+                if task == 'clouds':
+                    line, hist = result
+                    diagfile.add(k, line)
+                    if hist is not None:
+                        series.add(sim_nums[k], hist)
+                else:
+                    stats.update(result)
+
+            def write_stats():
+                stats.write('./observables/' + simname + '_coldens_stats.dat')
+                if phase is not None:
+                    series.write('./clouds/' + simname + '_phase.h5')
+
+            manifest = get_manifest(c, backend, simname)
+            if products is not None and backend.root and manifest is None:
+                products.clear()
+
+            if watcher is not None:
+                # the statistics are rewritten as every batch of files is analysed
+                follow_units(backend, analysis, watcher, ['observables', 'clouds'], collect, manifest, write_stats)
+            else:
+                run_units(backend, analysis, work, collect, manifest)
+
+            if backend.root:
+                diagfile.close()
+                write_stats()
+                if products is not None:
+                    products.join()
+
+        if shared is not None:
+            shared.close()
+
         print('FULL ANALYSIS done')
 
+    # raise here any error of the outputs still being written
+    writer.flush()
+
+    if report is not None and root:
+        instrument.get_profiler().write(report)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+
+class Manifest():
+    """
+
+    Record of completed analysis units, so that an interrupted run
+    can be restarted skipping the units that are already done
+
+    Every completed unit is appended as one JSON line with the
+    fingerprint of its input, its output files and its result
+
+    :filename: string
+
+        Path to the manifest file (created if missing)
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.records  = {}
+
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # last line of a run killed while writing
+                        continue
+                    self.records[(record['k'], record['task'])] = record
+
+    @staticmethod
+    def fingerprint(simfile, *params):
+        """
+
+        Fingerprint of the input of a unit: size and modification time
+        of the simulation file and the analysis parameters
+
+        """
+        st = os.stat(simfile)
+        key = repr((os.path.abspath(simfile), st.st_size, st.st_mtime_ns) + params)
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def completed(self, unit, fingerprint):
+        """
+
+        Record of a unit if it was completed with the same input
+        and all its outputs still exist, None otherwise
+
+        """
+        record = self.records.get(tuple(unit))
+        if record is None or record['fingerprint'] != fingerprint:
+            return None
+
+        if not all(os.path.exists(path) for path in record['outputs']):
+            return None
+
+        return record
+
+    def record(self, unit, fingerprint, outputs, result):
+        """
+
+        Append a completed unit to the manifest
+
+        :unit: tuple, (k, task)
+
+        :fingerprint: string, fingerprint of the input
+
+        :outputs: list, paths to the output files of the unit
+
+        :result: JSON-serialisable result of the unit
+
+        """
+        k, task = unit
+        record = {'k': k, 'task': task, 'fingerprint': fingerprint,
+                  'outputs': list(outputs), 'result': result}
+        self.records[(k, task)] = record
+
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+from . import instrument, writer
+from .simload import simload, VTKSlabReader
+from .manifest import Manifest
+from .shared import use_ion_tables
+from .clouds.diagnose import Diagnose
+from .clouds.cloud_cuts import CloudCuts
+from .synthetic.observables import SyntheticObservables
+from .synthetic.coldens_stats import ColumnDensityStats
+
+def diagnostics_line(avs, v_avs, fmix, j_cm, j_sg, v_sg):
+    return '{0:.14e} {1:.14e} {2:.14e} {3:.14e} {4:.14e} {5:.14e} {6:.14e} {7:.14e} {8:.14e} {9:.14e} {10:.14e} {11:.14e} {12:.14e} {13:.14e} {14:.14e} {15:.14e}'.format(avs[0], avs[1], avs[2], v_avs[0], v_avs[1], v_avs[2], fmix, j_cm[0], j_cm[1], j_cm[2], j_sg[0], j_sg[1], j_sg[2], v_sg[0], v_sg[1], v_sg[2])
+
+def initial_conditions(simfile, max_memory=None):
+    """
+
+    Shape of the computational box and initial mass of the cloud
+    from the first simulation file
+
+    :simfile: string, path to the first simulation file
+
+    :max_memory: int, optional, stream the file in z-slabs of at most max_memory bytes
+
+    """
+    if max_memory:
+        fields_1 = VTKSlabReader(simfile)
+        return fields_1.shape, Diagnose(fields_1, fields_1.shape, max_memory).M0
+
+    fields_1, shape = simload(simfile)
+    return shape, Diagnose(fields_1, shape).M0
+
+class Analysis():
+    """
+
+    Units of work of the analysis of a series of simulation files
+
+    A unit is (k, task) for the k-th simulation file, with task
+    'clouds' (diagnostics and cuts) or 'observables' (column densities,
+    position-velocity cubes and mock spectra)
+
+    :sim_files: list
+
+        Paths to the simulation files
+
+    :sim_nums: list
+
+        Numbers of the simulation files to label output files
+
+    :shape: tuple
+
+        Dimensions of the computational box
+
+    :M0: float
+
+        Initial mass of the cloud
+
+    :ions: numpy array, optional
+
+        Set of ions for analysis (needed for 'observables')
+
+    :units: numpy array, optional
+
+        Units array (see SyntheticObservables)
+
+    :thresholds: list, optional
+
+        log10 N thresholds of the column density statistics
+
+    :pv_dv: float, optional
+
+        Width of the velocity channels of position-velocity cubes in km/s
+
+    :max_memory: int, optional
+
+        Memory bound in bytes to stream simulation files in z-slabs
+        for 'clouds' (see VTKSlabReader)
+
+    :ionization_table: string, optional
+
+        Path to the ion fractions file for Trident
+
+    :shared: NodeArrays or ProcessArrays, optional
+
+        Shared ion fractions of ionization_table (see share_ion_tables)
+
+    :level: int, optional
+
+        Downsampling factor for a quick-look analysis (see pyramid)
+
+    :clumps: tuple, optional
+
+        (tr1_min, rho_min) thresholds to write clump catalogues
+        with 'clouds' (see CloudClumps)
+
+    :phase: PhaseHistograms, optional
+
+        Bins of the phase diagrams and PDFs filled with 'clouds'
+
+    :budget: MassBudget, optional
+
+        Planes and bins of the mass fluxes and binned masses filled
+        with 'clouds', written for every simulation file
+
+    :emission: list, optional
+
+        RateTable objects for emission maps with 'observables'
+        (see EmissionMaps), None for no emission maps
+
+    :cuts: tuple, optional
+
+        (axis, positions, quantities) of the cuts with 'clouds'
+        (see CloudCuts, default: n and v on the z mid-plane)
+
+    :sparse: float, optional
+
+        Tracer threshold of the cloud region for 'clouds': the
+        diagnostics and clumps only go through cells with tr1 > sparse
+        (see CloudRegion)
+
+    :spectra: SpectralProcessing, optional
+
+        Mock observation and measurements of the spectra of
+        'observables', written as one summary table per simulation file
+
+    :products: ProductStore, optional
+
+        Store of the cuts, maps and spectra of the units instead of
+        text files (see ProductStore)
+
+    """
+
+    header = 'n T v vx vy vz fmix x_CM y_CM z_CM x_sg y_sg z_sg vx_sg vy_sg vz_sg'
+
+    def __init__(self, sim_files, sim_nums, shape, M0, ions=None, units=None, thresholds=None, pv_dv=None, max_memory=None,
+                 ionization_table=None, shared=None, level=1, clumps=None, phase=None, budget=None,
+                 emission=None, cuts=None, sparse=None, spectra=None, products=None):
+        self.sim_files = sim_files
+        self.sim_nums  = sim_nums
+        self.shape = shape
+        self.ions  = ions
+        self.units = units
+        self.thresholds = thresholds
+        self.pv_dv = pv_dv
+        self.ionization_table = ionization_table
+        self.shared = shared
+        self.level  = level
+        self.clumps = clumps
+        self.phase  = phase
+        self.budget = budget
+        self.emission = emission
+        self.cuts = cuts or ('z', None, ('n', 'v'))
+        self.sparse = sparse
+        self.spectra  = spectra
+        self.products = products
+
+        if sparse is not None and (max_memory or phase is not None):
+            raise ValueError('Error: sparse cloud regions need the whole fields in memory and no phase histograms')
+
+        self.max_memory = max_memory
+
+        if max_memory:
+            self.diagnostics = Diagnose(None, shape, max_memory, M0=M0, level=level)
+        else:
+            self.diagnostics = Diagnose(None, shape, M0=M0, level=level)
+
+    def new_stats(self):
+        """
+
+        Empty column density statistics for the ions of the analysis
+
+        """
+        ionlabels = [f'{row[0]}{row[2]}' for row in self.ions]
+        if self.thresholds:
+            return ColumnDensityStats(ionlabels, self.thresholds)
+        return ColumnDensityStats(ionlabels)
+
+    def fingerprint(self, unit):
+        """
+
+        Fingerprint of the input and parameters of a unit (see Manifest)
+
+        """
+        k, task = unit
+        products = None if self.products is None else self.products.filename
+        if task == 'clouds':
+            phase = None if self.phase is None else self.phase.spec()
+            budget = None if self.budget is None else self.budget.spec()
+            return Manifest.fingerprint(self.sim_files[k], task, self.diagnostics.M0, self.level, self.clumps, phase,
+                                        self.cuts, self.sparse, products, budget)
+
+        ions = [list(map(str, row)) for row in self.ions]
+        emission = None if self.emission is None else [(table.filename, table.columns) for table in self.emission]
+        spectra  = None if self.spectra is None else self.spectra.spec()
+        return Manifest.fingerprint(self.sim_files[k], task, ions, list(map(str, self.units)), self.thresholds, self.pv_dv,
+                                   self.ionization_table, self.level, emission, products, spectra)
+
+    def outputs(self, unit):
+        """
+
+        Output files of a unit (with products, the files that are
+        not in the product store)
+
+        """
+        k, task = unit
+        simnum = self.sim_nums[k]
+        # tables are in the part files of the product store
+        tables = self.products is None
+
+        if task == 'clouds':
+            axis, positions, quantities = self.cuts
+            outputs = []
+            if tables:
+                outputs += [CloudCuts.filename(simnum, name, axis, position) for position in positions or [None] for name in quantities]
+            if self.clumps:
+                outputs.append(f'./clouds/{simnum}_clumps.dat')
+            if self.budget is not None:
+                outputs.append(f'./clouds/{simnum}_budget.h5')
+            return outputs
+
+        outputs = []
+        for row in self.ions:
+            prefix = f'./observables/{row[0]}/{simnum}_{row[0]}{row[2]}'
+            if tables:
+                outputs += [prefix + '_coldens_xz.dat', prefix + '_coldens_yz.dat']
+                outputs += [prefix + f'_ray{n}.dat' for n in range(1, 4)]
+            if self.pv_dv:
+                outputs.append(prefix + '_pv.h5')
+
+        if self.emission is not None and tables:
+            names = ['EM'] + [name for table in self.emission for name in table.columns]
+            outputs += [f'./observables/emission/{simnum}_{name}_{view}.dat' for name in names for view in ['xz', 'yz']]
+
+        if self.spectra is not None:
+            outputs.append(f'./observables/{simnum}_spectra.dat')
+
+        return outputs
+
+    def encode(self, unit, result):
+        """
+
+        JSON-serialisable result of a unit for the manifest
+
+        """
+        if unit[1] == 'clouds':
+            line, phase = result
+            return {'line': line, 'phase': None if phase is None else phase.todict()}
+
+        return result.todict()
+
+    def decode(self, unit, result):
+        """
+
+        Result of a unit from the manifest
+
+        """
+        if unit[1] == 'clouds':
+            phase = result['phase']
+            return result['line'], None if phase is None else self.phase.fromdict(phase)
+
+        return self.new_stats().fromdict(result)
+
+    def run(self, unit):
+        """
+
+        Run a unit of work
+
+        :unit: tuple, (k, task)
+
+        :return: diagnostics line and phase histograms (None without phase)
+                 for 'clouds', column density statistics for 'observables'
+
+        """
+        k, task = unit
+
+        # set in every process, also in spawned pool processes
+        writer.set_products(self.products)
+
+        if task == 'clouds' and self.max_memory:
+            fields = VTKSlabReader(self.sim_files[k])
+        else:
+            fields, _ = simload(self.sim_files[k])
+
+        if task == 'clouds':
+            phase  = None if self.phase is None else self.phase.empty()
+            budget = None if self.budget is None else self.budget.empty(self.diagnostics.grid[1])
+            if self.sparse is not None:
+                fields = self.diagnostics.get_region(fields, self.sparse)
+            avs, v_avs, fmix, j_cm, j_sg, v_sg = self.diagnostics.get_sim_diagnostics(fields, phase, budget)
+            if budget is not None:
+                self.diagnostics.write_budget(budget, self.sim_nums[k])
+            self.diagnostics.get_cuts(fields, self.sim_nums[k], *self.cuts)
+            if self.clumps:
+                self.diagnostics.get_clumps(fields, self.sim_nums[k], *self.clumps)
+            result = diagnostics_line(avs, v_avs, fmix, j_cm, j_sg, v_sg), phase
+
+        elif task == 'observables':
+            stats = self.new_stats()
+            if self.shared is not None:
+                use_ion_tables(self.shared, self.ions)
+            observables = SyntheticObservables(self.sim_nums[k], fields, self.shape, self.ions, self.units,
+                                               ionization_table=self.ionization_table, level=self.level)
+            observables.get_column_densities(stats)
+            if self.emission is not None:
+                observables.get_emission_maps(self.emission)
+            if self.pv_dv:
+                observables.get_pv_cubes(dv=self.pv_dv)
+            batch = observables.get_mock_spectra()
+            if self.spectra is not None:
+                observables.get_spectra_summary(self.spectra, batch)
+            result = stats
+
+        else:
+            raise ValueError(f'Error: unknown task {task}')
+
+        # outputs are complete when a unit returns (see Manifest),
+        # also in pool processes, which exit without atexit handlers
+        writer.flush()
+
+        print(f'SIMULATION {k + 1} of {len(self.sim_files)} {task} done')
+        return result
+
+class DiagnosticsFile():
+    """
+
+    Diagnostics table written as results arrive, in the order
+    of the simulation files
+
+    :filename: string
+
+        Path to the diagnostics file
+
+    :header: string
+
+        Header line of the table
+
+    """
+
+    def __init__(self, filename, header):
+        self.filename = filename
+        self.pending  = {}
+        self.next_k   = 0
+
+        with open(filename, 'w') as f:
+            f.write(header)
+
+    def add(self, k, line):
+        """
+
+        Add the diagnostics line of the k-th simulation file, writing
+        every line that is now in order
+
+        """
+        self.pending[k] = line
+
+        lines = []
+        while self.next_k in self.pending:
+            lines.append(self.pending.pop(self.next_k))
+            self.next_k += 1
+
+        if lines:
+            with open(self.filename, 'a') as f:
+                f.write(''.join('\n' + line for line in lines))
+
+    def close(self):
+        """
+
+        Write the lines still waiting for an earlier simulation file
+
+        """
+        with open(self.filename, 'a') as f:
+            f.write(''.join('\n' + self.pending[k] for k in sorted(self.pending)))
+
+        self.pending = {}
+
+def run_units(backend, analysis, units, callback, manifest=None):
+    """
+
+    Run analysis units on an execution backend, skipping the units
+    completed in a previous run when a manifest is given
+
+    :backend: execution backend (see backends)
+
+    :analysis: Analysis
+
+    :units: list of (k, task)
+
+    :callback: callable, callback(unit, result) on the root process
+
+    :manifest: Manifest, optional
+
+    """
+    func = analysis.run
+
+    # with instrumentation the records of each unit travel back with its result
+    profiler = instrument.get_profiler()
+    if profiler is not None:
+        func = instrument.Collect(analysis.run, profiler.rank, profiler.cprofile, profiler.cprofile_dir)
+
+    def collect(unit, result):
+        if profiler is not None:
+            result, records = result
+            profiler.records += records
+
+        if manifest is not None:
+            manifest.record(unit, analysis.fingerprint(unit), analysis.outputs(unit), analysis.encode(unit, result))
+
+        callback(unit, result)
+
+    todo = units
+    if manifest is not None and backend.root:
+        todo = []
+        for unit in units:
+            record = manifest.completed(unit, analysis.fingerprint(unit))
+            if record is None:
+                todo.append(unit)
+            else:
+                callback(unit, analysis.decode(unit, record['result']))
+
+        print(f'{len(units) - len(todo)} of {len(units)} units already done')
+
+    backend.run(todo, func, collect)
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+
+import os
+import json
+
+import numpy as np
+
+from .simload import VTKSlabReader
+from .pyramid import level_shape
+
+# bytes per value of the text tables (str of a float and a tab, see write_table)
+TEXT_BYTES = 13
+
+# elements up to Zn, for the number of ions (Z + 1) of the ion fraction maps
+SYMBOLS = ['H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne', 'Na', 'Mg', 'Al', 'Si', 'P',
+           'S', 'Cl', 'Ar', 'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn']
+
+# rows of a mock spectrum (-500 to 0 km/s in 1 km/s bins, see MockSpectra.getSpectrum)
+SPECTRUM_ROWS = 501
+
+def human(nbytes):
+    """
+
+    Size in bytes as a readable string
+
+    """
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(nbytes) < 1024 or unit == 'TB':
+            return f'{nbytes:.1f} {unit}' if unit != 'B' else f'{int(nbytes)} B'
+        nbytes /= 1024
+
+def node_memory():
+    """
+
+    Physical memory of this machine in bytes
+
+    """
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+class Plan():
+    """
+
+    Dry-run report of a configuration: Cloudy runs, output files and
+    bytes per stage, peak memory per rank and recommended rank count,
+    from the config file and the headers of the inputs only
+
+    Without calibration, times are not estimated and memory is the
+    size of the arrays a unit holds (fields, maps, work arrays); with
+    the profile report of a sample run of the same configuration
+    (see instrument), measured wall time and peak memory per
+    simulation file are projected to the whole series
+
+    :c: ConfigParser
+
+    :report: string, optional
+
+        Profile report (JSON) of a sample run
+
+    """
+
+    def __init__(self, c, report=None):
+        self.c = c
+        self.mode = int(c['MODE']['mode'])
+        self.lines  = []
+        self.stages = []
+        self.peak   = None
+        self.units  = None
+        self.files  = None
+        self.domain_ranks = 1
+
+        self.calibration = None
+        if report:
+            with open(report) as f:
+                self.calibration = json.load(f)
+
+    def stage(self, name, files, nbytes):
+        """
+
+        Add the output files and bytes of a stage
+
+        """
+        self.stages.append((name, int(files), int(nbytes)))
+
+    def make(self):
+        """
+
+        Plan of the mode of the configuration
+
+        :return: list of report lines
+
+        """
+        if self.mode == 1:
+            self.plan_radiation()
+        elif self.mode == 2:
+            self.plan_observables()
+        elif self.mode in [3, 4]:
+            self.plan_series()
+        else:
+            raise ValueError('Error: wrong mode.')
+
+        return self.report()
+
+    def plan_radiation(self):
+        """
+
+        Cloudy runs and map files of the parameter files, or maps read
+        and tables written when wrapping the output of CIAOLoop
+
+        """
+        from .radiation.parfiles import ParameterFiles
+        from .radiation.cloudy_cache import CloudyCache, read_loop_values
+
+        section = self.c['RADIATION']
+        elements = section.get('elements', '').split()
+
+        def nions(element):
+            return SYMBOLS.index(element) + 2 if element in SYMBOLS else 0
+
+        if section.get('sedfile', ''):
+            self.lines.append('SED file of one redshift')
+            self.stage('SED', 1, 0)
+
+        elif section.get('cloudypath', ''):
+            resolution = section.get('resolution', '') or 'LOW'
+            # a dry run does not create the cache directory
+            path = section.get('cache', '')
+            cache = CloudyCache(path) if path and os.path.isdir(path) else None
+            if path and cache is None:
+                self.lines.append(f'cache {path} does not exist yet: every grid point is run')
+            parfiles = ParameterFiles(section['cloudypath'], section['run_name'], ' '.join(elements),
+                                      section['redshift'], resolution, cache=cache)
+            nT = parfiles.resolution[0]
+            nhden = len(parfiles.hden_values())
+
+            for kind in ['ib', 'hc']:
+                runs = nhden * len(parfiles.init_values(kind))
+                if cache is not None:
+                    _, missing = parfiles.cached_grid(kind)
+                    todo = len(missing) * len(parfiles.init_values(kind))
+                    self.lines.append(f'{kind}: {runs} grid points, {todo} Cloudy runs ({runs - todo} in the cache)')
+                else:
+                    todo = runs
+                    self.lines.append(f'{kind}: {runs} Cloudy runs ({nhden} hden x {len(parfiles.init_values(kind))} redshift)')
+
+                if kind == 'ib':
+                    self.stage('CIAOLoop ib maps', todo * len(elements),
+                               todo * nT * sum(nions(element) + 1 for element in elements) * TEXT_BYTES)
+                else:
+                    self.stage('CIAOLoop hc maps', todo, todo * nT * 3 * TEXT_BYTES)
+
+        elif section.get('ibpath', '') or section.get('hcpath', ''):
+            path = section.get('ibpath', '') or section.get('hcpath', '')
+            runfile = section['runfile']
+            parameters = read_loop_values(path + runfile)
+            runs = int(np.prod([len(values) for values in parameters]))
+            prefix = runfile[:-4]
+
+            if section.get('ibpath', ''):
+                maps = [f'{path}{prefix}_run{j + 1}_{element}.dat' for j in range(runs) for element in elements]
+            else:
+                maps = [f'{path}{prefix}_run{j + 1}.dat' for j in range(runs)]
+            found = [m for m in maps if os.path.isfile(m)]
+            nbytes = sum(os.path.getsize(m) for m in found)
+
+            self.lines.append(f'{runs} runs in {runfile}, {len(found)} of {len(maps)} map files ({human(nbytes)}) found')
+
+            # the values of the maps as float64, one element at a time for the ion fractions
+            values = nbytes / TEXT_BYTES * 8
+            if section.get('ibpath', ''):
+                self.stage('ion fraction table', 1, values)
+                self.peak = values / max(1, len(elements))
+            else:
+                self.stage('heating & cooling table', 1, nbytes)
+                self.peak = values
+
+        else:
+            raise ValueError('Error: wrong configuration.')
+
+    def header(self, simfile):
+        """
+
+        Shape and bytes per value of a simulation file, from its header
+
+        """
+        reader = VTKSlabReader(simfile)
+        itemsize = max(np.dtype(dtype).itemsize for _, dtype in reader.arrays.values())
+        return reader.shape, itemsize
+
+    def observables_outputs(self, shape, section, prefix=''):
+        """
+
+        Files and bytes of the observables of one simulation file
+
+        """
+        ions = np.atleast_1d(np.genfromtxt(section[prefix + 'ionsfile'], dtype=None))
+        nx, ny, nz = shape
+
+        maps = (nx * nz + ny * nz) * TEXT_BYTES
+        files  = len(ions) * (2 + 3) + 3
+        nbytes = len(ions) * (maps + 3 * SPECTRUM_ROWS * 4 * TEXT_BYTES)
+        if section.get(prefix + 'pv_dv', ''):
+            files += len(ions)
+        if section.get(prefix + 'spectra', '').lower() in ['yes', 'true', '1']:
+            files  += 1
+            nbytes += 3 * len(ions) * 8 * TEXT_BYTES
+
+        if section.get(prefix + 'emission', '').lower() in ['yes', 'true', '1']:
+            # EM, cooling and the columns of the line tables (counted from their headers)
+            names = 1 + bool(section.get(prefix + 'emission_cooling', ''))
+            for filename in section.get(prefix + 'emission_lines', '').split():
+                with open(filename) as f:
+                    names += len(f.readline().split()) - 2
+            files  += 2 * names
+            nbytes += names * maps
+
+        return files, nbytes, len(ions)
+
+    def cuts_outputs(self, shape, section, prefix=''):
+        """
+
+        Files and bytes of the cuts of one simulation file
+
+        """
+        axis = section.get(prefix + 'cut_axis', '') or 'z'
+        positions  = section.get(prefix + 'cut_positions', '').split() or [None]
+        quantities = section.get(prefix + 'cut_fields', '').split() or ['n', 'v']
+
+        plane = int(np.prod(shape)) // shape['xyz'.index(axis)]
+        if positions == [None]:
+            plane = shape[0] * shape[1]
+
+        files = len(positions) * len(quantities)
+        return files, files * plane * TEXT_BYTES
+
+    def plan_observables(self):
+        """
+
+        Outputs and memory of the observables of one simulation file
+
+        """
+        section = self.c['OBSERVABLES']
+        simfile = section['obs_simpath'] + 'data.' + section['obs_simnum'] + '.vtk'
+
+        shape, itemsize = self.header(simfile)
+        fields = 6 * int(np.prod(shape)) * itemsize
+        self.lines.append(f'{simfile}: {shape[0]} x {shape[1]} x {shape[2]} cells, {human(fields)} of fields')
+
+        files, nbytes, _ = self.observables_outputs(shape, section, 'obs_')
+        self.stage('observables', files, nbytes)
+
+        # fields as loaded and as float64 yt fields of the projections
+        self.peak = fields + 6 * int(np.prod(shape)) * 8
+        self.units = 1
+        self.files = 1
+
+    def plan_series(self):
+        """
+
+        Outputs, memory and units of the analysis of a series (mode 3 and 4)
+
+        """
+        if self.mode == 3:
+            section, prefix = self.c['CLOUDS'], 'cl_'
+            simpath = section['cl_simpath']
+        else:
+            section, prefix = self.c['ANALYSIS'], ''
+            simpath = section['simpath']
+
+        sim_files = [simpath + 'data.{:04d}.vtk'.format(i) for i in range(81)]
+        found = [simfile for simfile in sim_files if os.path.isfile(simfile)]
+        if not found:
+            raise ValueError(f'Error: no simulation files in {simpath}')
+
+        shape, itemsize = self.header(found[0])
+        ncells = int(np.prod(shape))
+        fields = 6 * ncells * itemsize
+        self.lines.append(f'{len(found)} of {len(sim_files)} simulation files found, '
+                          f'{shape[0]} x {shape[1]} x {shape[2]} cells, {human(fields)} of fields each, '
+                          f'{human(sum(os.path.getsize(simfile) for simfile in found))} in total')
+
+        level = int(section.get(prefix + 'level', '') or 1)
+        grid = level_shape(shape, level)
+        if level > 1:
+            self.lines.append(f'level {level}: analysis on {grid[0]} x {grid[1]} x {grid[2]} cells')
+
+        max_memory = section.get(prefix + 'max_memory', '') if self.mode == 3 else ''
+        max_memory = int(float(max_memory) * 2**20) if max_memory else None
+        domain_ranks = int(section.get('domain_ranks', '') or 1) if self.mode == 4 else 1
+
+        products = bool(section.get(prefix + 'products', ''))
+
+        # clouds: fields (or a slab of them) and the float64 work arrays of the fused pass
+        if max_memory:
+            clouds_peak = max_memory + max_memory // (6 * 4) * 8 * 8
+        else:
+            clouds_peak = fields // domain_ranks + int(np.prod(grid)) // domain_ranks * 8 * 8
+
+        files, nbytes = self.cuts_outputs(grid, section, prefix)
+        if section.get(prefix + 'clump_tr1', '') or section.get(prefix + 'clump_rho', ''):
+            files += 1
+        if section.get(prefix + 'budget', '').lower() in ['yes', 'true', '1']:
+            files += 1
+        self.stage('clouds (cuts, clumps, budget)', 0 if products else len(sim_files) * files,
+                   len(sim_files) * (nbytes if not products else nbytes / TEXT_BYTES * itemsize))
+
+        series_files = 1
+        if section.get(prefix + 'phase', '').lower() in ['yes', 'true', '1']:
+            series_files += 1
+        units = len(sim_files)
+        self.peak = clouds_peak
+
+        if self.mode == 4:
+            files, nbytes, nions = self.observables_outputs(grid, section)
+            self.stage('observables (maps, spectra, rays)', 0 if products else len(sim_files) * files,
+                       len(sim_files) * (nbytes if not products else nbytes / TEXT_BYTES * 8))
+            series_files += 2
+            units += len(sim_files)
+
+            # fields as loaded and as float64 yt fields of the projections
+            self.peak = max(clouds_peak, fields // domain_ranks + 6 * int(np.prod(grid)) * 8 // domain_ranks)
+
+        if products:
+            series_files += 1
+        # 16 columns of 21 characters per line of the diagnostics
+        self.stage('series (diagnostics, statistics, phase, products)', series_files, len(sim_files) * 16 * 21)
+
+        self.units = units
+        self.files = len(sim_files)
+        self.domain_ranks = domain_ranks
+
+    def calibrate(self):
+        """
+
+        Wall time per simulation file and peak memory of the sample run
+
+        :return: (wall per file, peak memory, {stage: wall per call}), None without calibration
+
+        """
+        if self.calibration is None:
+            return None
+
+        records = [record for record in self.calibration['records'] if record['snapshot'] is not None]
+        if not records:
+            raise ValueError('Error: no simulation file stages in the profile report')
+
+        # stages are not nested, so the stages of a file add up to its time
+        walls = {}
+        for record in records:
+            walls[record['snapshot']] = walls.get(record['snapshot'], 0.0) + record['wall']
+
+        per_stage = {name: s['wall'] / s['calls'] for name, s in self.calibration['summary'].items()}
+        peak = max(record['peak_rss'] for record in records)
+
+        return float(np.mean(list(walls.values()))), peak, per_stage
+
+    def report(self):
+        """
+
+        Lines of the report
+
+        """
+        lines = list(self.lines)
+
+        lines.append('')
+        lines.append('{:<52s} {:>8s} {:>12s}'.format('stage', 'files', 'bytes'))
+        for name, files, nbytes in self.stages:
+            lines.append('{:<52s} {:>8d} {:>12s}'.format(name, files, human(nbytes)))
+        lines.append('{:<52s} {:>8d} {:>12s}'.format('total', sum(s[1] for s in self.stages), human(sum(s[2] for s in self.stages))))
+        lines.append('')
+
+        calibration = self.calibrate()
+        peak = self.peak
+        if calibration is not None:
+            wall, peak, per_stage = calibration
+            for name, t in sorted(per_stage.items()):
+                lines.append(f'{name}: {t:.3g} s per call in the sample run')
+
+        if peak is not None:
+            source = 'measured in the sample run' if calibration is not None else 'estimated from the array sizes'
+            lines.append(f'peak memory per rank: {human(peak)} ({source})')
+
+        if self.units is not None:
+            memory = node_memory()
+            fit = max(1, int(0.8 * memory // peak)) if peak else self.units
+            fit = min(fit, os.cpu_count())
+
+            if self.mode == 4 and self.domain_ranks > 1:
+                groups = min(self.files, max(1, fit // self.domain_ranks))
+                ranks  = groups * self.domain_ranks
+                lines.append(f'{self.units} units in groups of {self.domain_ranks} ranks')
+            else:
+                # rank 0 of the mpi backend schedules the units
+                ranks = min(self.units, fit) + 1
+                lines.append(f'{self.units} units, at most {self.units + 1} useful ranks')
+
+            lines.append(f'{fit} ranks fit in the memory and cores of this node ({human(memory)}, {os.cpu_count()} cores)')
+            lines.append(f'recommended ranks per node: {ranks}')
+
+            if calibration is not None:
+                workers = max(1, ranks - 1) if self.domain_ranks == 1 else ranks // self.domain_ranks
+                total = wall * self.files
+                lines.append(f'{wall:.3g} s per simulation file: {total / 3600:.3g} core hours, '
+                             f'{total / workers / 3600:.3g} h on {ranks} ranks')
+
+        return lines
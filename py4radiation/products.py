@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import shutil
+import socket
+
+import numpy as np
+
+class ProductStore():
+    """
+
+    Per-snapshot products of an analysis run (cuts, column density
+    and emission maps, spectra) stored in one HDF5 file instead of
+    one text file each
+
+    Every process writes the products of its units to its own part
+    file ({root}_parts/{host}.{pid}.h5, dataset {simnum}/{product});
+    join, on the root process when every unit is done, writes the
+    HDF5 file with one virtual dataset per product indexed by
+    snapshot, mapping the datasets of the parts
+    Parts are kept so that a resumed run adds to them
+
+    A product is named after the text file it replaces, relative to
+    the working directory and without the snapshot number, e.g.
+    ./clouds/0012_ncut.dat is clouds/ncut of snapshot 0012
+
+    :filename: string
+
+        Path to the HDF5 file
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.parts = os.path.splitext(filename)[0] + '_parts'
+
+    def part(self):
+        """
+
+        Part file of this process
+
+        """
+        return os.path.join(self.parts, f'{socket.gethostname()}.{os.getpid()}.h5')
+
+    @staticmethod
+    def key(filename):
+        """
+
+        Snapshot number and product name of an output file,
+        None for files that do not belong to a snapshot
+
+        """
+        path = os.path.relpath(os.path.dirname(filename) or '.')
+        name = os.path.splitext(os.path.basename(filename))[0]
+
+        simnum, sep, name = name.partition('_')
+        if not sep or not simnum.isdigit() or path.startswith('..'):
+            return None
+
+        return simnum, name if path == '.' else path + '/' + name
+
+    def add(self, filename, arr):
+        """
+
+        Store the product of an output file in the part of this process
+        The part is closed after every product so that it is complete
+        when a unit returns, also in pool processes
+
+        """
+        import h5py
+
+        simnum, product = self.key(filename)
+        os.makedirs(self.parts, exist_ok=True)
+
+        with h5py.File(self.part(), 'a') as f:
+            name = simnum + '/' + product
+            if name in f:
+                del f[name]
+            f.create_dataset(name, data=np.asarray(arr))
+
+    def clear(self):
+        """
+
+        Remove the parts of a previous run
+
+        """
+        if os.path.isdir(self.parts):
+            shutil.rmtree(self.parts)
+
+    def index(self):
+        """
+
+        Datasets of the parts as {product: {simnum: (part, shape, dtype)}},
+        the most recently written part first for a repeated snapshot
+
+        """
+        import h5py
+
+        parts = sorted(glob.glob(os.path.join(self.parts, '*.h5')), key=os.path.getmtime)
+
+        index = {}
+        for part in parts:
+            with h5py.File(part, 'r') as f:
+                def visit(name, obj):
+                    if isinstance(obj, h5py.Dataset):
+                        simnum, product = name.split('/', 1)
+                        index.setdefault(product, {})[simnum] = (part, obj.shape, obj.dtype)
+                f.visititems(visit)
+
+        return index
+
+    def join(self):
+        """
+
+        Write the HDF5 file of the products from the parts
+
+        Products with the same shape and type in every snapshot are
+        virtual datasets (snapshot, ...) with the snapshot numbers in
+        their snapshots attribute; other products are groups of
+        external links, one per snapshot
+
+        """
+        import h5py
+
+        index  = self.index()
+        folder = os.path.dirname(os.path.abspath(self.filename))
+
+        tmp = f'{self.filename}.tmp{os.getpid()}'
+        with h5py.File(tmp, 'w') as f:
+            simnums = sorted({simnum for datasets in index.values() for simnum in datasets})
+            f.create_dataset('snapshots', data=np.array(simnums, dtype='S'))
+
+            for product, datasets in sorted(index.items()):
+                order = sorted(datasets)
+                shapes = {(shape, dtype) for _, shape, dtype in datasets.values()}
+
+                if len(shapes) == 1:
+                    shape, dtype = shapes.pop()
+                    layout = h5py.VirtualLayout(shape=(len(order),) + shape, dtype=dtype)
+                    for i, simnum in enumerate(order):
+                        part = os.path.relpath(datasets[simnum][0], folder)
+                        layout[i] = h5py.VirtualSource(part, simnum + '/' + product, shape=shape)
+                    f.create_virtual_dataset(product, layout)
+                else:
+                    group = f.create_group(product)
+                    for simnum in order:
+                        group[simnum] = h5py.ExternalLink(os.path.relpath(datasets[simnum][0], folder), simnum + '/' + product)
+
+                f[product].attrs['snapshots'] = np.array(order, dtype='S')
+
+        os.replace(tmp, self.filename)
+
+class Products():
+    """
+
+    Reader of the products of a run written by ProductStore
+
+    :filename: string
+
+        Path to the HDF5 file
+
+    """
+
+    def __init__(self, filename):
+        import h5py
+
+        self.filename = filename
+        # virtual and external sources are found relative to the file
+        self.file = h5py.File(filename, 'r')
+        self.snapshots = [simnum.decode() for simnum in self.file['snapshots'][()]]
+
+        self.names = []
+        self.file.visititems(lambda name, obj: self.names.append(name) if 'snapshots' in obj.attrs else None)
+
+    def products(self, simnum=None):
+        """
+
+        Names of the products, of every snapshot or of one snapshot
+
+        """
+        if simnum is None:
+            return list(self.names)
+        return [name for name in self.names if simnum in self._snapshots(name)]
+
+    def _snapshots(self, name):
+        return [simnum.decode() for simnum in self.file[name].attrs['snapshots']]
+
+    def get(self, simnum, product):
+        """
+
+        Product of a snapshot as a numpy array
+
+        :simnum: string, snapshot number, e.g. '0012'
+
+        :product: string, e.g. 'clouds/ncut' or 'observables/H/H1_coldens_xz'
+
+        """
+        if product not in self.names:
+            raise ValueError(f'Error: no product {product} in {self.filename}')
+
+        snapshots = self._snapshots(product)
+        if simnum not in snapshots:
+            raise ValueError(f'Error: no snapshot {simnum} of {product} in {self.filename}')
+
+        obj = self.file[product]
+        if hasattr(obj, 'keys'):
+            return obj[simnum][()]
+        return obj[snapshots.index(simnum)]
+
+    def snapshot(self, simnum):
+        """
+
+        Every product of a snapshot as {product: numpy array}
+
+        """
+        return {name: self.get(simnum, name) for name in self.products(simnum)}
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+def block_sum(arr, factor):
+    """
+
+    Sums over blocks of factor^3 cells (trailing cells that do not
+    fill a block are left out)
+
+    """
+    nx, ny, nz = (n // factor for n in arr.shape)
+    arr = arr[:nx * factor, :ny * factor, :nz * factor]
+    return arr.reshape(nx, factor, ny, factor, nz, factor).sum(axis=(1, 3, 5), dtype=np.float64)
+
+def downsample(fields, factor):
+    """
+
+    Mass-conserving block average of the fields by factor in each axis
+
+    Density and pressure are volume averages, the tracer and the
+    velocities are mass-weighted averages, so that the mass, cloud
+    mass and momentum of every block are those of its cells
+
+    :fields: list, [rho, tr1, prs, vx1, vx2, vx3] arrays
+
+    :factor: int, block size
+
+    :return: downsampled fields (float64)
+
+    """
+    if factor == 1:
+        return fields
+
+    rho, tr1, prs, vx1, vx2, vx3 = fields
+    nblock = factor**3
+
+    mass = block_sum(rho, factor)
+    inv  = np.divide(1, mass, out=np.zeros_like(mass), where=mass > 0)
+
+    out = [mass / nblock, block_sum(rho * tr1, factor) * inv, block_sum(prs, factor) / nblock]
+    out += [block_sum(rho * v, factor) * inv for v in [vx1, vx2, vx3]]
+
+    return [np.asfortranarray(f) for f in out]
+
+def level_shape(shape, factor):
+    """
+
+    Dimensions of the computational box at a downsampling factor
+
+    """
+    return tuple(n // factor for n in shape)
+
+class Pyramid():
+    """
+
+    Downsampled copies of the fields of a simulation file for
+    quick-look analysis (see downsample)
+
+    Every level is built from the previous one, which gives the same
+    result as downsampling the full resolution fields directly
+
+    :fields: list
+
+        Scalar/vector fields of a simulation file
+
+    :factors: list, optional
+
+        Downsampling factors, each a multiple of the previous one
+
+    """
+
+    def __init__(self, fields, factors=(2, 4, 8)):
+        self.levels = {1: fields}
+
+        previous = 1
+        for factor in factors:
+            if factor % previous:
+                raise ValueError(f'Error: pyramid factor {factor} is not a multiple of {previous}')
+            self.levels[factor] = downsample(self.levels[previous], factor // previous)
+            previous = factor
+
+    def __getitem__(self, factor):
+        return self.levels[factor]
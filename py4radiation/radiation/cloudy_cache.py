@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+class CloudyCache():
+    """
+
+    Content-addressed store of the Cloudy map files of single grid
+    points, shared by CIAOLoop runs over overlapping grids
+
+    A map is stored under the hash of everything that determines it
+    (see ParameterFiles.point_key); the least recently used maps are
+    removed when the store grows beyond max_bytes, except the pinned
+    maps of a grid being assembled (see pin)
+
+    :path: string
+
+        Directory of the store
+
+    :max_bytes: int, optional
+
+        Size cap of the store in bytes (default: no cap)
+
+    """
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.pinned = set()
+
+        os.makedirs(path, exist_ok=True)
+        self.size = sum(os.path.getsize(entry) for entry in self.entries())
+
+    @staticmethod
+    def key(*params):
+        """
+
+        Key of a grid point from its parameters
+
+        """
+        return hashlib.sha1(repr(params).encode()).hexdigest()
+
+    @staticmethod
+    def file_hash(filename):
+        """
+
+        Hash of the content of a file (e.g. the SED .out file)
+
+        """
+        digest = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key + '.dat')
+
+    def entries(self):
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if name.endswith('.dat'):
+                    yield os.path.join(root, name)
+
+    def get(self, key):
+        """
+
+        Path of the map of a grid point, None if not stored
+        Marks the map as recently used
+
+        """
+        filename = self.filename(key)
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            return None
+        return filename
+
+    def __contains__(self, key):
+        return os.path.isfile(self.filename(key))
+
+    def put(self, key, mapfile):
+        """
+
+        Store a copy of the map file of a grid point
+
+        """
+        filename = self.filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        previous = os.path.getsize(filename) if os.path.isfile(filename) else 0
+
+        tmp = f'{filename}.tmp{os.getpid()}'
+        shutil.copyfile(mapfile, tmp)
+        os.replace(tmp, filename)
+
+        self.size += os.path.getsize(filename) - previous
+        self.evict(keep=filename)
+
+    def pin(self, keys):
+        """
+
+        Keep the maps of keys from eviction until unpin (e.g. every
+        point of a grid, while a run is stored and the tables are
+        assembled), so that the store may exceed max_bytes meanwhile
+
+        """
+        self.pinned.update(self.filename(key) for key in keys)
+
+    def unpin(self):
+        """
+
+        Release the pinned maps and evict down to max_bytes
+
+        """
+        self.pinned = set()
+        self.evict()
+
+    def evict(self, keep=None):
+        """
+
+        Remove the least recently used maps until the store fits in
+        max_bytes, leaving out keep and the pinned maps
+
+        """
+        if self.max_bytes is None or self.size <= self.max_bytes:
+            return
+
+        entries = sorted((os.path.getmtime(entry), entry) for entry in self.entries() if entry != keep and entry not in self.pinned)
+        for _, entry in entries:
+            if self.size <= self.max_bytes:
+                break
+            self.size -= os.path.getsize(entry)
+            os.remove(entry)
+
+class CloudyGrid():
+    """
+
+    Complete grid of a cached CIAOLoop calculation, written by
+    ParameterFiles next to the parameter file and read to assemble
+    the tables from the cache (see IonTables, HeatingCoolingRates)
+
+    Runs are ordered with hden as the outer loop, as in CIAOLoop
+
+    :parameters: dict, loop parameter name -> list of values
+
+    :keys: list, cache key of every run (a dict element -> key for
+           ion fractions, a single key for heating & cooling)
+
+    """
+
+    def __init__(self, parameters, keys):
+        self.parameters = parameters
+        self.keys = keys
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'parameters': self.parameters, 'keys': self.keys}, f)
+
+    @classmethod
+    def read(cls, filename):
+        with open(filename) as f:
+            state = json.load(f)
+        return cls(state['parameters'], state['keys'])
+
+    def shape(self):
+        return [len(values) for values in self.parameters.values()]
+
+    def all_keys(self):
+        """
+
+        Cache keys of every map of the grid
+
+        """
+        return [key for keys in self.keys for key in (keys.values() if isinstance(keys, dict) else [keys])]
+
+    def values(self):
+        """
+
+        Values of every loop parameter as floats (as in the .run file)
+
+        """
+        return [[float(value) for value in values] for values in self.parameters.values()]
+
+    def run(self, values):
+        """
+
+        Index of the run with the given values of the loop parameters
+
+        """
+        if len(values) < len(self.parameters):
+            # loops of a single value may not be listed in the .run file
+            values = list(values) + [grid[0] for grid in self.values()[len(values):] if len(grid) == 1]
+
+        idx = []
+        for value, grid in zip(values, self.values()):
+            match = np.flatnonzero(np.isclose(grid, value, rtol=1e-6, atol=1e-9))
+            if not len(match):
+                raise ValueError(f'Error: run with {values} is not in the grid')
+            idx.append(match[0])
+        return int(np.ravel_multi_index(idx, self.shape()))
+
+    def ingest(self, cache, path, runfile, mapfile):
+        """
+
+        Store the maps of a (partial) CIAOLoop run in the cache
+
+        :cache: CloudyCache
+
+        :path: string, output folder of the run
+
+        :runfile: string, .run file of the run
+
+        :mapfile: callable, mapfile(prefix, j, key) -> file name of the
+                  map of the j-th run (1-based) for an entry of keys
+
+        :return: number of maps stored
+
+        """
+        parameters = read_loop_values(path + runfile)
+        runs = list(np.ndindex(*[len(values) for values in parameters]))
+
+        prefix = runfile[:-4]
+        stored = 0
+        for j, idx in enumerate(runs):
+            keys = self.keys[self.run([parameters[i][k] for i, k in enumerate(idx)])]
+            for name, key in (keys.items() if isinstance(keys, dict) else [(None, keys)]):
+                filename = path + mapfile(prefix, j + 1, name)
+                if os.path.isfile(filename):
+                    cache.put(key, filename)
+                    stored += 1
+
+        return stored
+
+def read_loop_values(runfile):
+    """
+
+    Values of the loop parameters of a CIAOLoop .run file
+
+    """
+    with open(runfile) as f:
+        lines = [line.strip() for line in f]
+
+    parameter_values = []
+    get_parameter_values = False
+    for line in lines:
+        if get_parameter_values:
+            if line == '#':
+                break
+            parameter_values.append([float(value) for value in line.split(': ', 1)[1].split()])
+        elif line.startswith('# Loop commands and values'):
+            get_parameter_values = True
+
+    return parameter_values
@@ -1,20 +1,40 @@
 #!/usr/bin/env python3
 
+import os
 import numpy as np
 
+from ..instrument import stage
+from .cloudy_cache import CloudyGrid
+
 class HeatingCoolingRates():
     """
 
     Get PLUTO-readable heating and cooling rates
 
+    :cache: CloudyCache, optional
+
+        Store of grid point maps: the maps of the run are stored in it
+        and the rates are assembled from it over the complete grid
+
+    :grid: string, optional
+
+        Complete grid written by ParameterFiles with the cache
+        ({run_name}_hc_grid.json), needed with cache
+
     """
 
-    def __init__(self, path, runfile, outfile):
+    def __init__(self, path, runfile, outfile, cache=None, grid=None):
         self.path = path
         self.pathfile = path + runfile
         self.runfile = runfile
         self.outfile = outfile
+        self.cache = cache
+        self.grid = CloudyGrid.read(grid) if grid else None
 
+        if cache is not None and self.grid is None:
+            raise ValueError('Error: the cache needs the grid file written by ParameterFiles')
+
+    @stage('HeatingCoolingRates.get_hc_rates')
     def get_hc_rates(self):
         """
 
@@ -30,24 +50,42 @@ class HeatingCoolingRates():
         
         prefix = self.runfile[:-4]
 
-        with open(self.pathfile) as f:
-            lines = [line.strip() for line in f]
+        if self.cache is not None:
+            # maps of the grid are kept in the cache until they are read (see below)
+            self.cache.pin(self.grid.all_keys())
 
-        run_index = next((i for i, line in enumerate(lines) if line.startswith('#run')), None)
-        if run_index == None:
-            raise ValueError('Error: missing run marker (#run) in run file')
-        
-        n_runs = len(lines) - run_index - 1
+            # maps of the points computed in this run go to the cache first
+            if os.path.isfile(self.pathfile):
+                stored = self.grid.ingest(self.cache, self.path, self.runfile, lambda prefix, j, _: f'{prefix}_run{j}.dat')
+                print(f'{stored} maps of {self.runfile} stored in the cache')
+
+            hden = np.array(self.grid.values()[0])
+            maps = [self.cache.get(key) for key in self.grid.keys]
+            if None in maps:
+                raise ValueError(f'Error: grid point {maps.index(None) + 1} is neither in the cache nor in {self.runfile}')
+        else:
+            with open(self.pathfile) as f:
+                lines = [line.strip() for line in f]
+
+            run_index = next((i for i, line in enumerate(lines) if line.startswith('#run')), None)
+            if run_index == None:
+                raise ValueError('Error: missing run marker (#run) in run file')
+
+            n_runs = len(lines) - run_index - 1
 
-        hden = np.linspace(-9, 4, n_runs)
+            hden = np.linspace(-9, 4, n_runs)
+            maps = [f"{self.path}{prefix}_run{j+1}.dat" for j in range(n_runs)]
 
         output_lines = ['HDEN[cm^-3]  TEMPERATURE[K]  HEATING[erg_cm^3_s^-1]  COOLING[erg_cm^3_s^-1]']
 
-        for j in range(n_runs):
-            map_j = f"{self.path}{prefix}_run{j+1}.dat"
-            nvals, Tvals, hvals, cvals = self.loadmaps(map_j, hden, j)
-            for n, T, h, c in zip(nvals, Tvals, hvals, cvals):
-                output_lines.append('{0:.7E}  {1:.7E}  {2:.7E}  {3:.7E}'.format(10**n, T, h, c))
+        try:
+            for j, map_j in enumerate(maps):
+                nvals, Tvals, hvals, cvals = self.loadmaps(map_j, hden, j)
+                for n, T, h, c in zip(nvals, Tvals, hvals, cvals):
+                    output_lines.append('{0:.7E}  {1:.7E}  {2:.7E}  {3:.7E}'.format(10**n, T, h, c))
+        finally:
+            if self.cache is not None:
+                self.cache.unpin()
 
         with open(self.outfile, 'w') as fw:
             fw.write('\n'.join(output_lines))
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 
-import h5py
+import os
 import numpy as np
 
+from ..instrument import stage
+from ..writer import get_writer
+from .cloudy_cache import CloudyGrid
+
 class IonTables():
     """
 
@@ -23,16 +27,32 @@ class IonTables():
 
         Elements for ion fractions
 
+    :cache: CloudyCache, optional
+
+        Store of grid point maps: the maps of the run are stored in it
+        and the table is assembled from it over the complete grid
+
+    :grid: string, optional
+
+        Complete grid written by ParameterFiles with the cache
+        ({run_name}_ib_grid.json), needed with cache
+
     """
 
-    def __init__(self, path, runfile, outfile, elements):
+    def __init__(self, path, runfile, outfile, elements, cache=None, grid=None):
         self.path = path
         self.pathfile = path + runfile
         self.runfile = runfile
         self.outfile = outfile
         self.elements = elements
+        self.cache = cache
+        self.grid = CloudyGrid.read(grid) if grid else None
+
+        if cache is not None and self.grid is None:
+            raise ValueError('Error: the cache needs the grid file written by ParameterFiles')
 
 
+    @stage('IonTables._getdata')
     def _getdata(self, element):
         """
         
@@ -42,6 +62,9 @@ class IonTables():
 
         print(f"Converting {element} from {self.runfile} to {self.outfile}")
 
+        if self.cache is not None:
+            return self._getcached(element)
+
         if not self.runfile.endswith('.run'):
             raise ValueError('Error: run file needs to end in .run')
         
@@ -81,11 +104,42 @@ class IonTables():
             idxs = np.unravel_index(j, grid_shape)
             self.loadmaps(map_j, grid_shape, idxs, grid_data)
 
+        self._submit(element, grid_data, parameter_values)
+
+    def _getcached(self, element):
+        """
+
+        Ion fractions of an element over the complete grid from the cache
+
+        """
+        grid_shape = self.grid.shape()
+
+        grid_data = []
+        for j, keys in enumerate(self.grid.keys):
+            map_j = self.cache.get(keys[element])
+            if map_j is None:
+                raise ValueError(f'Error: grid point {j + 1} of {element} is neither in the cache nor in {self.runfile}')
+            self.loadmaps(map_j, grid_shape, np.unravel_index(j, grid_shape), grid_data)
+
+        self._submit(element, grid_data, self.grid.values())
+
+    def _submit(self, element, grid_data, parameter_values):
         temperature = grid_data.pop(0)
         ion_data    = grid_data.pop(0)
 
         ion_data = np.rollaxis(ion_data, -1)
 
+        # elements are appended to the same file in order by the writer thread
+        get_writer().submit(self.write_element, element, ion_data, temperature, parameter_values)
+
+    def write_element(self, element, ion_data, temperature, parameter_values):
+        """
+
+        Append the ion fractions of an element to the hdf5 file
+
+        """
+        import h5py
+
         with h5py.File(self.outfile, 'a') as output:
             ds = output.create_dataset(element, data=ion_data, dtype=np.float64)
             ds.attrs['Temperature'] = np.array(temperature, dtype=np.float64)
@@ -119,5 +173,22 @@ class IonTables():
         """
         """
 
-        for element in self.elements:
-            self._getdata(element)
\ No newline at end of file
+        # maps of the grid are kept in the cache until the tables are assembled
+        if self.cache is not None:
+            self.cache.pin(self.grid.all_keys())
+
+        try:
+            # maps of the points computed in this run go to the cache first
+            if self.cache is not None and os.path.isfile(self.pathfile):
+                stored = self.grid.ingest(self.cache, self.path, self.runfile,
+                                          lambda prefix, j, element: f'{prefix}_run{j}_{element}.dat')
+                print(f'{stored} maps of {self.runfile} stored in the cache')
+
+            for element in self.elements:
+                self._getdata(element)
+        finally:
+            if self.cache is not None:
+                self.cache.unpin()
+
+        # the table is complete when this returns
+        get_writer().flush()
\ No newline at end of file
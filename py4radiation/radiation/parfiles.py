@@ -2,6 +2,9 @@
 
 import os
 import sys
+import numpy as np
+
+from .cloudy_cache import CloudyGrid
 
 class ParameterFiles():
     """
@@ -33,9 +36,18 @@ class ParameterFiles():
         LOW: 81 log T points, 27 log hden points
         HIGH: 321 log T points, 105 log hden points
 
+    :cache: CloudyCache, optional
+
+        Store of the maps of previous runs: only the hden values with
+        a grid point missing from the store are written to the
+        parameter files, and the complete grid is written to
+        {run_name}_ib_grid.json / {run_name}_hc_grid.json to assemble
+        the tables (see IonTables, HeatingCoolingRates); the SED files
+        of the init loop must exist (see sed_hash)
+
     """
 
-    def __init__(self, cloudypath, run_name, elements, z, resolution='LOW'):
+    def __init__(self, cloudypath, run_name, elements, z, resolution='LOW', cache=None):
 
         self.cloudypath = cloudypath
         self.run_name   = run_name
@@ -54,6 +66,112 @@ class ParameterFiles():
 
         self.resolution = [T_res, hden_res]
         self.path = os.getcwd()
+        self.cache = cache
+        self._sed_hashes = {}
+
+    def hden_values(self):
+        """
+
+        Values of the hden loop (-9;4;resolution)
+
+        """
+        step = self.resolution[1]
+        return ['{:g}'.format(h) for h in np.arange(-9, 4 + step / 2, step)]
+
+    def init_values(self, kind):
+        """
+
+        Values of the init (redshift) loop of the ion fractions (ib)
+        or heating & cooling (hc) parameter file
+
+        """
+        return [self.z, '0.0001e+00'] if kind == 'ib' else [self.z]
+
+    def commands(self, kind):
+        """
+
+        Cloudy commands and map settings shared by every grid point
+        of the ion fractions (ib) or heating & cooling (hc) parameter file
+
+        """
+        commands = ['stop zone 1', 'iterate to convergence', 1e1, 1e9, self.resolution[0]]
+        if kind == 'ib':
+            return tuple(['cloudyRunMode 3'] + commands)
+        return tuple(['cloudyRunMode 1', 'coolingScaleFactor 1'] + commands)
+
+    def sed_hash(self, init):
+        """
+
+        Hash of the SED file of a value of the init loop,
+        {run_name}_z{init}.out in the working directory
+
+        Every SED file the loop refers to must be in place before the
+        parameter files are written with a cache: the one of the
+        redshift (see SED.getFile) and, for the ion fractions, the
+        one of the second init value 0.0001e+00, which CIAOLoop reads
+        as well, as the maps depend on them
+
+        """
+        if init not in self._sed_hashes:
+            sedfile = self.path + '/' + self.run_name + '_z' + init + '.out'
+            if not os.path.isfile(sedfile):
+                raise ValueError(f'Error: SED file {sedfile} of the init loop not found, needed for the cache keys of the maps')
+            self._sed_hashes[init] = self.cache.file_hash(sedfile)
+
+        return self._sed_hashes[init]
+
+    def point_key(self, kind, init, hden, element=None):
+        """
+
+        Cache key of the map of a grid point: hash of the SED file of
+        the init value, the init value, hden, the commands and the element
+
+        """
+        return self.cache.key(kind, self.sed_hash(init), float(init), float(hden), self.commands(kind), element)
+
+    def cached_grid(self, kind):
+        """
+
+        Complete grid of a parameter file with the cache keys of its
+        points, and the hden values with a point missing from the cache
+
+        """
+        hden  = self.hden_values()
+        inits = self.init_values(kind)
+
+        keys = []
+        missing = []
+        for h in hden:
+            for init in inits:
+                if kind == 'ib':
+                    keys.append({element: self.point_key(kind, init, h, element) for element in self.elements.split()})
+                    point = keys[-1].values()
+                else:
+                    keys.append(self.point_key(kind, init, h))
+                    point = [keys[-1]]
+
+                if any(key not in self.cache for key in point) and h not in missing:
+                    missing.append(h)
+
+        return CloudyGrid({'hden': hden, 'init': inits}, keys), missing
+
+    def hden_loop(self, kind):
+        """
+
+        hden loop line of a parameter file, None when every grid point is cached
+
+        """
+        if self.cache is None:
+            return 'loop [hden] (-9;4;' + str(self.resolution[1]) + ')'
+
+        grid, missing = self.cached_grid(kind)
+        grid.write(self.run_name + f'_{kind}_grid.json')
+
+        print(f'{len(self.hden_values()) - len(missing)} of {len(self.hden_values())} hden values of {kind} found in the cache')
+        if not missing:
+            return None
+
+        return 'loop [hden] ' + ' '.join(missing)
 
     def getIonFractions(self):
         """
@@ -63,6 +181,10 @@ class ParameterFiles():
         """
         file = self.run_name + '_ib.par'
 
+        hden_loop = self.hden_loop('ib')
+        if hden_loop is None:
+            return
+
         stdout = sys.stdout
         with open(file, 'w') as f:
             sys.stdout = f
@@ -119,7 +241,7 @@ class ParameterFiles():
             print()
             print('command iterate to convergence')
             print()
-            print('loop [hden] (-9;4;' + str(self.resolution[1]) + ')')
+            print(hden_loop)
             print()
             print('loop [init "' + self.path + '/' + self.run_name + '_z*.out"] ' + self.z + ' 0.0001e+00')
 
@@ -134,6 +256,10 @@ class ParameterFiles():
 
         file = self.run_name + '_hc.par'
 
+        hden_loop = self.hden_loop('hc')
+        if hden_loop is None:
+            return
+
         stdout = sys.stdout
         with open(file, 'w') as f:
             sys.stdout = f
@@ -192,7 +318,7 @@ class ParameterFiles():
             print()
             print('command iterate to convergence')
             print()
-            print('loop [hden] (-9;4;' + str(self.resolution[1]) + ')')
+            print(hden_loop)
             print()
             print('loop [init "' + self.path + '/' + self.run_name + '_z*.out"] ' + self.z)
             
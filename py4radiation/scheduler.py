@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+class TaskScheduler():
+    """
+
+    Dynamic master/worker scheduling of analysis units over MPI
+
+    Rank 0 hands out units one at a time to the workers that ask for
+    work and receives every result as soon as it is done, so ranks stay
+    busy however much the cost of the units varies
+    With a single rank the units are run in order on that rank
+
+    :comm: MPI communicator
+
+    """
+
+    READY  = 1
+    RESULT = 2
+    WORK   = 3
+
+    def __init__(self, comm):
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+
+    def run(self, units, func, callback=None):
+        """
+
+        Run func on every unit
+
+        :units: list
+
+            Units of work, only used on rank 0
+
+        :func: callable
+
+            Function run on the workers for each unit, func(unit)
+            Its result must be picklable
+
+        :callback: callable, optional
+
+            Called on rank 0 as callback(unit, result) as results arrive
+
+        """
+        if self.size == 1:
+            for unit in units:
+                result = func(unit)
+                if callback is not None:
+                    callback(unit, result)
+            return
+
+        if self.rank == 0:
+            self._master(units, callback)
+        else:
+            self._worker(func)
+
+    def _master(self, units, callback):
+        from mpi4py import MPI
+
+        queue   = list(units)
+        workers = self.size - 1
+        status  = MPI.Status()
+
+        while workers > 0:
+            msg = self.comm.recv(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status)
+            source = status.Get_source()
+
+            if status.Get_tag() == self.RESULT:
+                unit, result = msg
+                if callback is not None:
+                    callback(unit, result)
+
+            if queue:
+                self.comm.send(queue.pop(0), dest=source, tag=self.WORK)
+            else:
+                self.comm.send(None, dest=source, tag=self.WORK)
+                workers -= 1
+
+    def _worker(self, func):
+        self.comm.send(None, dest=0, tag=self.READY)
+
+        while True:
+            unit = self.comm.recv(source=0, tag=self.WORK)
+            if unit is None:
+                break
+
+            self.comm.send((unit, func(unit)), dest=0, tag=self.RESULT)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+# Blocks attached by this process, by name; kept open for the life of the
+# process as Trident's table store holds views into them
+_attached = {}
+
+class NodeArrays():
+    """
+
+    Read-only arrays shared by the MPI ranks of a node through
+    MPI-3 shared memory windows
+
+    Every array is loaded by one rank per node and mapped zero-copy
+    by the others; share is collective over the ranks of comm
+
+    :comm: MPI communicator
+
+    """
+
+    def __init__(self, comm):
+        from mpi4py import MPI
+
+        self.node   = comm.Split_type(MPI.COMM_TYPE_SHARED)
+        self.leader = self.node.Get_rank() == 0
+
+        self.arrays  = {}
+        self.windows = []
+
+    def share(self, key, loader):
+        """
+
+        Share an array across the node
+
+        :key: string, name of the array
+
+        :loader: callable, returns the array (called on one rank per node)
+
+        :return: read-only view of the shared array
+
+        """
+        from mpi4py import MPI
+
+        if self.leader:
+            arr  = np.ascontiguousarray(loader())
+            meta = (arr.shape, arr.dtype.str)
+        else:
+            meta = None
+
+        shape, dtype = self.node.bcast(meta, root=0)
+        itemsize = np.dtype(dtype).itemsize
+        nbytes   = int(np.prod(shape)) * itemsize if self.leader else 0
+
+        win = MPI.Win.Allocate_shared(nbytes, itemsize, comm=self.node)
+        buf, _ = win.Shared_query(0)
+        view = np.ndarray(shape, dtype=dtype, buffer=buf)
+
+        if self.leader:
+            view[...] = arr
+        self.node.Barrier()
+
+        view.flags.writeable = False
+        self.arrays[key] = view
+        self.windows.append(win)
+
+        return view
+
+    def get(self, key):
+        return self.arrays[key]
+
+    def close(self):
+        """
+
+        Free the shared windows (collective)
+
+        """
+        self.arrays = {}
+        for win in self.windows:
+            win.Free()
+        self.windows = []
+
+class ProcessArrays():
+    """
+
+    Read-only arrays shared with the worker processes of a pool
+    through multiprocessing.shared_memory
+
+    Arrays are loaded in the process that creates them; workers get
+    this object pickled (names only) and attach on first use;
+    only the creating process releases the blocks
+
+    """
+
+    def __init__(self):
+        self.specs  = {}
+        self.arrays = {}
+        self.blocks = []
+        self.owner  = True
+
+    def __getstate__(self):
+        return {'specs': self.specs}
+
+    def __setstate__(self, state):
+        self.specs  = state['specs']
+        self.arrays = {}
+        self.blocks = []
+        self.owner  = False
+
+    def share(self, key, loader):
+        """
+
+        Share an array with the workers
+
+        :key: string, name of the array
+
+        :loader: callable, returns the array
+
+        :return: read-only view of the shared array
+
+        """
+        from multiprocessing import shared_memory
+
+        arr = np.ascontiguousarray(loader())
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+
+        view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+        view[...] = arr
+        view.flags.writeable = False
+
+        self.specs[key]  = (shm.name, arr.shape, arr.dtype.str)
+        self.arrays[key] = view
+        self.blocks.append(shm)
+
+        return view
+
+    def get(self, key):
+        if key not in self.arrays:
+            self.arrays[key] = self._attach(*self.specs[key])
+        return self.arrays[key]
+
+    def _attach(self, name, shape, dtype):
+        from multiprocessing import shared_memory
+
+        if name in _attached:
+            return _attached[name][1]
+
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 registers attached blocks too, with the resource
+            # tracker that pool workers share with the creating process
+            shm = shared_memory.SharedMemory(name=name)
+
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        view.flags.writeable = False
+
+        _attached[name] = (shm, view)
+        return view
+
+    def close(self):
+        """
+
+        Release the blocks, removing them in the process that created them
+
+        """
+        self.arrays = {}
+        for shm in self.blocks:
+            shm.close()
+            if self.owner:
+                shm.unlink()
+        self.blocks = []
+
+def zero_out():
+    """
+
+    log10 of the ion fraction below which Trident zeroes fractions,
+    and the log10 value it sets them to before interpolating
+
+    """
+    try:
+        from trident.ion_balance import fraction_zero_point, zero_out_value
+    except ImportError:
+        fraction_zero_point, zero_out_value = 1e-9, -30
+    return np.log10(fraction_zero_point), zero_out_value
+
+def share_ion_tables(shared, table, elements):
+    """
+
+    Load the ion fractions of the elements from an ion table (see
+    IonTables) into shared memory; log fractions below the zero
+    point of Trident are set to its zero out value, as Trident does
+    when it loads the table itself
+
+    :shared: NodeArrays or ProcessArrays
+
+    :table: string, path to the hdf5 ion fractions file
+
+    :elements: list, element symbols
+
+    """
+    def dataset(element, name=None):
+        def load():
+            import h5py
+            with h5py.File(table, 'r') as f:
+                if name is None:
+                    fractions = f[element][()]
+                    zero_point, zero_out_value = zero_out()
+                    fractions[fractions < zero_point] = zero_out_value
+                    return fractions
+                return np.array(f[element].attrs[name])
+        return load
+
+    for element in elements:
+        fractions = shared.share(f'{element}', dataset(element))
+        for par in range(1, fractions.ndim - 1):
+            shared.share(f'{element}/Parameter{par}', dataset(element, f'Parameter{par}'))
+        shared.share(f'{element}/Temperature', dataset(element, 'Temperature'))
+
+def use_ion_tables(shared, ions):
+    """
+
+    Point Trident at the shared ion fractions instead of loading
+    the table in this process
+
+    Trident keeps the table of an ion fraction field in its table
+    store under the field name (e.g. O_p5_ion_fraction for O VI), as
+    {'fraction': ion fractions, 'parameters': [grid parameters]}
+    Entries already in the store are left untouched, and nothing is
+    done for Trident versions without a table store
+
+    :shared: NodeArrays or ProcessArrays (see share_ion_tables)
+
+    :ions: numpy array, set of ions for analysis
+
+    """
+    try:
+        from trident import ion_balance
+        store = ion_balance.table_store
+    except (ImportError, AttributeError):
+        return
+
+    parameters = {}
+    for row in ions:
+        element, ion = row[0], int(row[1])
+        field = f'{element}_p{ion - 1}_ion_fraction'
+        if field in store:
+            continue
+
+        fractions = shared.get(element)
+        if element not in parameters:
+            # one list of grid parameters per element, as in Trident
+            parameters[element] = [shared.get(f'{element}/Parameter{par}') for par in range(1, fractions.ndim - 1)]
+            parameters[element].append(shared.get(f'{element}/Temperature'))
+
+        store[field] = {'fraction': fractions[ion - 1], 'parameters': parameters[element]}
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
-import vtk
 import numpy as np
 
+from .instrument import stage
+
+@stage('simload')
 def simload(filename):
     """
 
@@ -16,6 +18,8 @@ def simload(filename):
 
     """
 
+    import vtk
+
     reader = vtk.vtkDataSetReader()
     reader.SetFileName(filename)
     reader.ReadAllScalarsOn()
@@ -31,3 +35,146 @@ def simload(filename):
     fields    = [np.array(cell_data.GetArray(name)).reshape(shape, order='F') for name in var_names]
 
     return fields, shape
+
+
+class VTKSlabReader():
+    """
+
+    Memory-mapped reader of z-slabs of a legacy binary VTK simulation
+    file (PLUTO output), for snapshots larger than the available memory
+
+    Only the header is parsed on creation, field values are read
+    from disk slab by slab
+
+    **Parameters**
+
+    :filename: string, path to simulation file
+
+    """
+
+    var_names = ['rho', 'tr1', 'prs', 'vx1', 'vx2', 'vx3']
+
+    # legacy VTK binary data is big-endian
+    dtypes = {'char': '>i1', 'unsigned_char': '>u1', 'short': '>i2', 'unsigned_short': '>u2',
+              'int': '>i4', 'unsigned_int': '>u4', 'long': '>i8', 'unsigned_long': '>u8',
+              'float': '>f4', 'double': '>f8'}
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.arrays = {}
+
+        dims   = None
+        ncells = None
+
+        def size(dtype):
+            return np.dtype(self.dtypes[dtype]).itemsize
+
+        def nextline(f):
+            # header lines, skipping the line breaks after binary blocks
+            line = b'\n'
+            while line and not line.strip():
+                line = f.readline()
+            return line.decode('ascii', errors='replace').split()
+
+        with open(filename, 'rb') as f:
+            f.readline()
+            f.readline()
+            if f.readline().strip().upper() != b'BINARY':
+                raise ValueError(f'Error: {filename} is not a binary VTK file')
+
+            while True:
+                words = nextline(f)
+                if not words:
+                    break
+
+                key = words[0].upper()
+                if key == 'DIMENSIONS':
+                    dims = [int(d) for d in words[1:4]]
+                elif key in ['X_COORDINATES', 'Y_COORDINATES', 'Z_COORDINATES']:
+                    f.seek(int(words[1]) * size(words[2]), 1)
+                elif key == 'POINTS':
+                    f.seek(3 * int(words[1]) * size(words[2]), 1)
+                elif key == 'CELL_DATA':
+                    ncells = int(words[1])
+                elif key == 'POINT_DATA':
+                    ncells = None
+                    npoints = int(words[1])
+                elif key == 'FIELD':
+                    for _ in range(int(words[2])):
+                        name, ncomp, ntuples, dtype = nextline(f)
+                        f.seek(int(ncomp) * int(ntuples) * size(dtype), 1)
+                elif key in ['SCALARS', 'VECTORS']:
+                    ncomp = 3 if key == 'VECTORS' else (int(words[3]) if len(words) > 3 else 1)
+                    if key == 'SCALARS':
+                        nextline(f)
+                    if ncells is not None and ncomp == 1:
+                        self.arrays[words[1]] = (f.tell(), self.dtypes[words[2]])
+                    f.seek((ncells if ncells is not None else npoints) * ncomp * size(words[2]), 1)
+
+        if dims is None:
+            raise ValueError(f'Error: missing DIMENSIONS in {filename}')
+
+        self.shape = tuple(d - 1 for d in dims)
+
+        missing = [name for name in self.var_names if name not in self.arrays]
+        if missing:
+            raise ValueError(f'Error: missing cell fields {missing} in {filename}')
+
+    def field(self, name):
+        """
+
+        Memory-mapped view of a cell field with shape (nx, ny, nz)
+
+        :name: string, name of the field
+
+        """
+        offset, dtype = self.arrays[name]
+        nx, ny, nz = self.shape
+
+        mm = np.memmap(self.filename, dtype=dtype, mode='r', offset=offset, shape=(nz, ny, nx))
+        return mm.T
+
+    def slab(self, k0, k1):
+        """
+
+        Read the fields of the z planes k0 to k1 (excluded)
+
+        :return: scalar/vector fields of the slab
+
+        """
+        return self.planes(2, k0, k1)
+
+    def planes(self, axis, i0, i1):
+        """
+
+        Read the fields of the planes i0 to i1 (excluded) normal to
+        an axis (0, 1, 2 for x, y, z)
+
+        :return: scalar/vector fields of the planes
+
+        """
+        index = [slice(None)] * 3
+        index[axis] = slice(i0, i1)
+
+        fields = [self.field(name)[tuple(index)] for name in self.var_names]
+        return [np.array(f, dtype=f.dtype.newbyteorder('='), order='F') for f in fields]
+
+    def slabs(self, max_memory, multiple=1):
+        """
+
+        Iterate over the file in z-slabs
+
+        :max_memory: int, memory bound for the fields of a slab in bytes
+
+        :multiple: int, optional, the slab thickness is a multiple of this
+                   (e.g. a downsampling factor)
+
+        :return: (k0, fields) for each slab
+
+        """
+        nx, ny, nz = self.shape
+        dk = max(1, int(max_memory // (nx * ny * 4 * len(self.var_names))))
+        dk = max(multiple, dk - dk % multiple)
+
+        for k0 in range(0, nz, dk):
+            yield k0, self.slab(k0, min(k0 + dk, nz))
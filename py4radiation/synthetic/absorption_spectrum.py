@@ -1,10 +1,12 @@
 #/usr/bin/env python3
 
 import os
-import trident
 
 import numpy as np
 
+from ..instrument import stage
+from ..writer import get_writer, get_products, write_table
+
 class MockSpectra():
     """
 
@@ -49,6 +51,10 @@ class MockSpectra():
 
         self.obs_path = elements_paths
 
+        # (ray, ion label) -> (velocity, tau, flux) of the spectra made so far
+        self.spectra = {}
+
+    @stage('MockSpectra.raymaker')
     def raymaker(self, ray_name, start, end):
         """
 
@@ -68,6 +74,8 @@ class MockSpectra():
         
         """
 
+        import trident
+
         ray = trident.make_simple_ray(self.ds,
                                 start_position = start,
                                 end_position = end,
@@ -79,6 +87,7 @@ class MockSpectra():
         print(f'Ray {ray_name} created')
         return ray
         
+    @stage('MockSpectra.getSpectrum')
     def getSpectrum(self, ray, ray_name):
         """
 
@@ -96,9 +105,16 @@ class MockSpectra():
 
         """
 
+        import trident
+
         for i, ion in enumerate(self.ions):
             fname = f"{self.obs_path[i]}{self.simnum}_{self.ionlabels[i]}_ray{ray_name}.dat"
             spec = trident.SpectrumGenerator(lambda_min=-500, lambda_max=0, dlambda=1, bin_space='velocity')
             spec.make_spectrum(ray, lines=[ion])
-            spec.save_spectrum(fname)
+            self.spectra[(ray_name, self.ionlabels[i])] = (np.array(spec.lambda_field), np.array(spec.tau_field), np.array(spec.flux_field))
+            if get_products() is not None:
+                # columns of the text file: wavelength (velocity), tau, flux
+                get_writer().write(fname, write_table, np.column_stack([spec.lambda_field, spec.tau_field, spec.flux_field]))
+            else:
+                get_writer().write(fname, spec.save_spectrum)
             print(f'{ion} DONE for ray {ray_name}')
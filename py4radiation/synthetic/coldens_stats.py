@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import copy
+import numpy as np
+
+class ColumnDensityStats():
+    """
+
+    Online statistics of column density maps across a series
+    of simulation files, fed by ColumnDensity as maps are produced
+
+    Memory is fixed: one log N histogram per ion and view for the whole
+    series plus one summary row per map (percentiles and covering fractions)
+
+    :ionlabels: list
+
+        Ion labels in the same order as in ColumnDensity (e.g. OVI)
+
+    :thresholds: list, optional
+
+        log10 N [cm^-2] thresholds for covering fractions
+
+    :logN_range: tuple, optional
+
+        Limits of the log10 N histogram bins
+
+    :nbins: int, optional
+
+        Number of log10 N histogram bins
+
+    :percentiles: list, optional
+
+        Percentiles of log10 N reported for every map
+
+    """
+
+    views = ['xz', 'yz']
+
+    def __init__(self, ionlabels, thresholds=(12, 13, 14, 15), logN_range=(8, 24), nbins=160, percentiles=(16, 50, 84)):
+        self.ionlabels   = list(ionlabels)
+        self.thresholds  = np.array(thresholds, dtype=float)
+        self.percentiles = np.array(percentiles, dtype=float)
+        self.edges = np.linspace(logN_range[0], logN_range[1], nbins + 1)
+
+        # bin 0 collects log N below the range (and empty pixels), bin nbins + 1 above it
+        self.hist = np.zeros((len(self.views), len(self.ionlabels), nbins + 2), dtype=np.int64)
+        self.rows = []
+
+    def add(self, simnum, ion, view, arr):
+        """
+
+        Add a column density map to the statistics
+
+        :simnum: string
+
+            Number of the simulation file
+
+        :ion: string
+
+            Ion label
+
+        :view: string, xz or yz
+
+            Projection of the map
+
+        :arr: numpy array
+
+            Column density map in cm^-2
+
+        """
+        arr = np.asarray(arr, dtype=np.float64).ravel()
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            logN = np.log10(arr)
+        logN[~np.isfinite(logN)] = -np.inf
+
+        idx = np.searchsorted(self.edges, logN, side='right')
+        h = np.bincount(idx, minlength=len(self.edges) + 1)
+
+        self.hist[self.views.index(view), self.ionlabels.index(ion)] += h
+
+        covering = [np.count_nonzero(logN >= t) / arr.size for t in self.thresholds]
+        self.rows.append((int(simnum), ion, view, self.hist_percentiles(h), covering))
+
+    def hist_percentiles(self, h):
+        """
+
+        Percentiles of log10 N from a histogram, interpolating within bins
+
+        :h: numpy array
+
+            Histogram counts including the under/overflow bins
+
+        """
+        cdf = np.cumsum(h) / max(np.sum(h), 1)
+        q   = self.percentiles / 100
+
+        # cdf at the bin edges, underflow goes to the lower edge and overflow to the upper one
+        p = np.interp(q, cdf[:-1], self.edges)
+        p[q <= cdf[0]] = -np.inf
+
+        return p
+
+    def update(self, other):
+        """
+
+        Add the statistics of another ColumnDensityStats with the same
+        ions and bins (e.g. computed by another process)
+
+        """
+        self.hist += other.hist
+        self.rows += other.rows
+
+    def todict(self):
+        """
+
+        JSON-serialisable histograms and rows (e.g. for a run manifest)
+
+        """
+        rows = [(simnum, ion, view, list(pct), list(fc)) for simnum, ion, view, pct, fc in self.rows]
+        return {'hist': self.hist.tolist(), 'rows': rows}
+
+    def fromdict(self, state):
+        """
+
+        Statistics from the output of todict, with the ions and bins of this object
+
+        """
+        stats = copy.copy(self)
+        stats.hist = np.array(state['hist'], dtype=np.int64)
+        stats.rows = [(simnum, ion, view, np.array(pct), fc) for simnum, ion, view, pct, fc in state['rows']]
+        return stats
+
+    def merge(self, comm):
+        """
+
+        Merge the statistics of all MPI ranks into rank 0
+
+        :comm: MPI communicator
+
+        """
+        from mpi4py import MPI
+
+        hist = np.zeros_like(self.hist) if comm.Get_rank() == 0 else None
+        comm.Reduce(self.hist, hist, op=MPI.SUM, root=0)
+
+        rows = comm.gather(self.rows, root=0)
+        if comm.Get_rank() == 0:
+            self.hist = hist
+            self.rows = [row for sublist in rows for row in sublist]
+
+    def write(self, filename):
+        """
+
+        Write the time series of percentiles and covering fractions
+        and the series log N histograms
+
+        :filename: string
+
+            Output file for the time series
+            The histograms are written to the same name ending in _pdf.dat
+
+        """
+        header = ['snap', 'ion', 'view']
+        header += [f'logN_p{p:g}' for p in self.percentiles]
+        header += [f'fc_{t:g}' for t in self.thresholds]
+
+        output_lines = [' '.join(header)]
+        for simnum, ion, view, pct, fc in sorted(self.rows, key=lambda x: (x[0], self.ionlabels.index(x[1]), x[2])):
+            values = ' '.join('{0:.7e}'.format(v) for v in list(pct) + list(fc))
+            output_lines.append(f'{simnum:04d} {ion} {view} {values}')
+
+        with open(filename, 'w') as f:
+            f.write('\n'.join(output_lines))
+
+        centres = 0.5 * (self.edges[1:] + self.edges[:-1])
+        columns = [f'{ion}_{view}' for view in self.views for ion in self.ionlabels]
+
+        pdf_lines = ['logN ' + ' '.join(columns)]
+        pdf_lines.append('below ' + ' '.join(str(c) for c in self.hist[:, :, 0].ravel()))
+        for b, centre in enumerate(centres, start=1):
+            pdf_lines.append('{0:.4f} '.format(centre) + ' '.join(str(c) for c in self.hist[:, :, b].ravel()))
+        pdf_lines.append('above ' + ' '.join(str(c) for c in self.hist[:, :, -1].ravel()))
+
+        pdffile = filename.rsplit('.', 1)[0] + '_pdf.dat'
+        with open(pdffile, 'w') as f:
+            f.write('\n'.join(pdf_lines))
@@ -3,6 +3,9 @@
 import os
 import numpy as np
 
+from ..instrument import stage
+from ..writer import get_writer, write_table
+
 class ColumnDensity():
     """
     
@@ -22,10 +25,15 @@ class ColumnDensity():
         Ions chosen for analysis
         They must be consistent with the ion fractions file for Trident
 
+    :stats: ColumnDensityStats, optional
+
+        Online statistics fed with every map as it is produced
+
     """
 
-    def __init__(self, simnum, ds, shape, ions):
+    def __init__(self, simnum, ds, shape, ions, stats=None):
         self.simnum = simnum
+        self.stats = stats
         self.ds = ds
         self.shape = shape
         elements = ions[:, 0]
@@ -54,34 +62,165 @@ class ColumnDensity():
         self.obs_path = elements_paths
 
 
-    def projYZ(self):
+    def project(self, axis):
         """
 
-        Get the YZ (transverse) column density map
+        Get the column density maps of all ions projected along an axis
+
+        :axis: string, x or y
+
+        :return: list of numpy arrays
 
         """
-        for i, ion in enumerate(self.ions):
-            proj = self.ds.proj(ion + '_number_density', 'x')
+        shape = (self.shape[1], self.shape[2]) if axis == 'x' else (self.shape[0], self.shape[2])
+
+        maps = []
+        for ion in self.ions:
+            proj = self.ds.proj(ion + '_number_density', axis)
             arr  = np.array(proj[(ion + '_number_density')])
-            arr  = np.reshape(arr, (self.shape[1], self.shape[2]))
+            maps.append(np.reshape(arr, shape))
+
+        return maps
+
+    def write_maps(self, maps, view):
+        """
 
-            fig_arr = '\n'.join(['\t'.join(map(str, row)) for row in arr])
-            file_yz = self.obs_path[i] + self.simnum + '_' + self.ionlabels[i] + '_coldens_yz.dat'
-            with open(file_yz, 'w') as file:
-                file.write(fig_arr)
+        Write column density maps of all ions and feed the statistics
 
+        :maps: list of numpy arrays
+
+            Column density maps in the order of the ions
+
+        :view: string, xz or yz
+
+        """
+        for i, arr in enumerate(maps):
+            if self.stats is not None:
+                self.stats.add(self.simnum, self.ionlabels[i], view, arr)
+
+            file_map = self.obs_path[i] + self.simnum + '_' + self.ionlabels[i] + '_coldens_' + view + '.dat'
+            get_writer().write(file_map, write_table, arr)
+
+    @stage('ColumnDensity.projYZ')
+    def projYZ(self):
+        """
+
+        Get the YZ (transverse) column density map
+
+        """
+        self.write_maps(self.project('x'), 'yz')
+
+    @stage('ColumnDensity.projXZ')
     def projXZ(self):
         """
 
         Get the XZ (down-the-barrel) column density map
 
         """
+        self.write_maps(self.project('y'), 'xz')
+
+    def iterPV(self, vmin=-500, vmax=500, dv=10):
+        """
+
+        Get position-velocity column density cubes for the XZ
+        (down-the-barrel, line-of-sight velocity vy) and YZ
+        (transverse, line-of-sight velocity vx) views
+
+        Column densities are binned per pixel in velocity channels
+        in a single weighted bincount over the ion density cube,
+        cells outside [vmin, vmax) are left out
+
+        :vmin: float
+
+            Lower limit of the velocity channels in km/s
+
+        :vmax: float
+
+            Upper limit of the velocity channels in km/s
+
+        :dv: float
+
+            Width of the velocity channels in km/s
+
+        :return: (i, {'xz': cube, 'yz': cube}) for each ion
+
+        """
+        ds = self.ds
+        grid = ds.covering_grid(level=0, left_edge=ds.domain_left_edge, dims=ds.domain_dimensions)
+        dl = (ds.domain_width / ds.domain_dimensions).in_units('cm').d
+
+        nx, ny, nz = self.shape
+        edges = self.pv_edges(vmin, vmax, dv)
+        nchan = len(edges) - 1
+
+        def channels(vel, npix, pix):
+            chan = np.searchsorted(edges, vel, side='right') - 1
+            keep = (chan >= 0) & (chan < nchan)
+            idx  = (pix * nchan + chan)[keep]
+            return idx, keep, npix * nchan
+
+        vy = grid[('gas', 'velocity_y')].in_units('km/s').d
+        ix = np.arange(nx).reshape(-1, 1, 1)
+        iz = np.arange(nz).reshape(1, 1, -1)
+        views = {'xz': channels(vy, nx * nz, ix * nz + iz) + ((nx, nz, nchan), dl[1])}
+        del vy
+
+        vx = grid[('gas', 'velocity_x')].in_units('km/s').d
+        iy = np.arange(ny).reshape(1, -1, 1)
+        views['yz'] = channels(vx, ny * nz, iy * nz + iz) + ((ny, nz, nchan), dl[0])
+        del vx
+
         for i, ion in enumerate(self.ions):
-            proj = self.ds.proj(ion + '_number_density', 'y')
-            arr  = np.array(proj[(ion + '_number_density')])
-            arr  = np.reshape(arr, (self.shape[0], self.shape[2]))
+            nion = grid[('gas', ion + '_number_density')].in_units('cm**-3').d
+
+            cubes = {}
+            for view, (idx, keep, size, cube_shape, dlos) in views.items():
+                cube = np.bincount(idx, weights=nion[keep] * dlos, minlength=size)
+                cubes[view] = cube.reshape(cube_shape)
+
+            yield i, cubes
+
+    @staticmethod
+    def pv_edges(vmin, vmax, dv):
+        """
+
+        Edges of the velocity channels in km/s
+
+        """
+        return np.arange(vmin, vmax + 0.5 * dv, dv, dtype=np.float64)
 
-            fig_arr = '\n'.join(['\t'.join(map(str, row)) for row in arr])
-            file_xz = self.obs_path[i] + self.simnum + '_' + self.ionlabels[i] + '_coldens_xz.dat'
-            with open(file_xz, 'w') as file:
-                file.write(fig_arr)
+    def write_pv(self, i, cubes, edges):
+        """
+
+        Write the position-velocity cubes of an ion to HDF5
+
+        :i: int, index of the ion
+
+        :cubes: dict, cubes for the xz and yz views
+
+        :edges: numpy array, edges of the velocity channels
+
+        """
+        file_pv = self.obs_path[i] + self.simnum + '_' + self.ionlabels[i] + '_pv.h5'
+        get_writer().write(file_pv, self.write_pv_file, cubes, edges)
+
+    @staticmethod
+    def write_pv_file(filename, cubes, edges):
+        import h5py
+
+        with h5py.File(filename, 'w') as output:
+            for view, cube in cubes.items():
+                output.create_dataset(view, data=cube, dtype=np.float64)
+
+            output.attrs['velocity_edges'] = edges
+
+    def projPV(self, vmin=-500, vmax=500, dv=10):
+        """
+
+        Get the position-velocity column density cubes of all ions
+        (see iterPV)
+
+        """
+        edges = self.pv_edges(vmin, vmax, dv)
+        for i, cubes in self.iterPV(vmin, vmax, dv):
+            self.write_pv(i, cubes, edges)
@@ -0,0 +1,201 @@
+#/usr/bin/env python3
+
+import os
+import numpy as np
+
+from ..instrument import stage
+from ..writer import get_writer, write_table
+
+class RateTable():
+    """
+
+    Rates tabulated on a grid of density and temperature, in the
+    format written by HeatingCoolingRates: a header line and columns
+    HDEN[cm^-3] TEMPERATURE[K] followed by one column per rate
+    in erg cm^3 s^-1 (e.g. HEATING COOLING, or line emissivities)
+
+    Rates are interpolated bilinearly in log n_H and log T, and
+    clipped to the edges of the table outside of it; grid indices
+    are computed arithmetically on uniform log grids (as written by
+    HeatingCoolingRates) and searched otherwise
+
+    :filename: string
+
+        Path to the table
+
+    :columns: list, optional
+
+        Names of the rate columns to use (default: all of them)
+
+    """
+
+    def __init__(self, filename, columns=None):
+        with open(filename) as f:
+            header = [name.split('[')[0] for name in f.readline().split()]
+
+        data = np.loadtxt(filename, skiprows=1, ndmin=2)
+        data = data[np.lexsort((data[:, 1], data[:, 0]))]
+
+        self.logn = np.log10(np.unique(data[:, 0]))
+        self.logT = np.log10(np.unique(data[:, 1]))
+        if len(self.logn) * len(self.logT) != len(data):
+            raise ValueError(f'Error: {filename} is not a regular grid of density and temperature')
+
+        if columns is None:
+            columns = header[2:]
+        for name in columns:
+            if name not in header[2:]:
+                raise ValueError(f'Error: no column {name} in {filename}')
+
+        self.filename = filename
+        self.columns  = list(columns)
+        self.rates = np.stack([data[:, header.index(name)].reshape(len(self.logn), len(self.logT)) for name in columns])
+
+    @staticmethod
+    def weights(axis, values):
+        """
+
+        Lower grid index and interpolation weight of values along an axis
+
+        """
+        step = np.diff(axis)
+        if np.allclose(step, step[0], rtol=1e-4):
+            x = (values - axis[0]) / step[0]
+            np.clip(x, 0, len(axis) - 1, out=x)
+            i = np.minimum(x.astype(np.intp), len(axis) - 2)
+            return i, x - i
+
+        i = np.searchsorted(axis, values, side='right') - 1
+        np.clip(i, 0, len(axis) - 2, out=i)
+
+        f = (values - axis[i]) / (axis[i + 1] - axis[i])
+        np.clip(f, 0, 1, out=f)
+
+        return i, f
+
+    def interpolate(self, logn, logT):
+        """
+
+        Rates at the given log n_H and log T
+
+        :return: numpy array, one row per column of the table
+
+        """
+        i, f = self.weights(self.logn, logn)
+        j, g = self.weights(self.logT, logT)
+
+        # flat index of the lower corner, shared by every column
+        nT = len(self.logT)
+        k  = i * nT + j
+
+        out = np.empty((len(self.columns),) + np.shape(logn))
+        for c, rate in enumerate(self.rates.reshape(len(self.columns), -1)):
+            lower = rate.take(k)
+            lower += g * (rate.take(k + 1) - lower)
+            upper = rate.take(k + nT)
+            upper += g * (rate.take(k + nT + 1) - upper)
+            out[c] = lower + f * (upper - lower)
+
+        return out
+
+class EmissionMaps():
+    """
+
+    Projected emission of a simulation file along x and y (yz and xz
+    views, as ColumnDensity), computed with numpy on the uniform grid
+    of the fields instead of through yt
+
+    Maps are the hydrogen emission measure EM = sum n_H^2 dl [cm^-5]
+    and sum n_H^2 rate(n_H, T) dl [erg s^-1 cm^-2] for every column of
+    the rate tables (e.g. COOLING of the HeatingCoolingRates file),
+    with the hydrogen density n_H = X rho / m_H: Cloudy rates are
+    normalised by n_H^2 (coolingScaleFactor 1) on a grid of hydrogen
+    density (HDEN)
+    Both views are summed in one pass over z-slabs of the fields
+
+    :simnum: string
+
+        Number of the simulation file to label output files
+
+    :rho, T: numpy arrays
+
+        Density [g cm^-3] and temperature [K] of the cells
+
+    :dl: list
+
+        x and y length of the cells in cm
+
+    :tables: list, optional
+
+        RateTable objects
+
+    :X: float, optional
+
+        Hydrogen mass fraction
+
+    :slab: int, optional
+
+        Number of cells per slab of the pass
+
+    """
+
+    def __init__(self, simnum, rho, T, dl, tables=(), X=0.7, slab=2**18):
+        self.simnum = simnum
+        self.rho = rho
+        self.T   = T
+        self.dl  = dl
+        self.tables = list(tables)
+        self.slab = slab
+
+        self.X  = X
+        self.mH = 1.6735e-24
+
+        self.names = ['EM'] + [name for table in self.tables for name in table.columns]
+
+    @stage('EmissionMaps.project')
+    def project(self):
+        """
+
+        Get the emission maps of both views
+
+        :return: dict, {'xz': maps, 'yz': maps} with maps in the order of names
+
+        """
+        nx, ny, nz = self.rho.shape
+        maps = {'xz': np.zeros((len(self.names), nx, nz)), 'yz': np.zeros((len(self.names), ny, nz))}
+
+        dk = max(1, self.slab // (nx * ny))
+        for k in range(0, nz, dk):
+            rho = np.asarray(self.rho[:, :, k:k + dk], dtype=np.float64)
+            T   = np.asarray(self.T[:, :, k:k + dk], dtype=np.float64)
+
+            nH  = rho * (self.X / self.mH)
+            nH2 = nH * nH
+
+            emissivity = [nH2[np.newaxis]]
+            if self.tables:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    lognH, logT = np.log10(nH), np.log10(T)
+                emissivity += [nH2 * table.interpolate(lognH, logT) for table in self.tables]
+            emissivity = np.concatenate(emissivity)
+
+            maps['yz'][:, :, k:k + dk] = emissivity.sum(axis=1) * self.dl[0]
+            maps['xz'][:, :, k:k + dk] = emissivity.sum(axis=2) * self.dl[1]
+
+        return maps
+
+    def write_maps(self, maps):
+        """
+
+        Write the emission maps of both views
+
+        :maps: dict, output of project
+
+        """
+        path = './observables/emission/'
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        for view, arrs in maps.items():
+            for name, arr in zip(self.names, arrs):
+                get_writer().write(path + self.simnum + '_' + name + '_' + view + '.dat', write_table, arr)
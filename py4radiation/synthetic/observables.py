@@ -2,20 +2,19 @@
 
 import os
 
-import yt
-import trident
-
 import numpy as np
-import pandas as pd
 
+from ..pyramid import Pyramid, downsample, level_shape
 from .absorption_spectrum import MockSpectra
 from .column_density import ColumnDensity
+from .emission import EmissionMaps
+from .spectra import SpectralBatch
 
 class SyntheticObservables():
     """
 
-    Generate synthetic observables (column densities and mock spectra)
-    from a single VTK simulation file
+    Generate synthetic observables (column densities, emission maps
+    and mock spectra) from a single VTK simulation file
 
     :fields: numpy array
 
@@ -37,9 +36,34 @@ class SyntheticObservables():
         [2] velocity
         [3] length
 
+    :bbox: numpy array, optional
+
+        x, y, z limits of the fields in computational units
+        (default: whole box centred in x and z)
+
+    :ionization_table: string, optional
+
+        Path to the ion fractions file for Trident
+        (default: the table configured for Trident)
+
+    :level: int, optional
+
+        Downsampling factor for quick-look observables (see pyramid);
+        fields are given at full resolution (or as a Pyramid) and the
+        box keeps its extent with cells level times larger
+
     """
 
-    def __init__(self, simnum, fields, shape, ions, units):
+    def __init__(self, simnum, fields, shape, ions, units, bbox=None, ionization_table=None, level=1):
+        import yt
+        import trident
+
+        if isinstance(fields, Pyramid):
+            fields = fields[level]
+        else:
+            fields = downsample(fields, level)
+        grid = level_shape(shape, level)
+
         mm = 1.660e-24   # 1 amu
         mu = 6.724418e-1 
         kb = 1.380e-16   # Boltzmann constant in cgs
@@ -51,8 +75,9 @@ class SyntheticObservables():
         vx3 = fields[5] * units[2]
         T   = prs * mu * mm / (rho * kb)
 
-        metal = np.ones((shape[0], shape[1], shape[2]))
-        bbox  = np.array([[-shape[0]/2, shape[0]/2], [0, shape[1]], [-shape[2]/2, shape[2]/2]], dtype=int)
+        metal = np.ones(grid)
+        if bbox is None:
+            bbox = np.array([[-shape[0]/2, shape[0]/2], [0, shape[1]], [-shape[2]/2, shape[2]/2]], dtype=int)
 
         data = {
             ('gas', 'density'): (rho, 'g/cm**3'),
@@ -67,7 +92,7 @@ class SyntheticObservables():
         mass     = units[0] * length**3
         velocity = units[2]
 
-        ds = yt.load_uniform_grid(data, shape,
+        ds = yt.load_uniform_grid(data, grid,
                                   length_unit = (length, 'cm'),
                                   mass_unit = (mass, 'g'),
                                   velocity_unit = (velocity, 'cm/s'),
@@ -76,27 +101,71 @@ class SyntheticObservables():
 
         species = [f'{row[0]} {row[2]}' for row in ions]
         
-        trident.add_ion_fields(ds, ions=species, ftype='gas')
+        trident.add_ion_fields(ds, ions=species, ftype='gas', ionization_table=ionization_table)
+
+        # cell lengths in cm for the emission maps, which work on the fields directly
+        self.rho = rho
+        self.T   = T
+        self.dl  = [length * (bbox[i][1] - bbox[i][0]) / grid[i] for i in range(3)]
 
         self.simnum = simnum
         self.ds    = ds
-        self.shape = shape
+        self.shape = grid
+        self.box_shape = shape
         self.ions  = ions
 
-    def get_column_densities(self):
+    def get_column_densities(self, stats=None):
         """
 
         Get down-the-barrel and transverse column density maps
+
+        :stats: ColumnDensityStats, optional
+
+            Online column density statistics across a series
         
         """
 
-        cols = ColumnDensity(self.simnum, self.ds, self.shape, self.ions)
+        cols = ColumnDensity(self.simnum, self.ds, self.shape, self.ions, stats)
         cols.projXZ()
         cols.projYZ()
 
         print('Column density maps DONE')
 
-    def get_mock_spectra(self, create_rays, raypath, raynum):
+    def get_emission_maps(self, tables=()):
+        """
+
+        Get down-the-barrel and transverse emission measure and
+        emission maps of the rate tables (see EmissionMaps)
+
+        :tables: list, optional
+
+            RateTable objects, e.g. the cooling of HeatingCoolingRates
+
+        """
+
+        emission = EmissionMaps(self.simnum, self.rho, self.T, self.dl, tables)
+        emission.write_maps(emission.project())
+
+        print('Emission maps DONE')
+
+    def get_pv_cubes(self, vmin=-500, vmax=500, dv=10):
+        """
+
+        Get down-the-barrel and transverse position-velocity
+        column density cubes
+
+        :vmin, vmax, dv: float
+
+            Limits and width of the velocity channels in km/s
+
+        """
+
+        cols = ColumnDensity(self.simnum, self.ds, self.shape, self.ions)
+        cols.projPV(vmin, vmax, dv)
+
+        print('Position-velocity cubes DONE')
+
+    def get_mock_spectra(self, create_rays=True, raypath=None, raynum=3):
         """
 
         Get absorption spectra for three default rays
@@ -108,9 +177,9 @@ class SyntheticObservables():
             rays = [os.path.join(raypath, f'ray_{i}.h5') for i in range(1, int(raynum + 1))]
         else:
             rays = []
-            rays.append(spectra.raymaker('1', [0, 0, 0], [0, self.shape[1], 0]))
-            rays.append(spectra.raymaker('2', [8, 0, 0], [8, self.shape[1], 0]))
-            rays.append(spectra.raymaker('3', [16, 0, 0], [16, self.shape[1], 0]))
+            rays.append(spectra.raymaker('1', [0, 0, 0], [0, self.box_shape[1], 0]))
+            rays.append(spectra.raymaker('2', [8, 0, 0], [8, self.box_shape[1], 0]))
+            rays.append(spectra.raymaker('3', [16, 0, 0], [16, self.box_shape[1], 0]))
 
             raynum = 3
 
@@ -118,3 +187,21 @@ class SyntheticObservables():
             spectra.getSpectrum(ray, str(i + 1))
         
         print('Mock absorption spectra DONE')
+
+        return SpectralBatch.from_spectra(self.simnum, spectra.spectra, [str(i + 1) for i in range(len(rays))], spectra.ionlabels)
+
+    def get_spectra_summary(self, processing, batch):
+        """
+
+        Mock observation and measurements of the absorption spectra,
+        written to ./observables/{simnum}_spectra.dat
+
+        :processing: SpectralProcessing
+
+        :batch: SpectralBatch, output of get_mock_spectra
+
+        """
+        _, summary = processing.process(batch)
+        processing.write_summary('./observables/' + self.simnum + '_spectra.dat', batch, summary)
+
+        print('Spectra summary DONE')
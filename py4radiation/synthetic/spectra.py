@@ -0,0 +1,315 @@
+#/usr/bin/env python3
+
+import numpy as np
+
+from ..instrument import stage
+from ..writer import get_writer
+
+# rest wavelength [A] and oscillator strength of the strongest line of
+# common ions (Morton 2003), for apparent optical depth column densities,
+# by ion label as in MockSpectra (element and Roman numeral, e.g. OVI)
+LINES = {
+    'HI':    (1215.670, 0.4164),
+    'CII':   (1334.532, 0.1278),
+    'CIV':   (1548.204, 0.1899),
+    'NV':    (1238.821, 0.1560),
+    'OVI':   (1031.926, 0.1325),
+    'SiIII': (1206.500, 1.6300),
+    'SiIV':  (1393.755, 0.5130),
+    'MgII':  (2796.352, 0.6155),
+}
+
+# m_e c / (pi e^2) in cm^-2 A (km/s)^-1: N = AOD / (f lambda) * int tau dv
+AOD = 3.768e14
+
+# speed of light in km/s
+C_KMS = 2.99792458e5
+
+def read_spectrum(filename):
+    """
+
+    Velocity, tau and flux columns of a spectrum text file (as written
+    by trident or write_table), parsed in one call instead of line by line
+
+    """
+    with open(filename) as f:
+        text = ''.join(line for line in f if not line.startswith('#'))
+
+    values = np.array(text.split(), dtype=np.float64)
+    ncols = len(text.split('\n', 1)[0].split())
+    return values.reshape(-1, ncols)[:, :3].T
+
+class SpectralBatch():
+    """
+
+    Mock absorption spectra of a simulation file on a common velocity
+    grid, as arrays (rays, ions, velocity) processed all at once
+
+    :simnum: string
+
+        Number of the simulation file
+
+    :velocity: numpy array
+
+        Velocity of the pixels in km/s
+
+    :flux, tau: numpy arrays
+
+        Normalised flux and optical depth, (rays, ions, velocity)
+
+    :rays, ions: list
+
+        Names of the rays and labels of the ions (e.g. OVI)
+
+    :error: numpy array, optional
+
+        Flux error of the pixels (after noise)
+
+    """
+
+    def __init__(self, simnum, velocity, flux, tau, rays, ions, error=None):
+        self.simnum = simnum
+        self.velocity = velocity
+        self.flux = flux
+        self.tau  = tau
+        self.rays = list(rays)
+        self.ions = list(ions)
+        self.error = error
+
+    @classmethod
+    def from_spectra(cls, simnum, spectra, rays, ions):
+        """
+
+        Batch of spectra given as {(ray, ion): (velocity, tau, flux)}
+
+        """
+        velocity = spectra[(rays[0], ions[0])][0]
+        flux = np.empty((len(rays), len(ions), len(velocity)))
+        tau  = np.empty_like(flux)
+
+        for i, ray in enumerate(rays):
+            for j, ion in enumerate(ions):
+                v, tau[i, j], flux[i, j] = spectra[(ray, ion)]
+                if len(v) != len(velocity) or not np.allclose(v, velocity):
+                    raise ValueError(f'Error: spectrum of {ion} on ray {ray} is not on the velocity grid of the batch')
+
+        return cls(simnum, np.asarray(velocity, dtype=np.float64), flux, tau, rays, ions)
+
+    @classmethod
+    def load(cls, simnum, ions, raynum=3, products=None):
+        """
+
+        Batch of the spectra of a simulation file written by
+        MockSpectra, from the text files or a products file
+
+        :ions: numpy array, ions of the analysis (rows element, _, ion)
+
+        :raynum: int, number of rays
+
+        :products: Products, optional, reader of a products file
+
+        """
+        rays = [str(i) for i in range(1, raynum + 1)]
+        labels = [f'{row[0]}{row[2]}' for row in ions]
+
+        spectra = {}
+        for row, label in zip(ions, labels):
+            for ray in rays:
+                if products is not None:
+                    spectra[(ray, label)] = products.get(simnum, f'observables/{row[0]}/{label}_ray{ray}').T[:3]
+                else:
+                    spectra[(ray, label)] = read_spectrum(f'./observables/{row[0]}/{simnum}_{label}_ray{ray}.dat')
+
+        return cls.from_spectra(simnum, spectra, rays, labels)
+
+class SpectralProcessing():
+    """
+
+    Turn a batch of mock spectra into mock observations and measure
+    them: convolution with a Gaussian line spread function (FFT along
+    velocity for the whole batch), rebinning, Gaussian noise of a
+    signal-to-noise ratio per pixel, then equivalent widths, apparent
+    optical depth (AOD) column densities and velocity centroids
+
+    :lsf: float, optional
+
+        FWHM of the line spread function in km/s (default: none)
+
+    :snr: float, optional
+
+        Signal-to-noise ratio per pixel of the continuum (default: no noise)
+
+    :rebin: int, optional
+
+        Number of pixels averaged in each output pixel
+
+    :lines: dict, optional
+
+        Ion label -> (rest wavelength [A], oscillator strength) for AOD
+        column densities and equivalent widths in mA (default: LINES)
+
+    :seed: int, optional
+
+        Seed of the noise
+
+    """
+
+    columns = ['ray', 'ion', 'EW[km/s]', 'EW_err[km/s]', 'EW[mA]', 'logN_AOD[cm^-2]', 'saturated', 'v_centroid[km/s]']
+
+    def __init__(self, lsf=None, snr=None, rebin=1, lines=None, seed=0):
+        self.lsf = lsf
+        self.snr = snr
+        self.rebin = int(rebin)
+        self.lines = dict(LINES if lines is None else lines)
+        self.seed = seed
+
+    def spec(self):
+        """
+
+        Parameters of the processing (e.g. for a run manifest)
+
+        """
+        return (self.lsf, self.snr, self.rebin, sorted(self.lines.items()), self.seed)
+
+    def convolve(self, velocity, flux):
+        """
+
+        Convolve spectra with the Gaussian line spread function along
+        the last axis, with the edges extended to avoid wrap-around
+
+        """
+        dv = velocity[1] - velocity[0]
+        sigma = self.lsf / (2 * np.sqrt(2 * np.log(2))) / dv
+
+        nv  = flux.shape[-1]
+        pad = int(np.ceil(4 * sigma)) + 1
+        padded = np.pad(flux, [(0, 0)] * (flux.ndim - 1) + [(pad, pad)], mode='edge')
+
+        # transfer function of the Gaussian, on a power of two length
+        n = 1 << int(np.ceil(np.log2(nv + 2 * pad)))
+        kernel = np.exp(-2 * (np.pi * sigma * np.fft.rfftfreq(n))**2)
+
+        return np.fft.irfft(np.fft.rfft(padded, n) * kernel, n)[..., pad:pad + nv]
+
+    def rebin_spectra(self, velocity, *arrs):
+        """
+
+        Average groups of rebin pixels (the last incomplete group is dropped)
+
+        """
+        nv = len(velocity) // self.rebin * self.rebin
+
+        def average(arr):
+            return arr[..., :nv].reshape(arr.shape[:-1] + (nv // self.rebin, self.rebin)).mean(axis=-1)
+
+        return [average(velocity)] + [average(arr) for arr in arrs]
+
+    def observe(self, batch):
+        """
+
+        Mock observation of a batch: convolved, rebinned and noisy spectra
+
+        :return: SpectralBatch
+
+        """
+        velocity, flux, tau = batch.velocity, batch.flux, batch.tau
+
+        if self.lsf:
+            flux = self.convolve(velocity, flux)
+        if self.rebin > 1:
+            velocity, flux, tau = self.rebin_spectra(velocity, flux, tau)
+
+        error = None
+        if self.snr:
+            # noise of the continuum-normalised flux, reproducible per simulation file
+            rng = np.random.default_rng([self.seed, int(batch.simnum) if str(batch.simnum).isdigit() else 0])
+            flux  = flux + rng.standard_normal(flux.shape) / self.snr
+            error = np.full(flux.shape[-1], 1 / self.snr)
+
+        return SpectralBatch(batch.simnum, velocity, flux, tau, batch.rays, batch.ions, error)
+
+    def measure(self, batch):
+        """
+
+        Equivalent widths, AOD column densities and velocity centroids
+        of every spectrum of a batch
+
+        The apparent optical depth is ln(1 / F), with F floored at the
+        noise level (1 / snr, or 1e-3 without noise); spectra reaching
+        the floor are flagged as saturated and their column density
+        is a lower limit
+
+        :return: dict of (rays, ions) arrays
+
+        """
+        velocity, flux = batch.velocity, batch.flux
+        dv = abs(velocity[1] - velocity[0])
+
+        ew = (1 - flux).sum(axis=-1) * dv
+        if batch.error is not None:
+            ew_err = np.full(ew.shape, np.sqrt(np.sum(batch.error**2)) * dv)
+        else:
+            ew_err = np.zeros(ew.shape)
+
+        floor = 1 / self.snr if self.snr else 1e-3
+        saturated = (flux <= floor).any(axis=-1)
+        tau_a = -np.log(np.maximum(flux, floor))
+        tau_a = np.maximum(tau_a, 0)
+
+        integral = tau_a.sum(axis=-1) * dv
+        with np.errstate(divide='ignore', invalid='ignore'):
+            centroid = (tau_a * velocity).sum(axis=-1) * dv / integral
+
+        rest = np.array([self.lines.get(ion, (np.nan, np.nan)) for ion in batch.ions])
+        wavelength, f = rest[:, 0], rest[:, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            logN = np.log10(AOD / (f * wavelength) * integral)
+
+        return {'EW': ew, 'EW_err': ew_err, 'EW_mA': ew * wavelength / C_KMS * 1e3,
+                'logN': logN, 'saturated': saturated, 'centroid': centroid}
+
+    @stage('SpectralProcessing.process')
+    def process(self, batch):
+        """
+
+        Mock observation and measurements of a batch
+
+        :return: observed SpectralBatch, measurements (see measure)
+
+        """
+        observed = self.observe(batch)
+        return observed, self.measure(observed)
+
+    def write_summary(self, filename, batch, summary):
+        """
+
+        Write the measurements of a batch, one row per ray and ion
+
+        """
+        rows = []
+        for i, ray in enumerate(batch.rays):
+            for j, ion in enumerate(batch.ions):
+                rows.append(f'{ray} {ion} {summary["EW"][i, j]:.6e} {summary["EW_err"][i, j]:.6e} '
+                            f'{summary["EW_mA"][i, j]:.6e} {summary["logN"][i, j]:.6e} '
+                            f'{int(summary["saturated"][i, j])} {summary["centroid"][i, j]:.6e}')
+
+        get_writer().write(filename, write_rows, ' '.join(self.columns), rows)
+
+def write_rows(filename, header, rows):
+    with open(filename, 'w') as f:
+        f.write('\n'.join([header] + rows))
+
+def read_lines(filename):
+    """
+
+    Line data for AOD column densities from a text file with rows
+    ion label (e.g. OVI), rest wavelength [A], oscillator strength
+
+    """
+    lines = {}
+    with open(filename) as f:
+        for line in f:
+            words = line.split()
+            if words and not words[0].startswith('#'):
+                lines[words[0]] = (float(words[1]), float(words[2]))
+    return lines
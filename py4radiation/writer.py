@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+import os
+import queue
+import atexit
+import threading
+
+# Shared writer of this process, created on first use
+_writer = None
+
+# ProductStore taking the tables of the snapshots instead of text files
+_products = None
+
+class AsyncWriter():
+    """
+
+    Background thread writing output files while the computation goes on
+
+    Output sites hand over the data and a function that writes it;
+    the queue is bounded so that a slow filesystem holds back the
+    computation instead of piling up data in memory
+    A failed write is raised in the caller on the next submit or flush
+
+    :maxsize: int, optional
+
+        Number of pending writes before submit blocks
+
+    """
+
+    def __init__(self, maxsize=16):
+        self.queue  = queue.Queue(maxsize)
+        self.errors = []
+        self.pid    = os.getpid()
+
+        self.thread = threading.Thread(target=self._run, name='py4radiation-writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                func, args, kwargs = task
+                func(*args, **kwargs)
+            except BaseException as e:
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        """
+
+        Raise the first error of the writes done so far
+
+        """
+        if self.errors:
+            error = self.errors.pop(0)
+            self.errors = []
+            raise RuntimeError(f'Error: writing output failed: {error}') from error
+
+    def submit(self, func, *args, **kwargs):
+        """
+
+        Queue func(*args, **kwargs), blocking while the queue is full
+        The arguments must not be modified after the call
+
+        """
+        self.check()
+        self.queue.put((func, args, kwargs))
+
+    def write(self, filename, func, *args, **kwargs):
+        """
+
+        Queue func(path, *args, **kwargs) writing to a temporary file
+        renamed to filename when complete, so that a file that exists
+        is never partially written
+
+        Tables (func write_table) of a snapshot go to the product
+        store instead when one is set (see set_products)
+
+        """
+        if _products is not None and func is write_table and _products.key(filename) is not None:
+            self.submit(_products.add, filename, *args)
+        else:
+            self.submit(_atomic, filename, func, *args, **kwargs)
+
+    def flush(self):
+        """
+
+        Wait for all queued writes and raise the first error
+
+        """
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        """
+
+        Flush and stop the writer thread
+
+        """
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+
+def _atomic(filename, func, *args, **kwargs):
+    root, ext = os.path.splitext(filename)
+    tmp = f'{root}.tmp{os.getpid()}{ext}'
+
+    try:
+        func(tmp, *args, **kwargs)
+        os.replace(tmp, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def write_table(filename, arr):
+    """
+
+    Write a 2D array as tab-separated rows (format of cuts and maps)
+
+    """
+    with open(filename, 'w') as f:
+        f.write('\n'.join(['\t'.join(map(str, row)) for row in arr]))
+
+def get_writer():
+    """
+
+    Shared AsyncWriter of this process (a new one in forked processes),
+    flushed when the interpreter exits
+
+    """
+    global _writer
+    if _writer is None or _writer.pid != os.getpid():
+        _writer = AsyncWriter()
+        atexit.register(_writer.close)
+    return _writer
+
+def set_products(store):
+    """
+
+    Store the tables of the snapshots written in this process in a
+    ProductStore (None to write text files again)
+
+    """
+    global _products
+    _products = store
+
+def get_products():
+    return _products
+
+def flush():
+    """
+
+    Wait for the outputs queued in this process, raising the first error
+
+    """
+    if _writer is not None and _writer.pid == os.getpid():
+        _writer.flush()